@@ -7,11 +7,14 @@ import secrets
 import re
 import io
 import base64
+import csv
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from threading import Thread, Lock
+from queue import LifoQueue, Empty, Full
+from contextlib import contextmanager
 from functools import wraps
-from flask import Flask, render_template_string, request, jsonify, send_file, redirect, url_for, session, flash, make_response, g
+from flask import Flask, Response, request, jsonify, send_file, redirect, url_for, session, flash, make_response, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
@@ -19,9 +22,17 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 import bleach
 import uuid
+import click
+from collections import namedtuple
+import invoiceflow_common
+from invoiceflow_common import (
+    CompressionMiddleware, RowSet, FastJSONProvider, SchemaMigrator, BatchWriter,
+    ActivityBatcher, LogRetention, StaticAssets
+)
 
 # ================== تطبيق Flask المتطور مع الحماية ==================
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'invoiceflow_premium_secure_2024_v6')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=6)
 app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only in production
@@ -33,8 +44,45 @@ app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET', 'jwt_invoiceflow_sec
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=2)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
+# إعدادات مجمع الاتصالات: كل عامل gunicorn عملية مستقلة بمجمعها الخاص،
+# لذلك حجم المجمع = عدد الخيوط لكل عامل (الإجمالي = العمال × الخيوط)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 4)))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+app.config['DB_POOL_MAX_LIFETIME'] = int(os.environ.get('DB_POOL_MAX_LIFETIME', 3600))
+app.config['DB_POOL_HEALTHCHECK_INTERVAL'] = int(os.environ.get('DB_POOL_HEALTHCHECK_INTERVAL', 30))
+# auto: إنشاء الجداول والترحيلات عند الاستيراد | probe: فحص رقم الإصدار فقط
+# (يُنفذ الإعداد مرة واحدة عبر: flask --app app init-db)
+app.config['DB_BOOTSTRAP_MODE'] = os.environ.get('DB_BOOTSTRAP_MODE', 'auto')
+# ضغط الاستجابات: أصغر حجم يستحق الضغط (بايت) ومستوى الضغط
+app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+app.config['COMPRESSION_LEVEL'] = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# السجل الأمني: طابور محدود يُكتب على دفعات، مع تدوير الملف حسب الحجم
+app.config['SECURITY_LOG_QUEUE_SIZE'] = int(os.environ.get('SECURITY_LOG_QUEUE_SIZE', 10000))
+app.config['SECURITY_LOG_BATCH_SIZE'] = int(os.environ.get('SECURITY_LOG_BATCH_SIZE', 200))
+app.config['SECURITY_LOG_FLUSH_INTERVAL'] = float(os.environ.get('SECURITY_LOG_FLUSH_INTERVAL', 1.0))
+app.config['SECURITY_LOG_MAX_BYTES'] = int(os.environ.get('SECURITY_LOG_MAX_BYTES', 10 * 1024 * 1024))
+app.config['SECURITY_LOG_BACKUP_COUNT'] = int(os.environ.get('SECURITY_LOG_BACKUP_COUNT', 5))
+# السجل الأمني ملف وليس جدولاً، فالاحتفاظ به حسب العمر يطبقه compact-logs على ملفاته
+app.config['SECURITY_LOG_RETENTION_DAYS'] = int(os.environ.get('SECURITY_LOG_RETENTION_DAYS', 180))
+# سجل النشاط: كتابة الأحداث على دفعات (عدد الأحداث أو المهلة بالملي ثانية، أيهما أولاً)
+app.config['ACTIVITY_BATCH_SIZE'] = int(os.environ.get('ACTIVITY_BATCH_SIZE', 100))
+app.config['ACTIVITY_FLUSH_INTERVAL_MS'] = int(os.environ.get('ACTIVITY_FLUSH_INTERVAL_MS', 250))
+app.config['ACTIVITY_QUEUE_SIZE'] = int(os.environ.get('ACTIVITY_QUEUE_SIZE', 10000))
+# الاحتفاظ بالسجلات: عدد الأيام في القاعدة الرئيسية قبل نقلها إلى قاعدة الأرشيف
+app.config['LOG_RETENTION_DAYS'] = {
+    'activity_logs': int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 90)),
+}
+app.config['LOG_ARCHIVE_PATH'] = os.environ.get('LOG_ARCHIVE_PATH', 'database/invoiceflow_secure_archive.db')
+app.config['LOG_COMPACTION_BATCH_SIZE'] = int(os.environ.get('LOG_COMPACTION_BATCH_SIZE', 1000))
+# تصدير الفواتير: عدد الصفوف المقروءة من المؤشر في كل دفعة
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+
 # إعدادات الأمان
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.wsgi_app = CompressionMiddleware(
+    ProxyFix(app.wsgi_app, x_proto=1, x_host=1),
+    minimum_size=app.config['COMPRESSION_MIN_SIZE'],
+    level=app.config['COMPRESSION_LEVEL']
+)
 CORS(app, resources={r"/*": {"origins": ["https://yourdomain.com"]}}, supports_credentials=True)
 
 # نظام تحديد المعدل
@@ -79,6 +127,8 @@ class MultilingualSystem:
                 'welcome': 'مرحباً في النظام المتقدم',
                 'dashboard': 'لوحة التحكم',
                 'revenue': 'الإيرادات',
+                'total_revenue': 'إجمالي الإيرادات',
+                'monthly_revenue': 'إيرادات هذا الشهر',
                 'expenses': 'المصروفات',
                 'profit': 'الأرباح',
                 'pending': 'معلقة',
@@ -129,6 +179,8 @@ class MultilingualSystem:
                 'welcome': 'Welcome to Advanced System',
                 'dashboard': 'Dashboard',
                 'revenue': 'Revenue',
+                'total_revenue': 'Total Revenue',
+                'monthly_revenue': 'Revenue This Month',
                 'expenses': 'Expenses',
                 'profit': 'Profit',
                 'pending': 'Pending',
@@ -177,23 +229,125 @@ class MultilingualSystem:
 lang_system = MultilingualSystem()
 
 # ================== نظام السجلات الأمنية ==================
-class SecurityLogger:
-    def __init__(self):
-        self.log_file = 'logs/security.log'
+class SecurityLogger(BatchWriter):
+    """كتابة الأحداث الأمنية عبر خيط خلفي بطابور محدود ودفعات مع تدوير الملف"""
+    
+    THREAD_NAME = 'security-log-writer'
+    # أحداث تُكتب فوراً على خيط الطلب حتى لا تضيع إذا توقفت العملية
+    FATAL_EVENTS = {'SERVER_ERROR', 'DATABASE_ERROR'}
+    
+    def __init__(self, log_file='logs/security.log', queue_size=10000, batch_size=200,
+                 flush_interval=1.0, max_bytes=10 * 1024 * 1024, backup_count=5, retention_days=180):
+        super().__init__(batch_size, flush_interval, queue_size)
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.retention_days = retention_days
         self.lock = Lock()
+        self.stats = {'queued': 0, 'written': 0, 'dropped': 0, 'sync': 0, 'batches': 0, 'rotations': 0}
+    
+    def count(self, key, amount=1):
+        """زيادة أحد العدادات"""
+        with self.stats_lock:
+            self.stats[key] += amount
     
     def log_event(self, event_type, user_id, ip_address, details):
         """تسجيل حدث أمني"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         log_entry = f"[{timestamp}] [{event_type}] [User: {user_id}] [IP: {ip_address}] {details}\n"
         
+        if event_type in self.FATAL_EVENTS:
+            try:
+                self.write([log_entry])
+                self.count('sync')
+            except OSError as e:
+                print(f"خطأ في كتابة السجل الأمني: {e}")
+                self.count('dropped')
+            return
+        
+        self.ensure_started()
+        try:
+            self.queue.put_nowait(log_entry)
+            self.count('queued')
+        except Full:
+            # الضغط الزائد: إسقاط الحدث بدلاً من حجز خيط الطلب
+            self.count('dropped')
+    
+    def write_batch(self, batch):
+        """أخطاء الدفعة يلتقطها BatchWriter._run ويعدّها في dropped"""
+        self.write(batch)
+    
+    def write(self, entries):
+        """كتابة مجموعة أسطر في الملف مع التدوير حسب الحجم"""
+        # backslashreplace: نص مُصاغ (مثل surrogate منفرد في details) لا يُفشل كتابة الدفعة كلها
+        data = ''.join(entries).encode('utf-8', 'backslashreplace')
         with self.lock:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(log_entry)
+            self.rotate_if_needed(len(data))
+            with open(self.log_file, 'ab') as f:
+                f.write(data)
         
-        print(f"🔒 {log_entry.strip()}")
-
-security_logger = SecurityLogger()
+        self.count('written', len(entries))
+        self.count('batches')
+    
+    def rotate_if_needed(self, incoming):
+        """تدوير security.log إلى security.log.1 ... عند تجاوز max_bytes"""
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            return
+        if size + incoming > self.max_bytes:
+            self.rotate()
+    
+    def rotate(self):
+        """security.log ← security.log.1 ← ... حتى backup_count (الأقدم يُحذف)"""
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.log_file}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.log_file}.{index + 1}")
+        os.replace(self.log_file, f"{self.log_file}.1")
+        self.count('rotations')
+    
+    def prune(self):
+        """الاحتفاظ حسب العمر بملفات كاملة: يُدوَّر الملف الحالي إذا كان أول سطر فيه أقدم من retention_days،
+        وتُحذف النسخ المدورة التي آخر كتابة فيها أقدم من ذلك؛ يُعيد عدد الملفات المحذوفة"""
+        cutoff = time.time() - self.retention_days * 86400
+        self.flush()
+        with self.lock:
+            try:
+                with open(self.log_file, 'rb') as f:
+                    first = f.readline()
+                # السطر يبدأ بـ [YYYY-mm-dd HH:MM:SS]
+                if datetime.strptime(first[1:20].decode('ascii'), '%Y-%m-%d %H:%M:%S').timestamp() < cutoff:
+                    self.rotate()
+            except (OSError, ValueError):
+                pass
+            
+            removed = 0
+            for index in range(1, self.backup_count + 1):
+                path = f"{self.log_file}.{index}"
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
+    
+    def get_stats(self):
+        """عدادات السجل وعمق الطابور الحالي"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue_depth()
+        return stats
+
+security_logger = SecurityLogger(
+    queue_size=app.config['SECURITY_LOG_QUEUE_SIZE'],
+    batch_size=app.config['SECURITY_LOG_BATCH_SIZE'],
+    flush_interval=app.config['SECURITY_LOG_FLUSH_INTERVAL'],
+    max_bytes=app.config['SECURITY_LOG_MAX_BYTES'],
+    backup_count=app.config['SECURITY_LOG_BACKUP_COUNT'],
+    retention_days=app.config['SECURITY_LOG_RETENTION_DAYS']
+)
 
 # ================== نظام الحماية من الهجمات ==================
 class SecuritySystem:
@@ -363,16 +517,390 @@ def csrf_protect(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# ================== مجمع اتصالات قاعدة البيانات ==================
+class PooledConnection:
+    """اتصال داخل المجمع مع بيانات عمره"""
+    __slots__ = ('conn', 'created_at', 'last_used')
+    
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+class ConnectionPool:
+    def __init__(self, db_path, size=4, timeout=10.0, max_lifetime=3600, healthcheck_interval=30):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.healthcheck_interval = healthcheck_interval
+        self.lock = Lock()
+        self._reset()
+    
+    def _reset(self):
+        """إعادة تهيئة المجمع (عند الإنشاء أو بعد fork في عامل جديد)"""
+        self.pid = os.getpid()
+        self.idle = LifoQueue(maxsize=self.size)
+        self.open_connections = 0
+        self.stats = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'healthcheck_failures': 0,
+            'timeouts': 0,
+            'waits': 0,
+            'total_wait_ms': 0.0,
+            'max_wait_ms': 0.0,
+        }
+    
+    def _connect(self):
+        """فتح اتصال جديد بنفس إعدادات execute_query"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.stats['created'] += 1
+        return PooledConnection(conn)
+    
+    def _discard(self, pooled):
+        """إغلاق اتصال وإخراجه من المجمع"""
+        try:
+            pooled.conn.close()
+        except sqlite3.Error:
+            pass
+        with self.lock:
+            self.open_connections -= 1
+    
+    def _is_healthy(self, pooled):
+        """فحص صلاحية الاتصال قبل إعادة استخدامه"""
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_lifetime:
+            with self.lock:
+                self.stats['recycled'] += 1
+            return False
+        
+        if now - pooled.last_used > self.healthcheck_interval:
+            try:
+                pooled.conn.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                with self.lock:
+                    self.stats['healthcheck_failures'] += 1
+                return False
+        return True
+    
+    def _acquire(self):
+        """الحصول على اتصال من المجمع أو فتح اتصال جديد ضمن الحد الأقصى"""
+        if self.pid != os.getpid():
+            # الاتصالات الموروثة من العملية الأم لا تُستخدم بعد fork
+            with self.lock:
+                if self.pid != os.getpid():
+                    self._reset()
+        
+        started = time.monotonic()
+        waited = False
+        
+        while True:
+            try:
+                pooled = self.idle.get_nowait()
+            except Empty:
+                with self.lock:
+                    can_open = self.open_connections < self.size
+                    if can_open:
+                        self.open_connections += 1
+                
+                if can_open:
+                    try:
+                        pooled = self._connect()
+                    except sqlite3.Error:
+                        with self.lock:
+                            self.open_connections -= 1
+                        raise
+                else:
+                    waited = True
+                    remaining = self.timeout - (time.monotonic() - started)
+                    try:
+                        pooled = self.idle.get(timeout=max(remaining, 0))
+                    except Empty:
+                        with self.lock:
+                            self.stats['timeouts'] += 1
+                        raise sqlite3.OperationalError(
+                            f"Connection pool exhausted after {self.timeout}s (size={self.size})"
+                        )
+                    if not self._is_healthy(pooled):
+                        self._discard(pooled)
+                        continue
+            else:
+                if not self._is_healthy(pooled):
+                    self._discard(pooled)
+                    continue
+            break
+        
+        wait_ms = (time.monotonic() - started) * 1000
+        with self.lock:
+            self.stats['checkouts'] += 1
+            if waited:
+                self.stats['waits'] += 1
+                self.stats['total_wait_ms'] += wait_ms
+                self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+        return pooled
+    
+    def _release(self, pooled):
+        """إعادة الاتصال إلى المجمع"""
+        if self.pid != os.getpid():
+            return
+        
+        try:
+            if pooled.conn.in_transaction:
+                pooled.conn.rollback()
+        except sqlite3.Error:
+            # اتصال في حالة غير معروفة، لا نعيده إلى المجمع
+            self._discard(pooled)
+            return
+        
+        pooled.last_used = time.monotonic()
+        self.idle.put_nowait(pooled)
+    
+    @contextmanager
+    def connection(self):
+        """استعارة اتصال من المجمع طوال كتلة with"""
+        pooled = self._acquire()
+        try:
+            yield pooled.conn
+        finally:
+            self._release(pooled)
+    
+    def get_stats(self):
+        """إحصائيات المجمع ووقت الانتظار"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['size'] = self.size
+            stats['open'] = self.open_connections
+        stats['idle'] = self.idle.qsize()
+        stats['avg_wait_ms'] = stats['total_wait_ms'] / stats['waits'] if stats['waits'] else 0.0
+        return stats
+    
+    def close_all(self):
+        """إغلاق جميع الاتصالات الخاملة"""
+        while True:
+            try:
+                pooled = self.idle.get_nowait()
+            except Empty:
+                break
+            self._discard(pooled)
+
+# ================== جداول الإحصائيات التراكمية ==================
+class StatsRollup(invoiceflow_common.StatsRollup):
+    """الإحصائيات التراكمية؛ عدد العملاء هنا للنشطين فقط"""
+    
+    CLIENTS_COLUMN = 'active_clients'
+    CLIENTS_ACTIVE_COLUMN = 'is_active'
+
+# ================== إصدارات الفواتير ==================
+class InvoiceVersions:
+    """row_version لكل فاتورة وإصدار لمجموعة فواتير كل مستخدم تحدّثها triggers، لدعم ETag و 304"""
+    
+    TABLE = '''
+        CREATE TABLE IF NOT EXISTS invoice_collection_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    '''
+    
+    @staticmethod
+    def bump_sql(row):
+        """زيادة إصدار مجموعة فواتير صاحب الصف"""
+        return f"""
+            INSERT OR IGNORE INTO invoice_collection_versions (user_id) VALUES ({row}.user_id);
+            UPDATE invoice_collection_versions SET
+                version = version + 1,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = {row}.user_id;
+        """
+    
+    @staticmethod
+    def trigger_statements():
+        """كل تعديل يزيد row_version ويحدّث updated_at، وكل تغيير يزيد إصدار المجموعة"""
+        touch_row = """
+            UPDATE invoices SET row_version = OLD.row_version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.id;
+        """
+        triggers = [
+            # row_version لم يتغير = تعديل من التطبيق؛ التحديث الداخلي يغيره فلا يتكرر الـ trigger
+            ('invoices_row_version', 'AFTER UPDATE ON invoices', 'NEW.row_version = OLD.row_version', touch_row),
+            ('invoices_version_insert', 'AFTER INSERT ON invoices', 'NEW.user_id IS NOT NULL', InvoiceVersions.bump_sql('NEW')),
+            ('invoices_version_delete', 'AFTER DELETE ON invoices', 'OLD.user_id IS NOT NULL', InvoiceVersions.bump_sql('OLD')),
+            ('invoices_version_update', 'AFTER UPDATE OF row_version ON invoices', 'OLD.user_id IS NOT NULL', InvoiceVersions.bump_sql('OLD')),
+            ('invoices_version_move', 'AFTER UPDATE OF user_id ON invoices',
+             'NEW.user_id IS NOT NULL AND NEW.user_id IS NOT OLD.user_id', InvoiceVersions.bump_sql('NEW')),
+        ]
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {name} {event} FOR EACH ROW WHEN {condition} BEGIN {body} END"
+            for name, event, condition, body in triggers
+        ]
+    
+    @staticmethod
+    def create(cursor):
+        """إضافة عمود row_version وجدول الإصدارات والـ triggers، وتهيئة إصدارات المستخدمين الحاليين"""
+        cursor.execute("PRAGMA table_info(invoices)")
+        if 'row_version' not in {column[1] for column in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE invoices ADD COLUMN row_version INTEGER NOT NULL DEFAULT 1")
+        cursor.execute(InvoiceVersions.TABLE)
+        cursor.execute('''
+            INSERT OR IGNORE INTO invoice_collection_versions (user_id, version, updated_at)
+            SELECT user_id, 1, MAX(updated_at) FROM invoices WHERE user_id IS NOT NULL GROUP BY user_id
+        ''')
+        for statement in InvoiceVersions.trigger_statements():
+            cursor.execute(statement)
+    
+    @staticmethod
+    def parse_timestamp(value):
+        """CURRENT_TIMESTAMP في SQLite بتوقيت UTC ← datetime لرأس Last-Modified"""
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+    
+    @staticmethod
+    def variant(args):
+        """بصمة معاملات الطلب (cursor, limit, fields...) لأنها تغيّر محتوى الاستجابة"""
+        if not args:
+            return ''
+        return '-' + hashlib.sha1(json.dumps(sorted(args.items(multi=True))).encode('utf-8')).hexdigest()[:12]
+    
+    @classmethod
+    def invoice_validator(cls, user_id, invoice_id, args=None):
+        """(ETag، Last-Modified) لفاتورة من المفتاح الأساسي فقط، أو None إذا لم توجد"""
+        row = secure_db.execute_query(
+            "SELECT row_version, updated_at FROM invoices WHERE id = ? AND user_id = ? AND is_deleted = 0",
+            (invoice_id, user_id),
+            fetchone=True
+        )
+        if not row:
+            return None
+        return cls.row_validator(invoice_id, row, args)
+    
+    @classmethod
+    def row_validator(cls, invoice_id, row, args=None):
+        """(ETag، Last-Modified) من row_version و updated_at في صف الفاتورة"""
+        etag = f"invoice-{invoice_id}-v{row['row_version']}{cls.variant(args)}"
+        return etag, cls.parse_timestamp(row['updated_at'])
+    
+    @classmethod
+    def collection_validator(cls, user_id, args):
+        """(ETag، Last-Modified) لقائمة الفواتير لهذه المعاملات"""
+        row = secure_db.execute_query(
+            "SELECT version, updated_at FROM invoice_collection_versions WHERE user_id = ?",
+            (user_id,),
+            fetchone=True
+        ) or {'version': 0, 'updated_at': None}
+        etag = f"invoices-{user_id}-v{row['version']}{cls.variant(args)}"
+        return etag, cls.parse_timestamp(row['updated_at'])
+    
+    @staticmethod
+    def not_modified(etag, last_modified):
+        """استجابة 304 إذا طابق If-None-Match (أو If-Modified-Since عند غيابه)، وإلا None"""
+        if request.if_none_match:
+            # مقارنة ضعيفة: CompressionMiddleware يحوّل الـ ETag إلى W/ عند الضغط
+            fresh = request.if_none_match.contains_weak(etag)
+        else:
+            fresh = bool(last_modified and request.if_modified_since
+                         and last_modified <= request.if_modified_since)
+        if not fresh:
+            return None
+        return InvoiceVersions.with_validators(Response(status=304), etag, last_modified)
+    
+    @staticmethod
+    def with_validators(response, etag, last_modified):
+        """ETag و Last-Modified مع إلزام العميل بإعادة التحقق في كل طلب"""
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
+# ================== ترحيلات مخطط قاعدة البيانات ==================
+# الفهارس مشتقة من الاستعلامات الفعلية في HOT_QUERIES
+MIGRATIONS = [
+    (1, 'user_stats rollup tables', StatsRollup.create),
+    (2, 'hot query indexes', [
+        # /api/v1/invoices: WHERE user_id AND is_deleted = 0 ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_deleted_created ON invoices (user_id, is_deleted, created_at)",
+        # الفواتير المتأخرة: WHERE user_id AND status AND is_deleted AND due_date <
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_status_due ON invoices (user_id, status, is_deleted, due_date)",
+    ]),
+    (3, 'keyset pagination indexes', [
+        # /api/v1/clients و /api/v1/activities: ORDER BY created_at DESC, id DESC
+        "CREATE INDEX IF NOT EXISTS idx_clients_user_active_created ON clients (user_id, is_active, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_activity_logs_user_created ON activity_logs (user_id, created_at)",
+    ]),
+    (4, 'invoice row and collection versions', InvoiceVersions.create),
+    (5, 'null-safe user_stats triggers', StatsRollup.recreate_triggers),
+]
+
 # ================== قاعدة البيانات الآمنة ==================
 class SecureDatabaseManager:
     def __init__(self):
         self.db_path = 'database/invoiceflow_secure.db'
+        self.bootstrap()
+        self.pool = ConnectionPool(
+            self.db_path,
+            size=app.config['DB_POOL_SIZE'],
+            timeout=app.config['DB_POOL_TIMEOUT'],
+            max_lifetime=app.config['DB_POOL_MAX_LIFETIME'],
+            healthcheck_interval=app.config['DB_POOL_HEALTHCHECK_INTERVAL'],
+        )
+        self.activity_batcher = ActivityBatcher(
+            self.insert_activities,
+            batch_size=app.config['ACTIVITY_BATCH_SIZE'],
+            flush_interval_ms=app.config['ACTIVITY_FLUSH_INTERVAL_MS'],
+            queue_size=app.config['ACTIVITY_QUEUE_SIZE']
+        )
+    
+    def schema_version(self):
+        """قراءة رقم إصدار المخطط دون إنشاء أو تعديل أي شيء"""
+        try:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        except sqlite3.OperationalError:
+            return 0
+        
+        try:
+            return SchemaMigrator.current_version(conn.cursor())
+        except sqlite3.Error:
+            return 0
+        finally:
+            conn.close()
+    
+    @contextmanager
+    def read_connection(self):
+        """اتصال قراءة مستقل عن المجمع للقراءات الطويلة (التصدير)؛ وضع WAL يسمح بها أثناء الكتابة"""
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True,
+                               timeout=app.config['DB_POOL_TIMEOUT'], check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    
+    def bootstrap(self):
+        """تهيئة المخطط عند الإقلاع حسب DB_BOOTSTRAP_MODE"""
+        if app.config['DB_BOOTSTRAP_MODE'] == 'probe':
+            version = self.schema_version()
+            latest = SchemaMigrator(MIGRATIONS).latest_version
+            if version >= latest:
+                print(f"✅ مخطط قاعدة البيانات محدث (الإصدار {version})")
+                return
+            print(f"⚠️ مخطط قاعدة البيانات قديم ({version} < {latest})، يتم تطبيق التهيئة الآن")
+        
         self.init_database()
     
     def init_database(self):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # وضع WAL يسمح للقراءات الطويلة (مثل التصدير المتدفق) بالعمل دون حجب الكتّاب
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
         # جدول المستخدمين مع سجلات الدخول
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -512,38 +1040,47 @@ class SecureDatabaseManager:
         ''')
         
         conn.commit()
+        
+        # تطبيق الترحيلات المرقمة (جداول الإحصائيات والفهارس)
+        applied = SchemaMigrator(MIGRATIONS).migrate(conn)
         conn.close()
+        
+        if applied:
+            print(f"✅ تم تطبيق الترحيلات: {applied}")
         print("✅ قاعدة البيانات الآمنة جاهزة!")
     
-    def execute_query(self, query, params=(), fetchone=False, fetchall=False, commit=True):
-        """تنفيذ استعلام آمن مع حماية من SQL Injection"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute(query, params)
-            
-            if fetchone:
-                result = cursor.fetchone()
-                if result:
-                    result = dict(result)
-            elif fetchall:
-                results = cursor.fetchall()
-                result = [dict(row) for row in results]
-            else:
-                result = None
-            
-            if commit:
-                conn.commit()
+    def execute_query(self, query, params=(), fetchone=False, fetchall=False, commit=True, rowset=False):
+        """تنفيذ استعلام آمن مع حماية من SQL Injection (rowset: صفوف fetchall كـ RowSet بدل dict)"""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            if rowset:
+                cursor.row_factory = None
             
-            return result
-        except sqlite3.Error as e:
-            security_logger.log_event('DATABASE_ERROR', 'system', '127.0.0.1', f"Query failed: {str(e)}")
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+            try:
+                cursor.execute(query, params)
+                
+                if fetchone:
+                    result = cursor.fetchone()
+                    if result:
+                        result = dict(result)
+                elif fetchall and rowset:
+                    result = RowSet([column[0] for column in cursor.description], cursor.fetchall())
+                elif fetchall:
+                    results = cursor.fetchall()
+                    result = [dict(row) for row in results]
+                else:
+                    result = None
+                
+                if commit:
+                    conn.commit()
+                
+                return result
+            except sqlite3.Error as e:
+                security_logger.log_event('DATABASE_ERROR', 'system', '127.0.0.1', f"Query failed: {str(e)}")
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
     
     def get_user_by_username(self, username):
         """الحصول على مستخدم بأمان"""
@@ -578,15 +1115,129 @@ class SecureDatabaseManager:
         ip_address = request.remote_addr if request else '127.0.0.1'
         user_agent = request.user_agent.string if request else ''
         
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        
+        self.activity_batcher.add((user_id, action, entity_type, entity_id, details, ip_address, user_agent, created_at))
+    
+    def insert_activities(self, rows):
+        """كتابة دفعة من سجلات النشاط في معاملة واحدة"""
         query = """
-        INSERT INTO activity_logs (user_id, action, entity_type, entity_id, details, ip_address, user_agent)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
+        INSERT INTO activity_logs (user_id, action, entity_type, entity_id, details, ip_address, user_agent, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         """
         
-        self.execute_query(query, (user_id, action, entity_type, entity_id, details, ip_address, user_agent))
+        with self.pool.connection() as conn:
+            conn.executemany(query, rows)
+            conn.commit()
 
 secure_db = SecureDatabaseManager()
 
+# ================== أرشفة السجلات ==================
+log_retention = LogRetention(
+    secure_db,
+    app.config['LOG_ARCHIVE_PATH'],
+    app.config['LOG_RETENTION_DAYS'],
+    batch_size=app.config['LOG_COMPACTION_BATCH_SIZE']
+)
+
+# ================== خدمة الإحصائيات ==================
+UserStats = namedtuple('UserStats', [
+    'total_invoices', 'total_revenue', 'pending_invoices',
+    'overdue_invoices', 'monthly_revenue', 'active_clients'
+])
+
+class StatsService:
+    # صف واحد من user_stats وصف الشهر الحالي من user_monthly_stats؛
+    # الفواتير المتأخرة تعتمد على تاريخ اليوم فتُحسب بعدّ محدود على الفواتير المعلقة
+    STATS_QUERY = """
+        SELECT
+            COALESCE(s.total_invoices, 0) AS total_invoices,
+            COALESCE(s.total_revenue, 0) AS total_revenue,
+            COALESCE(s.pending_invoices, 0) AS pending_invoices,
+            (SELECT COUNT(*) FROM invoices
+             WHERE user_id = u.user_id AND status = 'pending' AND due_date < DATE('now')
+               AND is_deleted = 0) AS overdue_invoices,
+            COALESCE(m.paid_revenue, 0) AS monthly_revenue,
+            COALESCE(s.active_clients, 0) AS active_clients
+        FROM (SELECT ? AS user_id) u
+        LEFT JOIN user_stats s ON s.user_id = u.user_id
+        LEFT JOIN user_monthly_stats m ON m.user_id = u.user_id AND m.month = strftime('%Y-%m', 'now')
+    """
+    
+    @staticmethod
+    def get_user_stats(user_id):
+        """إحصائيات المستخدم لصفحات لوحة التحكم والتقارير والذكاء الاصطناعي"""
+        return UserStats(**secure_db.execute_query(StatsService.STATS_QUERY, (user_id,), fetchone=True))
+
+# ================== اختيار أعمدة الفواتير ==================
+class InvoiceFields:
+    """إسقاط أعمدة الفواتير حسب fields= و include= من قائمة مسموحة، داخل SELECT نفسه"""
+    
+    ALLOWED = (
+        'id', 'invoice_number', 'client_id', 'client_name', 'client_email', 'client_phone',
+        'client_address', 'company_name', 'company_address', 'company_logo', 'issue_date', 'due_date',
+        'items', 'subtotal', 'tax_rate', 'tax_amount', 'discount', 'total_amount', 'status',
+        'payment_method', 'notes', 'pdf_path', 'qr_code', 'created_at', 'updated_at', 'row_version',
+    )
+    # أعمدة نصية كبيرة لا تُرسل في القوائم إلا بـ include=
+    HEAVY = ('items', 'notes', 'company_logo', 'qr_code', 'pdf_path')
+    LIST_DEFAULT = (
+        'id', 'invoice_number', 'client_id', 'client_name', 'issue_date', 'due_date',
+        'total_amount', 'status', 'created_at', 'updated_at',
+    )
+    
+    @classmethod
+    def parse(cls, args, default=None):
+        """الأعمدة المطلوبة بترتيب ALLOWED، أو default إذا لم يحدد الطلب شيئاً (None = كل الأعمدة)"""
+        def split(name):
+            return [field.strip() for field in args.get(name, '').split(',') if field.strip()]
+        
+        fields, include = split('fields'), split('include')
+        unknown = [field for field in fields if field not in cls.ALLOWED]
+        unknown += [field for field in include if field not in cls.HEAVY]
+        if unknown:
+            raise ValueError(f"حقول غير معروفة: {', '.join(unknown)}")
+        if not fields and not include:
+            return default
+        
+        selected = set(fields or default or cls.ALLOWED) | set(include)
+        return tuple(column for column in cls.ALLOWED if column in selected)
+    
+    @staticmethod
+    def sql(columns, extra=()):
+        """قائمة SELECT؛ id و created_at دائماً لأن مؤشر الصفحات يعتمد عليهما، و extra لما يحتاجه المسار"""
+        if columns is None:
+            return '*'
+        return ', '.join(dict.fromkeys(('id', 'created_at') + tuple(extra) + tuple(columns)))
+
+# الاستعلامات الساخنة التي يجب أن تستخدم فهرساً (يتحقق منها team_test_system.py)
+HOT_QUERIES = [
+    ('dashboard_stats', StatsService.STATS_QUERY, (1,)),
+    ('api_invoices', f"SELECT {InvoiceFields.sql(InvoiceFields.LIST_DEFAULT)} FROM invoices WHERE user_id = ? AND is_deleted = 0 ORDER BY created_at DESC, id DESC LIMIT ?", (1, 51)),
+    ('api_invoices_cursor', "SELECT * FROM invoices WHERE user_id = ? AND is_deleted = 0 AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 51)),
+    ('api_clients', "SELECT * FROM clients WHERE user_id = ? AND is_active = 1 AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 51)),
+    ('api_activities', "SELECT * FROM activity_logs WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 51)),
+    ('api_invoice', "SELECT * FROM invoices WHERE id = ? AND user_id = ? AND is_deleted = 0", (1, 1)),
+    ('api_invoice_version', "SELECT row_version, updated_at FROM invoices WHERE id = ? AND user_id = ? AND is_deleted = 0", (1, 1)),
+    ('api_invoices_version', "SELECT version, updated_at FROM invoice_collection_versions WHERE user_id = ?", (1,)),
+    ('login_lookup', "SELECT * FROM users WHERE username = ? AND is_active = 1", ('admin',)),
+    ('register_lookup', "SELECT id FROM users WHERE username = ? OR email = ?", ('admin', 'admin@example.com')),
+]
+
+# ================== ترقيم الصفحات بالمؤشر ==================
+class KeysetPaginator(invoiceflow_common.KeysetPaginator):
+    """ترقيم الصفحات بالمؤشر على قاعدة secure_db"""
+    
+    database = secure_db
+
+# ================== الملفات الثابتة ذات البصمة ==================
+static_assets = StaticAssets(os.path.join(app.static_folder, 'css'))
+
+@app.route('/assets/css/<filename>')
+def fingerprinted_asset(filename):
+    """تقديم ملفات CSS ذات البصمة"""
+    return static_assets.send(filename)
+
 # ================== إعدادات التصميم العالمي ==================
 GLOBAL_DESIGN_CSS = """
 /* ================== إعدادات التصميم العالمية ================== */
@@ -1030,6 +1681,36 @@ body {
 }
 """
 
+static_assets.register('global', GLOBAL_DESIGN_CSS)
+
+# ================== قوالب الصفحات ==================
+# يُترجم القالب مرة واحدة لكل عملية، ومحتوى الصفحة يُمرر كسياق بدلاً من إعادة ترجمة HTML في كل طلب
+PAGE_LAYOUT = app.jinja_env.from_string("""<!DOCTYPE html>
+<html dir="{{ 'rtl' if lang == 'ar' else 'ltr' }}" lang="{{ lang }}" class="lang-{{ lang }}">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{ title }}</title>
+    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&family=Tajawal:wght@300;400;500;700&display=swap" rel="stylesheet">
+    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
+    <link href="{{ css_url }}" rel="stylesheet">
+</head>
+<body>
+{{ content|safe }}
+</body>
+</html>""")
+
+def render_page(content, title='InvoiceFlow Premium'):
+    """عرض محتوى الصفحة داخل القالب العام المترجم مسبقاً"""
+    context = {
+        'content': content,
+        'css_url': static_assets.url('global'),
+        'lang': session.get('lang', 'ar'),
+        'title': title,
+    }
+    app.update_template_context(context)
+    return PAGE_LAYOUT.render(context)
+
 # ================== Routes متعددة اللغات وآمنة ==================
 
 @app.route('/')
@@ -1048,7 +1729,7 @@ def home():
         <title>InvoiceFlow Premium - {lang_system.get_text('title', lang)}</title>
         <link href="https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&family=Tajawal:wght@300;400;500;700&display=swap" rel="stylesheet">
         <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
-        <style>{GLOBAL_DESIGN_CSS}</style>
+        <link href="{static_assets.url('global')}" rel="stylesheet">
     </head>
     <body>
         <!-- شريط التنقل العالمي -->
@@ -1372,7 +2053,7 @@ def login():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/register', methods=['GET', 'POST'])
 @limiter.limit("5 per hour")
@@ -1587,7 +2268,7 @@ def register():
     </script>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/dashboard')
 @login_required
@@ -1598,12 +2279,7 @@ def dashboard():
     # إحصائيات المستخدم
     user_id = session['user_id']
     
-    stats = {
-        'total_invoices': 0,
-        'total_revenue': 0,
-        'pending_invoices': 0,
-        'active_clients': 0
-    }
+    stats = StatsService.get_user_stats(user_id)
     
     content = f'''
     <div class="secure-dashboard">
@@ -1635,7 +2311,7 @@ def dashboard():
                         <i class="fas fa-file-invoice" style="color: var(--global-accent-blue);"></i>
                     </div>
                     <div>
-                        <div class="stat-number">{stats['total_invoices']}</div>
+                        <div class="stat-number">{stats.total_invoices}</div>
                         <p>{lang_system.get_text('invoices', lang)}</p>
                     </div>
                 </div>
@@ -1647,7 +2323,7 @@ def dashboard():
                         <i class="fas fa-dollar-sign" style="color: var(--global-accent-green);"></i>
                     </div>
                     <div>
-                        <div class="stat-number">${stats['total_revenue']:,.0f}</div>
+                        <div class="stat-number">${stats.total_revenue:,.0f}</div>
                         <p>{lang_system.get_text('revenue', lang)}</p>
                     </div>
                 </div>
@@ -1659,7 +2335,7 @@ def dashboard():
                         <i class="fas fa-clock" style="color: var(--global-accent-yellow);"></i>
                     </div>
                     <div>
-                        <div class="stat-number">{stats['pending_invoices']}</div>
+                        <div class="stat-number">{stats.pending_invoices}</div>
                         <p>{lang_system.get_text('pending', lang)}</p>
                     </div>
                 </div>
@@ -1671,7 +2347,7 @@ def dashboard():
                         <i class="fas fa-users" style="color: var(--global-accent-red);"></i>
                     </div>
                     <div>
-                        <div class="stat-number">{stats['active_clients']}</div>
+                        <div class="stat-number">{stats.active_clients}</div>
                         <p>{lang_system.get_text('clients', lang)}</p>
                     </div>
                 </div>
@@ -1743,7 +2419,7 @@ def dashboard():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/invoices')
 @login_required
@@ -1837,7 +2513,7 @@ def invoices():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/invoices/create', methods=['GET', 'POST'])
 @login_required
@@ -2180,13 +2856,16 @@ def create_invoice():
     </script>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/ai')
 @login_required
 def ai_insights():
     """صفحة الذكاء الاصطناعي"""
     lang = request.args.get('lang', session.get('lang', 'ar'))
+    stats = StatsService.get_user_stats(session['user_id'])
+    paid_invoices = stats.total_invoices - stats.pending_invoices
+    collection_rate = paid_invoices / stats.total_invoices * 100 if stats.total_invoices else 0
     
     content = f'''
     <div class="secure-dashboard">
@@ -2261,12 +2940,16 @@ def ai_insights():
                     <div style="font-size: 2.5em; font-weight: bold; color: var(--global-accent-yellow);">78%</div>
                     <div style="color: var(--global-gray-lighter);">كفاءة الأداء</div>
                 </div>
+                <div class="stat-card">
+                    <div style="font-size: 2.5em; font-weight: bold; color: var(--global-accent-blue);">{collection_rate:.0f}%</div>
+                    <div style="color: var(--global-gray-lighter);">معدل التحصيل</div>
+                </div>
             </div>
         </div>
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/ai/clients')
 @login_required
@@ -2452,7 +3135,7 @@ def ai_clients_analysis():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/clients')
 @login_required
@@ -2516,13 +3199,14 @@ def clients():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/reports')
 @login_required
 def reports():
     """صفحة التقارير"""
     lang = request.args.get('lang', session.get('lang', 'ar'))
+    stats = StatsService.get_user_stats(session['user_id'])
     
     content = f'''
     <div class="secure-dashboard">
@@ -2536,6 +3220,26 @@ def reports():
             </p>
         </div>
         
+        <!-- ملخص المؤشرات -->
+        <div class="stats-grid" style="margin-bottom: var(--global-spacing-xl);">
+            <div class="stat-card">
+                <div class="stat-number">${stats.total_revenue:,.0f}</div>
+                <p>{lang_system.get_text('total_revenue', lang)}</p>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">${stats.monthly_revenue:,.0f}</div>
+                <p>{lang_system.get_text('monthly_revenue', lang)}</p>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{stats.pending_invoices}</div>
+                <p>{lang_system.get_text('pending', lang)}</p>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number">{stats.overdue_invoices}</div>
+                <p>{lang_system.get_text('overdue', lang)}</p>
+            </div>
+        </div>
+        
         <div class="dashboard-grid">
             <div class="secure-card">
                 <h3 style="margin-bottom: var(--global-spacing-lg);">
@@ -2635,7 +3339,7 @@ def reports():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/settings')
 @login_required
@@ -2788,7 +3492,7 @@ def settings():
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content)
+    return render_page(content)
 
 @app.route('/logout')
 def logout():
@@ -2808,17 +3512,30 @@ def api_get_invoices():
     """API للحصول على الفواتير"""
     try:
         user_id = session['user_id']
-        invoices = secure_db.execute_query(
-            "SELECT * FROM invoices WHERE user_id = ? AND is_deleted = 0 ORDER BY created_at DESC LIMIT 50",
-            (user_id,),
-            fetchall=True
+        columns = InvoiceFields.parse(request.args, default=InvoiceFields.LIST_DEFAULT)
+        etag, last_modified = InvoiceVersions.collection_validator(user_id, request.args)
+        not_modified = InvoiceVersions.not_modified(etag, last_modified)
+        if not_modified:
+            return not_modified
+        
+        invoices, next_cursor = KeysetPaginator.fetch(
+            'invoices', 'user_id = ? AND is_deleted = 0', (user_id,),
+            cursor=request.args.get('cursor'),
+            limit=KeysetPaginator.parse_limit(request.args.get('limit')),
+            columns=InvoiceFields.sql(columns)
         )
         
-        return jsonify({
+        return InvoiceVersions.with_validators(jsonify({
             'success': True,
             'data': invoices,
-            'count': len(invoices)
-        })
+            'count': len(invoices),
+            'next_cursor': next_cursor
+        }), etag, last_modified)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         security_logger.log_event('API_ERROR', session.get('user_id'), request.remote_addr, f"Get invoices: {str(e)}")
         return jsonify({
@@ -2826,28 +3543,112 @@ def api_get_invoices():
             'error': 'حدث خطأ في الخادم'
         }), 500
 
+def csv_safe(value):
+    """منع حقن الصيغ في Excel: النص الذي يبدأ بـ = أو + أو - أو @ يُسبق بعلامة '"""
+    if isinstance(value, str) and value.startswith(('=', '+', '-', '@', '\t', '\r')):
+        return "'" + value
+    return value
+
+@app.route('/api/v1/invoices/export', methods=['GET'])
+@login_required
+@limiter.limit("10 per hour")
+def api_export_invoices():
+    """تصدير كل فواتير المستخدم بتدفق NDJSON أو CSV بذاكرة ثابتة"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'success': False, 'error': 'الصيغة المدعومة: ndjson أو csv'}), 400
+    
+    where = ["user_id = ?", "is_deleted = 0"]
+    params = [session['user_id']]
+    for arg, condition in (('date_from', "issue_date >= ?"), ('date_to', "issue_date <= ?")):
+        value = request.args.get(arg)
+        if not value:
+            continue
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'success': False, 'error': f'{arg} يجب أن يكون بصيغة YYYY-MM-DD'}), 400
+        where.append(condition)
+        params.append(value)
+    if request.args.get('status'):
+        where.append("status = ?")
+        params.append(request.args['status'])
+    
+    query = f"SELECT * FROM invoices WHERE {' AND '.join(where)} ORDER BY created_at, id"
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    secure_db.log_activity(session['user_id'], 'EXPORT', 'invoice', None, f"format={export_format}")
+    
+    def generate():
+        # اتصال مستقل طوال التصدير حتى لا يُحجز اتصال من المجمع، والصفوف تُقرأ على دفعات من المؤشر
+        with secure_db.read_connection() as conn:
+            cursor = conn.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            buffer = io.StringIO()
+            writer = csv.writer(buffer) if export_format == 'csv' else None
+            if writer:
+                writer.writerow(columns)
+            
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    if writer:
+                        writer.writerow([csv_safe(value) for value in row])
+                    else:
+                        buffer.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+                        buffer.write('\n')
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+            
+            if buffer.tell():
+                yield buffer.getvalue().encode('utf-8')
+            cursor.close()
+    
+    filename = f"invoices-{datetime.now().strftime('%Y%m%d')}.{export_format}"
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson' if export_format == 'ndjson' else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'}
+    )
+
 @app.route('/api/v1/invoices/<int:invoice_id>', methods=['GET'])
 @login_required
 def api_get_invoice(invoice_id):
     """API للحصول على فاتورة محددة"""
     try:
         user_id = session['user_id']
+        columns = InvoiceFields.parse(request.args)
+        validator = InvoiceVersions.invoice_validator(user_id, invoice_id, request.args)
+        if validator:
+            not_modified = InvoiceVersions.not_modified(*validator)
+            if not_modified:
+                return not_modified
+        
+        # row_version و updated_at في الإسقاط نفسه حتى يطابق الـ ETag الصف المُرسل فعلاً
         invoice = secure_db.execute_query(
-            "SELECT * FROM invoices WHERE id = ? AND user_id = ? AND is_deleted = 0",
+            f"SELECT {InvoiceFields.sql(columns, ('row_version', 'updated_at'))} FROM invoices "
+            "WHERE id = ? AND user_id = ? AND is_deleted = 0",
             (invoice_id, user_id),
             fetchone=True
-        )
+        ) if validator else None
         
         if invoice:
-            return jsonify({
+            return InvoiceVersions.with_validators(jsonify({
                 'success': True,
                 'data': invoice
-            })
+            }), *InvoiceVersions.row_validator(invoice_id, invoice, request.args))
         else:
             return jsonify({
                 'success': False,
                 'error': 'الفاتورة غير موجودة'
             }), 404
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         security_logger.log_event('API_ERROR', session.get('user_id'), request.remote_addr, f"Get invoice {invoice_id}: {str(e)}")
         return jsonify({
@@ -2855,6 +3656,65 @@ def api_get_invoice(invoice_id):
             'error': 'حدث خطأ في الخادم'
         }), 500
 
+@app.route('/api/v1/clients', methods=['GET'])
+@login_required
+def api_get_clients():
+    """API للحصول على العملاء النشطين"""
+    try:
+        clients, next_cursor = KeysetPaginator.fetch(
+            'clients', 'user_id = ? AND is_active = 1', (session['user_id'],),
+            cursor=request.args.get('cursor'),
+            limit=KeysetPaginator.parse_limit(request.args.get('limit'))
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': clients,
+            'count': len(clients),
+            'next_cursor': next_cursor
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        security_logger.log_event('API_ERROR', session.get('user_id'), request.remote_addr, f"Get clients: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ في الخادم'
+        }), 500
+
+@app.route('/api/v1/activities', methods=['GET'])
+@login_required
+def api_get_activities():
+    """API لسجل نشاط المستخدم"""
+    try:
+        # السجلات المؤرشفة بـ compact-logs جزء من التاريخ نفسه
+        activities, next_cursor = log_retention.page(
+            'activity_logs', session['user_id'],
+            cursor=request.args.get('cursor'),
+            limit=KeysetPaginator.parse_limit(request.args.get('limit'))
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': activities,
+            'count': len(activities),
+            'next_cursor': next_cursor
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        security_logger.log_event('API_ERROR', session.get('user_id'), request.remote_addr, f"Get activities: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ في الخادم'
+        }), 500
+
 # ================== معالج الأخطاء ==================
 @app.errorhandler(404)
 def page_not_found(e):
@@ -2876,7 +3736,7 @@ def page_not_found(e):
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content), 404
+    return render_page(content), 404
 
 @app.errorhandler(500)
 def internal_server_error(e):
@@ -2898,7 +3758,7 @@ def internal_server_error(e):
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content), 500
+    return render_page(content), 500
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
@@ -2918,7 +3778,7 @@ def ratelimit_handler(e):
     </div>
     '''
     
-    return render_template_string(GLOBAL_DESIGN_CSS + content), 429
+    return render_page(content), 429
 
 # ================== وظائف مساعدة للسلامة ==================
 @app.before_request
@@ -2952,6 +3812,48 @@ def add_security_headers(response):
     response.headers['Permissions-Policy'] = 'geolocation=(), microphone=(), camera=()'
     return response
 
+# ================== أوامر الإدارة ==================
+@app.cli.command('init-db')
+def init_db_command():
+    """إنشاء الجداول وتطبيق الترحيلات مرة واحدة قبل تشغيل العمال: flask --app app init-db"""
+    secure_db.init_database()
+
+@app.cli.command('rollups')
+@click.argument('action', type=click.Choice(['verify', 'rebuild']))
+def rollups_command(action):
+    """التحقق من جداول الإحصائيات أو إعادة بنائها: flask --app app rollups verify"""
+    with secure_db.pool.connection() as conn:
+        cursor = conn.cursor()
+        
+        if action == 'rebuild':
+            cursor.execute("BEGIN IMMEDIATE")
+            StatsRollup.rebuild(cursor)
+            conn.commit()
+            print("✅ تمت إعادة بناء جداول الإحصائيات")
+        
+        drift = StatsRollup.verify(cursor)
+    
+    if not drift:
+        print("✅ جداول الإحصائيات مطابقة لجدول الفواتير")
+        return
+    
+    print(f"❌ تم العثور على {len(drift)} فرق:")
+    for item in drift[:50]:
+        print(f"   {item['table']} {item['key']} {item['column']}: "
+              f"المخزن={item['stored']} المتوقع={item['expected']}")
+    raise SystemExit(1)
+
+@app.cli.command('compact-logs')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(sorted(app.config['LOG_RETENTION_DAYS'])),
+              help="جدول محدد (الافتراضي: كل الجداول)")
+def compact_logs_command(tables):
+    """نقل السجلات الأقدم من مدة الاحتفاظ إلى قاعدة الأرشيف وحذف ملفات السجل الأمني القديمة: flask --app app compact-logs"""
+    for table, moved in log_retention.compact(tables).items():
+        print(f"✅ {table}: تم نقل {moved} صف إلى الأرشيف (الاحتفاظ {log_retention.retention_days[table]} يوم)")
+    if not tables:
+        removed = security_logger.prune()
+        print(f"✅ {security_logger.log_file}: تم حذف {removed} ملف (الاحتفاظ {security_logger.retention_days} يوم)")
+
 # ================== التشغيل الرئيسي ==================
 if __name__ == '__main__':
     try:
@@ -5,57 +5,166 @@ import time
 import hashlib
 import secrets
 import re
-import io
 import base64
+import math
+import tempfile
+import zipfile
 import random
 import uuid
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-from threading import Thread, Lock
+import importlib
+import multiprocessing
+from collections import namedtuple, OrderedDict, deque
+from datetime import datetime, date, timedelta
+from threading import Thread, Lock, Event, Condition, BoundedSemaphore, local
+from queue import Queue
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as futures_wait
+from concurrent.futures.process import BrokenProcessPool
 from functools import wraps
-from flask import Flask, render_template_string, request, jsonify, send_file, redirect, url_for, session, flash, Response
+from itertools import chain
+from flask import Flask, render_template_string, request, jsonify, send_file, abort, redirect, url_for, session, flash, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
-import arabic_reshaper
-from bidi.algorithm import get_display
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.utils import simpleSplit
-from reportlab.lib.units import inch, mm
-import qrcode
-from PIL import Image as PILImage
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
+import click
+import invoiceflow_common
+from invoiceflow_common import (
+    CompressionMiddleware, RowSet, FastJSONProvider, StatsRollup, SchemaMigrator,
+    ActivityBatcher, LogRetention, StaticAssets
+)
 import warnings
 warnings.filterwarnings('ignore')
 
+# ================== التحميل الكسول للمكتبات الثقيلة ==================
+class LazyModule:
+    """وكيل لمكتبة لا تُستورد إلا عند أول استخدام لأحد عناصرها"""
+    
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+    
+    def load(self):
+        """استيراد المكتبة الفعلية (مرة واحدة فقط)"""
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+    
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+    
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<LazyModule {self._name} ({state})>"
+
+# التحليلات
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+# النص العربي
+arabic_reshaper = LazyModule('arabic_reshaper')
+bidi_algorithm = LazyModule('bidi.algorithm')
+# إنشاء PDF
+canvas = LazyModule('reportlab.pdfgen.canvas')
+pagesizes = LazyModule('reportlab.lib.pagesizes')
+colors = LazyModule('reportlab.lib.colors')
+platypus = LazyModule('reportlab.platypus')
+pdf_styles = LazyModule('reportlab.lib.styles')
+pdfmetrics = LazyModule('reportlab.pdfbase.pdfmetrics')
+ttfonts = LazyModule('reportlab.pdfbase.ttfonts')
+pdf_units = LazyModule('reportlab.lib.units')
+# المولد ومهام العمال (تستورد reportlab والتشكيل عند تحميلها)
+pdf_worker = LazyModule('pdf_worker')
+# الصور و QR
+qrcode = LazyModule('qrcode')
+PILImage = LazyModule('PIL.Image')
+
+HEAVY_MODULES = [
+    pd, np, arabic_reshaper, bidi_algorithm, canvas, pagesizes, colors, platypus,
+    pdf_styles, pdfmetrics, ttfonts, pdf_units, qrcode, PILImage, pdf_worker
+]
+
+def preload_heavy_modules():
+    """تحميل المكتبات الثقيلة مسبقاً (مفيد مع gunicorn --preload لمشاركتها بين العمال)"""
+    for module in HEAVY_MODULES:
+        module.load()
+
 # ================== تهيئة التطبيق ==================
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'invoiceflow_pro_secure_key_2024_v2')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['DATABASE_PATH'] = 'database/invoiceflow_pro.db'
+# وضع التزامن: wal (قراءات متوازية + كاتب واحد) أو serialized (القفل العام القديم)
+app.config['DATABASE_CONCURRENCY_MODE'] = os.environ.get('DB_CONCURRENCY_MODE', 'wal')
+app.config['DATABASE_BUSY_TIMEOUT'] = float(os.environ.get('DB_BUSY_TIMEOUT', 5))
+# auto: إنشاء الجداول والترحيلات عند الاستيراد | probe: فحص رقم الإصدار فقط
+# (يُنفذ الإعداد مرة واحدة عبر: flask --app bot_arabic init-db)
+app.config['DB_BOOTSTRAP_MODE'] = os.environ.get('DB_BOOTSTRAP_MODE', 'auto')
+# تحميل مكتبات PDF والتحليلات عند الإقلاع بدلاً من أول طلب يحتاجها
+app.config['PRELOAD_HEAVY_MODULES'] = os.environ.get('PRELOAD_HEAVY_MODULES', '0') == '1'
+# ضغط الاستجابات: أصغر حجم يستحق الضغط (بايت) ومستوى الضغط
+app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+app.config['COMPRESSION_LEVEL'] = int(os.environ.get('COMPRESSION_LEVEL', 6))
+# سجل النشاط: كتابة الأحداث على دفعات (عدد الأحداث أو المهلة بالملي ثانية، أيهما أولاً)
+app.config['ACTIVITY_BATCH_SIZE'] = int(os.environ.get('ACTIVITY_BATCH_SIZE', 100))
+app.config['ACTIVITY_FLUSH_INTERVAL_MS'] = int(os.environ.get('ACTIVITY_FLUSH_INTERVAL_MS', 250))
+app.config['ACTIVITY_QUEUE_SIZE'] = int(os.environ.get('ACTIVITY_QUEUE_SIZE', 10000))
+# ذاكرة عدد الإشعارات غير المقروءة: مدة الصلاحية (ثوان) تحد من التقادم بين العمال
+app.config['UNREAD_CACHE_TTL'] = float(os.environ.get('UNREAD_CACHE_TTL', 60))
+app.config['UNREAD_CACHE_MAX_SIZE'] = int(os.environ.get('UNREAD_CACHE_MAX_SIZE', 10000))
+# بث الإشعارات (SSE): local = توزيع داخل العملية فقط | sqlite = استطلاع جدول الإشعارات (عدة عمال)
+app.config['NOTIFICATION_BROKER'] = os.environ.get('NOTIFICATION_BROKER', 'local')
+app.config['NOTIFICATION_POLL_INTERVAL'] = float(os.environ.get('NOTIFICATION_POLL_INTERVAL', 1.0))
+app.config['NOTIFICATION_STREAM_HEARTBEAT'] = float(os.environ.get('NOTIFICATION_STREAM_HEARTBEAT', 15))
+app.config['NOTIFICATION_STREAM_QUEUE_SIZE'] = int(os.environ.get('NOTIFICATION_STREAM_QUEUE_SIZE', 100))
+app.config['NOTIFICATION_STREAM_MAX_PER_USER'] = int(os.environ.get('NOTIFICATION_STREAM_MAX_PER_USER', 5))
+# كل اتصال SSE يشغل خيط عامل WSGI (sync/gthread) طوال مدته، لذا تبقى المدة قصيرة
+# ويعيد المتصفح الاتصال تلقائياً مع Last-Event-ID دون فقدان أي إشعار
+app.config['NOTIFICATION_STREAM_MAX_DURATION'] = int(os.environ.get('NOTIFICATION_STREAM_MAX_DURATION', 60))
+# الاحتفاظ بالسجلات: عدد الأيام في القاعدة الرئيسية قبل نقلها إلى قاعدة الأرشيف
+app.config['LOG_RETENTION_DAYS'] = {
+    'activities': int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 90)),
+}
+app.config['LOG_ARCHIVE_PATH'] = os.environ.get('LOG_ARCHIVE_PATH', 'database/invoiceflow_pro_archive.db')
+app.config['LOG_COMPACTION_BATCH_SIZE'] = int(os.environ.get('LOG_COMPACTION_BATCH_SIZE', 1000))
+# ذاكرة ملفات PDF: المجلد والحجم الأقصى (بايت) قبل حذف الأقدم استخداماً
+app.config['PDF_CACHE_DIR'] = os.environ.get('PDF_CACHE_DIR', 'static/invoices')
+app.config['PDF_CACHE_MAX_BYTES'] = int(os.environ.get('PDF_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+# خدمة توليد PDF: عدد العمليات (0 = خيط واحد داخل العملية)، حجم الطابور، ومهلة كل مهمة (ثوان)
+app.config['PDF_WORKERS'] = int(os.environ.get('PDF_WORKERS', 2))
+app.config['PDF_QUEUE_SIZE'] = int(os.environ.get('PDF_QUEUE_SIZE', 32))
+app.config['PDF_JOB_TIMEOUT'] = float(os.environ.get('PDF_JOB_TIMEOUT', 30))
+app.config['PDF_JOB_TTL'] = int(os.environ.get('PDF_JOB_TTL', 600))
+# إنشاء عمليات PDF وتسخينها مع أول طلب تستقبله العملية بدلاً من أول فاتورة
+# (أو استدعاء pdf_service.warm_up() من post_worker_init في إعداد gunicorn)
+app.config['PDF_PREWARM'] = os.environ.get('PDF_PREWARM', '0') == '1'
+# تنزيل الفواتير دفعة واحدة: عدد الفواتير لكل مهمة عامل، والحد الأقصى للفواتير في الطلب
+app.config['PDF_BATCH_SIZE'] = int(os.environ.get('PDF_BATCH_SIZE', 10))
+app.config['PDF_BATCH_MAX_INVOICES'] = int(os.environ.get('PDF_BATCH_MAX_INVOICES', 500))
+# الملف المدمج يُولَّد في مهمة واحدة لا تُرسل شيئاً قبل اكتمالها، فحده أصغر بكثير من ZIP
+app.config['PDF_MERGED_MAX_INVOICES'] = int(os.environ.get('PDF_MERGED_MAX_INVOICES', 50))
+# عدد النصوص العربية المُشكَّلة المحفوظة في كل عملية (اسم البائع، العناوين، أسماء العناصر...)
+app.config['ARABIC_SHAPING_CACHE_SIZE'] = int(os.environ.get('ARABIC_SHAPING_CACHE_SIZE', 4096))
 app.config['LANGUAGES'] = {'ar': 'العربية', 'en': 'English'}
 app.config['SUPPORTED_CURRENCIES'] = {
     'USD': '$', 'SAR': 'ر.س', 'AED': 'د.إ', 'EUR': '€', 'GBP': '£'
 }
 
 # إعدادات الأمان
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.wsgi_app = CompressionMiddleware(
+    ProxyFix(app.wsgi_app, x_proto=1, x_host=1),
+    minimum_size=app.config['COMPRESSION_MIN_SIZE'],
+    level=app.config['COMPRESSION_LEVEL']
+)
 
 # إنشاء المجلدات
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('database', exist_ok=True)
-os.makedirs('static/invoices', exist_ok=True)
+os.makedirs(app.config['PDF_CACHE_DIR'], exist_ok=True)
 os.makedirs('static/qrcodes', exist_ok=True)
 os.makedirs('static/logos', exist_ok=True)
 os.makedirs('static/fonts', exist_ok=True)
@@ -2634,19 +2743,136 @@ class MultiLanguage:
 
 multilang = MultiLanguage()
 
+# ================== ترحيلات مخطط قاعدة البيانات ==================
+def migrate_invoice_soft_delete(cursor):
+    """إضافة أعمدة الحذف المنطقي لقواعد البيانات القديمة"""
+    cursor.execute("PRAGMA table_info(invoices)")
+    invoice_columns = {row[1] for row in cursor.fetchall()}
+    if 'is_deleted' not in invoice_columns:
+        cursor.execute("ALTER TABLE invoices ADD COLUMN is_deleted BOOLEAN DEFAULT 0")
+        cursor.execute("ALTER TABLE invoices ADD COLUMN deleted_at TIMESTAMP")
+
+# الفهارس مشتقة من الاستعلامات الفعلية في HOT_QUERIES
+MIGRATIONS = [
+    (1, 'invoice soft delete columns', migrate_invoice_soft_delete),
+    (2, 'user_stats rollup tables', StatsRollup.create),
+    (3, 'hot query indexes', [
+        # الفواتير الأخيرة: WHERE user_id ORDER BY created_at
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_created ON invoices (user_id, created_at)",
+        # الفواتير المتأخرة: WHERE user_id AND status AND is_deleted AND due_date <
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_status_due ON invoices (user_id, status, is_deleted, due_date)",
+        # جميع الإشعارات والإشعارات غير المقروءة مرتبة بالأحدث
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_read_created ON notifications (user_id, is_read, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_activities_user_created ON activities (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_clients_user_created ON clients (user_id, created_at)",
+    ]),
+    (4, 'null-safe user_stats triggers', StatsRollup.recreate_triggers),
+]
+
 # ================== نظام قاعدة البيانات المحسن ==================
+class DatabaseWriter:
+    """خيط كتابة واحد يستقبل عمليات INSERT/UPDATE/DELETE من طابور"""
+    
+    def __init__(self, database):
+        self.database = database
+        self.queue = Queue()
+        self.pid = None
+        self.thread = None
+        self.start_lock = Lock()
+    
+    def ensure_started(self):
+        """تشغيل خيط الكتابة عند أول استخدام (وبعد fork في عامل جديد)"""
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        
+        with self.start_lock:
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                self.queue = Queue()
+                self.pid = os.getpid()
+                self.thread = Thread(target=self._run, name='db-writer', daemon=True)
+                self.thread.start()
+    
+    def submit(self, query, params, fetchone=False, fetchall=False, commit=True, many=False):
+        """إرسال استعلام كتابة وانتظار نتيجته"""
+        self.ensure_started()
+        future = Future()
+        self.queue.put((query, params, fetchone, fetchall, commit, many, future))
+        return future.result()
+    
+    def _run(self):
+        """حلقة الكتابة: اتصال واحد ينفذ المهام بالترتيب"""
+        conn = None
+        
+        while True:
+            query, params, fetchone, fetchall, commit, many, future = self.queue.get()
+            
+            if not future.set_running_or_notify_cancel():
+                continue
+            
+            try:
+                if conn is None:
+                    conn = self.database.get_connection()
+                future.set_result(self.database.run_query(conn, query, params, fetchone, fetchall, commit, many))
+            except Exception as e:
+                future.set_exception(e)
+
 class EnhancedDatabaseSystem:
+    READ_PREFIXES = ('SELECT', 'WITH', 'EXPLAIN')
+    # WITH ... INSERT و ... RETURNING تبدأ بكلمة قراءة لكنها تكتب، فتذهب لخيط الكتابة
+    WRITE_KEYWORDS = re.compile(
+        r'\b(INSERT|UPDATE|DELETE|UPSERT|RETURNING|CREATE|DROP|ALTER|ATTACH|DETACH|VACUUM|REINDEX|ANALYZE)\b'
+        r'|\bREPLACE\s+INTO\b',
+        re.IGNORECASE
+    )
+    # النصوص والأسماء بين علامات تنصيص لا تُفحص ('UPDATE' كقيمة لا يجعل الاستعلام كتابة)
+    QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+    
     def __init__(self):
         self.db_path = app.config['DATABASE_PATH']
+        self.mode = app.config['DATABASE_CONCURRENCY_MODE']
+        self.busy_timeout = app.config['DATABASE_BUSY_TIMEOUT']
         self.lock = Lock()
+        self.readers = local()
+        self.writer = DatabaseWriter(self)
+        self.bootstrap()
+    
+    def schema_version(self):
+        """قراءة رقم إصدار المخطط دون إنشاء أو تعديل أي شيء"""
+        try:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        except sqlite3.OperationalError:
+            return 0
+        
+        try:
+            return SchemaMigrator.current_version(conn.cursor())
+        except sqlite3.Error:
+            return 0
+        finally:
+            conn.close()
+    
+    def bootstrap(self):
+        """تهيئة المخطط عند الإقلاع حسب DB_BOOTSTRAP_MODE"""
+        if app.config['DB_BOOTSTRAP_MODE'] == 'probe':
+            version = self.schema_version()
+            latest = SchemaMigrator(MIGRATIONS).latest_version
+            if version >= latest:
+                print(f"✅ مخطط قاعدة البيانات محدث (الإصدار {version})")
+                return
+            print(f"⚠️ مخطط قاعدة البيانات قديم ({version} < {latest})، يتم تطبيق التهيئة الآن")
+        
         self.init_database()
     
     def init_database(self):
         """تهيئة قاعدة البيانات مع جداول جديدة"""
         with self.lock:
-            conn = sqlite3.connect(self.db_path)
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
             cursor = conn.cursor()
             
+            # وضع WAL يسمح للقراءات بالعمل بالتوازي مع الكاتب
+            if self.mode == 'wal':
+                cursor.execute("PRAGMA journal_mode=WAL")
+            
             # جدول المستخدمين
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -2727,6 +2953,8 @@ class EnhancedDatabaseSystem:
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     paid_at TIMESTAMP,
+                    is_deleted BOOLEAN DEFAULT 0,
+                    deleted_at TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE,
                     FOREIGN KEY (client_id) REFERENCES clients (id) ON DELETE SET NULL
                 )
@@ -2807,58 +3035,329 @@ class EnhancedDatabaseSystem:
                 ''', ('admin', 'admin@invoiceflow.com', default_hash, 'مدير النظام', 'InvoiceFlow Pro', 'admin', 1))
             
             conn.commit()
+            
+            # تطبيق الترحيلات المرقمة (فهارس، أعمدة جديدة، جداول الإحصائيات)
+            applied = SchemaMigrator(MIGRATIONS).migrate(conn)
             conn.close()
+            
+            if applied:
+                print(f"✅ تم تطبيق الترحيلات: {applied}")
             print("✅ قاعدة البيانات المحسنة جاهزة!")
     
     def get_connection(self):
         """الحصول على اتصال قاعدة البيانات"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, check_same_thread=False)
         conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
         return conn
     
-    def execute_query(self, query, params=(), fetchone=False, fetchall=False, commit=True):
-        """تنفيذ استعلام"""
-        with self.lock:
+    def get_read_connection(self):
+        """اتصال قراءة خاص بكل خيط يُعاد استخدامه بين الطلبات"""
+        conn = getattr(self.readers, 'conn', None)
+        if conn is None or self.readers.pid != os.getpid():
             conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            try:
+            self.readers.conn = conn
+            self.readers.pid = os.getpid()
+        return conn
+    
+    def is_read_query(self, query):
+        """هل الاستعلام قراءة فقط؟ (يبدأ بكلمة قراءة ولا يحتوي أي كلمة تعديل بيانات)"""
+        if not query.lstrip().upper().startswith(self.READ_PREFIXES):
+            return False
+        return not self.WRITE_KEYWORDS.search(self.QUOTED.sub("''", query))
+    
+    def run_query(self, conn, query, params, fetchone, fetchall, commit, many=False, rowset=False):
+        """تنفيذ استعلام على اتصال معين (many: executemany لقائمة من المعاملات، rowset: صفوف fetchall كـ RowSet)"""
+        cursor = conn.cursor()
+        if rowset:
+            cursor.row_factory = None
+        
+        try:
+            if many:
+                cursor.executemany(query, params)
+            else:
                 cursor.execute(query, params)
-                
-                if fetchone:
-                    result = cursor.fetchone()
-                    if result:
-                        result = dict(result)
-                elif fetchall:
-                    results = cursor.fetchall()
-                    result = [dict(row) for row in results]
-                else:
-                    result = None
-                
-                if commit:
-                    conn.commit()
-                else:
-                    conn.rollback()
-                
-                return result
-                
-            except Exception as e:
+            
+            if fetchone:
+                result = cursor.fetchone()
+                if result:
+                    result = dict(result)
+            elif fetchall and rowset:
+                result = RowSet([column[0] for column in cursor.description], cursor.fetchall())
+            elif fetchall:
+                results = cursor.fetchall()
+                result = [dict(row) for row in results]
+            else:
+                result = None
+            
+            if commit:
+                conn.commit()
+            else:
                 conn.rollback()
-                raise e
-            finally:
-                conn.close()
+            
+            return result
+        
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            cursor.close()
+    
+    def execute_query(self, query, params=(), fetchone=False, fetchall=False, commit=True, rowset=False):
+        """تنفيذ استعلام (rowset: نتائج القراءة كـ RowSet بدل قائمة dict)"""
+        if self.mode == 'serialized':
+            # السلوك القديم: قفل عام واتصال جديد لكل استعلام
+            with self.lock:
+                conn = self.get_connection()
+                try:
+                    return self.run_query(conn, query, params, fetchone, fetchall, commit, rowset=rowset)
+                finally:
+                    conn.close()
+        
+        if self.is_read_query(query):
+            return self.run_query(self.get_read_connection(), query, params, fetchone, fetchall, commit,
+                                  rowset=rowset)
+        
+        return self.writer.submit(query, params, fetchone, fetchall, commit)
+    
+    def execute_many(self, query, rows):
+        """تنفيذ استعلام كتابة لعدة صفوف في معاملة واحدة"""
+        if self.mode == 'serialized':
+            with self.lock:
+                conn = self.get_connection()
+                try:
+                    return self.run_query(conn, query, rows, False, False, True, many=True)
+                finally:
+                    conn.close()
+        
+        return self.writer.submit(query, rows, many=True)
 
 db = EnhancedDatabaseSystem()
 
+# ================== أرشفة السجلات ==================
+log_retention = LogRetention(
+    db,
+    app.config['LOG_ARCHIVE_PATH'],
+    app.config['LOG_RETENTION_DAYS'],
+    batch_size=app.config['LOG_COMPACTION_BATCH_SIZE']
+)
+
+# ================== ترقيم الصفحات بالمؤشر ==================
+class KeysetPaginator(invoiceflow_common.KeysetPaginator):
+    """ترقيم الصفحات بالمؤشر على قاعدة db"""
+    
+    database = db
+
 # ================== نظام الإشعارات ==================
+class LocalCounterBackend:
+    """مخزن عدادات داخل العملية: LRU بحد أقصى للحجم ومدة صلاحية لكل مفتاح"""
+    
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+    
+    def get(self, key):
+        """القيمة إن كانت موجودة وصالحة، وإلا None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+    
+    def set(self, key, value):
+        """تخزين القيمة مع مدة صلاحية جديدة وطرد الأقدم استخداماً"""
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def incr(self, key, delta):
+        """تعديل قيمة موجودة فقط؛ المفتاح الغائب يُحسب من القاعدة عند أول قراءة"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                return None
+            value = max(0, entry[0] + delta)
+            self.entries[key] = (value, entry[1])
+            return value
+    
+    def delete(self, key):
+        """حذف المفتاح"""
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def __len__(self):
+        return len(self.entries)
+
+class UnreadCountCache:
+    """عدد الإشعارات غير المقروءة لكل مستخدم؛ أي مخزن يوفر get/set/incr/delete (مثل Redis) يمكن تمريره بدل المخزن المحلي"""
+    
+    COUNT_QUERY = "SELECT COUNT(*) AS unread FROM notifications WHERE user_id = ? AND is_read = 0"
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats_lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def get(self, user_id):
+        """العدد من الذاكرة، أو استعلام COUNT واحد عند الإخفاق"""
+        value = self.backend.get(user_id)
+        with self.stats_lock:
+            self.stats['hits' if value is not None else 'misses'] += 1
+        if value is not None:
+            return value
+        
+        value = db.execute_query(self.COUNT_QUERY, (user_id,), fetchone=True)['unread']
+        self.backend.set(user_id, value)
+        return value
+    
+    def adjust(self, user_id, delta):
+        """تعديل العدد المخزن بعد إنشاء أو قراءة أو حذف إشعار"""
+        self.backend.incr(user_id, delta)
+    
+    def reset(self, user_id, value=0):
+        """تعيين العدد مباشرة (مثل قراءة جميع الإشعارات)"""
+        self.backend.set(user_id, value)
+    
+    def get_stats(self):
+        """عدادات الإصابة والإخفاق"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+
+unread_counts = UnreadCountCache(LocalCounterBackend(
+    max_size=app.config['UNREAD_CACHE_MAX_SIZE'],
+    ttl=app.config['UNREAD_CACHE_TTL']
+))
+
+class NotificationSubscriber:
+    """اتصال SSE واحد: أحداث لم تُرسل بعد بحد أقصى، والأقدم يُسقط عند الامتلاء"""
+    
+    def __init__(self, user_id, max_events):
+        self.user_id = user_id
+        self.events = deque(maxlen=max_events)
+        self.condition = Condition()
+        self.overflowed = False
+    
+    def push(self, event):
+        """إضافة حدث وإيقاظ خيط الاتصال"""
+        with self.condition:
+            if len(self.events) == self.events.maxlen:
+                self.overflowed = True
+            self.events.append(event)
+            self.condition.notify()
+    
+    def wait(self, timeout):
+        """انتظار أحداث جديدة حتى timeout؛ يعيد (الأحداث، هل فُقدت أحداث)"""
+        with self.condition:
+            if not self.events:
+                self.condition.wait(timeout)
+            events, overflowed = list(self.events), self.overflowed
+            self.events.clear()
+            self.overflowed = False
+        return events, overflowed
+
+class NotificationBroker:
+    """توزيع الإشعارات الجديدة على اتصالات SSE المفتوحة في هذه العملية"""
+    
+    def __init__(self, mode='local', poll_interval=1.0, max_events=100, max_connections_per_user=5):
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.max_events = max_events
+        self.max_connections_per_user = max_connections_per_user
+        self.subscribers = {}
+        self.lock = Lock()
+        self.pid = None
+        self.thread = None
+    
+    def subscribe(self, user_id):
+        """تسجيل اتصال جديد؛ None إذا تجاوز المستخدم حد الاتصالات"""
+        if self.mode == 'sqlite':
+            self.ensure_poller()
+        
+        with self.lock:
+            connections = self.subscribers.setdefault(user_id, set())
+            if len(connections) >= self.max_connections_per_user:
+                return None
+            subscriber = NotificationSubscriber(user_id, self.max_events)
+            connections.add(subscriber)
+            return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            connections = self.subscribers.get(subscriber.user_id, set())
+            connections.discard(subscriber)
+            if not connections:
+                self.subscribers.pop(subscriber.user_id, None)
+    
+    def publish(self, event):
+        """إرسال الحدث لكل اتصالات صاحب الإشعار"""
+        with self.lock:
+            targets = list(self.subscribers.get(event['user_id'], ()))
+        for subscriber in targets:
+            subscriber.push(event)
+    
+    def notify_created(self, event):
+        """يُستدعى بعد إنشاء إشعار؛ في وضع sqlite يتكفل الاستطلاع بالتوزيع لكل العمال"""
+        if self.mode == 'local':
+            self.publish(event)
+    
+    def ensure_poller(self):
+        """تشغيل خيط الاستطلاع (مرة لكل عملية، بعد fork في gunicorn)"""
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                row = db.execute_query("SELECT COALESCE(MAX(id), 0) AS last_id FROM notifications", fetchone=True)
+                self.thread = Thread(target=self._poll, args=(row['last_id'],), name='notification-poller', daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+    
+    def _poll(self, last_id):
+        """قراءة الإشعارات الجديدة من كل العمال بالمفتاح الأساسي وتوزيعها محلياً"""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                rows = db.execute_query(
+                    "SELECT * FROM notifications WHERE id > ? ORDER BY id LIMIT 500",
+                    (last_id,), fetchall=True
+                )
+            except sqlite3.Error as e:
+                print(f"خطأ في استطلاع الإشعارات: {e}")
+                continue
+            
+            for row in rows:
+                self.publish(row)
+                last_id = row['id']
+
+notification_broker = NotificationBroker(
+    mode=app.config['NOTIFICATION_BROKER'],
+    poll_interval=app.config['NOTIFICATION_POLL_INTERVAL'],
+    max_events=app.config['NOTIFICATION_STREAM_QUEUE_SIZE'],
+    max_connections_per_user=app.config['NOTIFICATION_STREAM_MAX_PER_USER']
+)
+
 class NotificationSystem:
     @staticmethod
     def create_notification(user_id, notification_type, title, message, data=None):
         """إنشاء إشعار جديد"""
-        return db.execute_query('''
+        notification = db.execute_query('''
             INSERT INTO notifications (user_id, type, title, message, data, created_at)
             VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (user_id, notification_type, title, message, json.dumps(data or {})))
+            RETURNING *
+        ''', (user_id, notification_type, title, message, json.dumps(data or {})), fetchone=True)
+        unread_counts.adjust(user_id, 1)
+        notification_broker.notify_created(notification)
+        return notification
     
     @staticmethod
     def get_user_notifications(user_id, unread_only=False, limit=50):
@@ -2872,47 +3371,117 @@ class NotificationSystem:
         if unread_only:
             query += ' AND is_read = 0'
         
-        query += ' ORDER BY created_at DESC LIMIT ?'
+        query += ' ORDER BY created_at DESC, id DESC LIMIT ?'
         params.append(limit)
         
         return db.execute_query(query, params, fetchall=True)
     
+    @staticmethod
+    def get_notifications_page(user_id, cursor=None, limit=KeysetPaginator.DEFAULT_LIMIT, unread_only=False):
+        """صفحة من إشعارات المستخدم مع مؤشر الصفحة التالية"""
+        where = 'user_id = ? AND is_read = 0' if unread_only else 'user_id = ?'
+        return KeysetPaginator.fetch('notifications', where, (user_id,), cursor=cursor, limit=limit)
+    
     @staticmethod
     def mark_as_read(notification_id):
         """تحديد الإشعار كمقروء"""
-        return db.execute_query(
-            "UPDATE notifications SET is_read = 1 WHERE id = ?",
-            (notification_id,)
+        row = db.execute_query(
+            "UPDATE notifications SET is_read = 1 WHERE id = ? AND is_read = 0 RETURNING user_id",
+            (notification_id,), fetchone=True
         )
+        if row:
+            unread_counts.adjust(row['user_id'], -1)
     
     @staticmethod
     def mark_all_as_read(user_id):
         """تحديد جميع إشعارات المستخدم كمقروءة"""
-        return db.execute_query(
+        db.execute_query(
             "UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0",
             (user_id,)
         )
+        unread_counts.reset(user_id, 0)
     
     @staticmethod
     def delete_notification(notification_id):
         """حذف إشعار"""
-        return db.execute_query(
-            "DELETE FROM notifications WHERE id = ?",
-            (notification_id,)
+        row = db.execute_query(
+            "DELETE FROM notifications WHERE id = ? RETURNING user_id, is_read",
+            (notification_id,), fetchone=True
         )
+        if row and not row['is_read']:
+            unread_counts.adjust(row['user_id'], -1)
 
 # ================== نظام الأنشطة ==================
 class ActivityLogger:
     @staticmethod
     def log_activity(user_id, action, description, request=None):
-        """تسجيل نشاط"""
+        """تسجيل نشاط (يُكتب على دفعات عبر activity_batcher)"""
         ip_address = request.remote_addr if request else None
         user_agent = request.user_agent.string if request else None
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
         
-        return db.execute_query('''
+        activity_batcher.add((user_id, action, description, ip_address, user_agent, created_at))
+    
+    @staticmethod
+    def insert_activities(rows):
+        """كتابة دفعة من الأنشطة في معاملة واحدة"""
+        db.execute_many('''
             INSERT INTO activities (user_id, action, description, ip_address, user_agent, created_at)
-            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (user_id, action, description, ip_address, user_agent))
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+activity_batcher = ActivityBatcher(
+    ActivityLogger.insert_activities,
+    batch_size=app.config['ACTIVITY_BATCH_SIZE'],
+    flush_interval_ms=app.config['ACTIVITY_FLUSH_INTERVAL_MS'],
+    queue_size=app.config['ACTIVITY_QUEUE_SIZE']
+)
+
+# ================== خدمة الإحصائيات ==================
+UserStats = namedtuple('UserStats', [
+    'total_invoices', 'total_revenue', 'pending_invoices',
+    'overdue_invoices', 'monthly_revenue', 'total_clients'
+])
+
+class DashboardStatsService:
+    # صف واحد من user_stats وصف الشهر الحالي من user_monthly_stats؛
+    # الفواتير المتأخرة تعتمد على تاريخ اليوم فتُحسب بعدّ محدود على الفواتير المعلقة
+    STATS_QUERY = """
+        SELECT
+            COALESCE(s.total_invoices, 0) AS total_invoices,
+            COALESCE(s.total_revenue, 0) AS total_revenue,
+            COALESCE(s.pending_invoices, 0) AS pending_invoices,
+            (SELECT COUNT(*) FROM invoices
+             WHERE user_id = u.user_id AND status = 'pending' AND due_date < DATE('now')
+               AND is_deleted = 0) AS overdue_invoices,
+            COALESCE(m.paid_revenue, 0) AS monthly_revenue,
+            COALESCE(s.total_clients, 0) AS total_clients
+        FROM (SELECT ? AS user_id) u
+        LEFT JOIN user_stats s ON s.user_id = u.user_id
+        LEFT JOIN user_monthly_stats m ON m.user_id = u.user_id AND m.month = strftime('%Y-%m', 'now')
+    """
+    
+    @staticmethod
+    def get_user_stats(user_id):
+        """إحصائيات المستخدم لصفحات لوحة التحكم والتقارير والذكاء الاصطناعي"""
+        return UserStats(**db.execute_query(DashboardStatsService.STATS_QUERY, (user_id,), fetchone=True))
+
+# الاستعلامات الساخنة التي يجب أن تستخدم فهرساً (يتحقق منها team_test_system.py)
+HOT_QUERIES = [
+    ('dashboard_stats', DashboardStatsService.STATS_QUERY, (1,)),
+    ('recent_invoices', """SELECT i.*, c.name as client_name
+        FROM invoices i LEFT JOIN clients c ON i.client_id = c.id
+        WHERE i.user_id = ? ORDER BY i.created_at DESC LIMIT 5""", (1,)),
+    ('notifications', "SELECT * FROM notifications WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?", (1, 50)),
+    ('notifications_cursor', "SELECT * FROM notifications WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 51)),
+    ('unread_notifications_cursor', "SELECT * FROM notifications WHERE user_id = ? AND is_read = 0 AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 51)),
+    ('activities_cursor', "SELECT * FROM activities WHERE user_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?", (1, '2024-01-01 00:00:00', 1, 51)),
+    ('unread_count', UnreadCountCache.COUNT_QUERY, (1,)),
+    ('recent_activities', "SELECT * FROM activities WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (1, 5)),
+    ('new_clients', "SELECT * FROM clients WHERE user_id = ? ORDER BY created_at DESC LIMIT 3", (1,)),
+    ('login_lookup', "SELECT * FROM users WHERE username = ? AND is_active = 1", ('admin',)),
+    ('register_lookup', "SELECT id FROM users WHERE username = ? OR email = ?", ('admin', 'admin@invoiceflow.com')),
+]
 
 # ================== نظام المصادقة المحسن ==================
 def login_required(f):
@@ -2949,6 +3518,14 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# ================== الملفات الثابتة ذات البصمة ==================
+static_assets = StaticAssets(os.path.join(app.static_folder, 'css'))
+
+@app.route('/assets/css/<filename>')
+def fingerprinted_asset(filename):
+    """تقديم ملفات CSS ذات البصمة"""
+    return static_assets.send(filename)
+
 # ================== نظام التصميم المحسن ==================
 BASE_CSS = """
 /* ================== إعدادات التصميم الأساسية ================== */
@@ -5127,6 +5704,9 @@ DASHBOARD_CSS = """
 }
 """
 
+static_assets.register('base', BASE_CSS)
+static_assets.register('dashboard', DASHBOARD_CSS)
+
 # ================== قالب لوحة التحكم المحسن ==================
 def get_dashboard_template(title, subtitle, content, current_lang='ar'):
     """إنشاء قالب لوحة التحكم مع دعم اللغات"""
@@ -5139,8 +5719,7 @@ def get_dashboard_template(title, subtitle, content, current_lang='ar'):
     # إحصائيات الإشعارات
     notification_count = 0
     if session.get('user_logged_in'):
-        notifications = NotificationSystem.get_user_notifications(session['user_id'], unread_only=True, limit=10)
-        notification_count = len(notifications)
+        notification_count = unread_counts.get(session['user_id'])
     
     template = f"""
     <!DOCTYPE html>
@@ -5151,10 +5730,9 @@ def get_dashboard_template(title, subtitle, content, current_lang='ar'):
         <title>{title} - InvoiceFlow Pro</title>
         <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
         <link href="https://fonts.googleapis.com/css2?family=Tajawal:wght@300;400;500;700&display=swap" rel="stylesheet">
+        <link href="{static_assets.url('base')}" rel="stylesheet">
+        <link href="{static_assets.url('dashboard')}" rel="stylesheet">
         <style>
-            {BASE_CSS}
-            {DASHBOARD_CSS}
-            
             /* تنسيقات إضافية للغة الإنجليزية */
             [dir="ltr"] .arabic-text {{
                 font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
@@ -5285,7 +5863,7 @@ def get_dashboard_template(title, subtitle, content, current_lang='ar'):
                             <div class="relative">
                                 <button class="notification-btn" onclick="toggleNotifications()">
                                     <i class="fas fa-bell"></i>
-                                    {{{{ '<span class="notification-badge">{}</span>'.format(notification_count) if notification_count > 0 else '' }}}}
+                                    {f'<span class="notification-badge">{notification_count}</span>' if notification_count > 0 else ''}
                                 </button>
                                 
                                 <!-- قائمة الإشعارات -->
@@ -5394,6 +5972,25 @@ def get_dashboard_template(title, subtitle, content, current_lang='ar'):
                 }});
             }}
             
+            // استقبال الإشعارات الجديدة فوراً بدلاً من إعادة تحميل الصفحة
+            if (window.EventSource) {{
+                const notificationStream = new EventSource('{{{{ url_for('notification_stream') }}}}');
+                notificationStream.addEventListener('notification', function(event) {{
+                    const button = document.querySelector('.notification-btn');
+                    let badge = button.querySelector('.notification-badge');
+                    if (!badge) {{
+                        badge = document.createElement('span');
+                        badge.className = 'notification-badge';
+                        badge.textContent = '0';
+                        button.appendChild(badge);
+                    }}
+                    badge.textContent = parseInt(badge.textContent, 10) + 1;
+                }});
+                notificationStream.addEventListener('resync', function() {{
+                    window.location.reload();
+                }});
+            }}
+            
             // تحديد إشعار كمقروء
             function markNotificationAsRead(notificationId) {{
                 fetch('{{{{ url_for('mark_notification_as_read') }}}}', {{
@@ -5483,7 +6080,7 @@ def generate_notifications_list(notifications):
         time_ago = get_time_ago(notification['created_at'])
         
         notifications_html += f"""
-        <div class="notification {{{{ 'unread' if not notification['is_read'] else '' }}}}" data-notification-id="{notification['id']}">
+        <div class="notification {'unread' if not notification['is_read'] else ''}" data-notification-id="{notification['id']}">
             <div class="notification-icon">
                 <i class="{icon_class}"></i>
             </div>
@@ -5492,7 +6089,7 @@ def generate_notifications_list(notifications):
                 <p class="notification-message">{notification['message']}</p>
                 <p class="notification-time">{time_ago}</p>
             </div>
-            {{{{ '<button class="icon-button icon-button-primary" onclick="markNotificationAsRead({})"><i class="fas fa-check"></i></button>'.format(notification['id']) if not notification['is_read'] else '' }}}}
+            {f'<button class="icon-button icon-button-primary" onclick="markNotificationAsRead({notification["id"]})"><i class="fas fa-check"></i></button>' if not notification['is_read'] else ''}
         </div>
         """
     
@@ -5523,335 +6120,479 @@ def get_time_ago(timestamp):
     else:
         return "الآن" if session.get('language', 'ar') == 'ar' else "Just now"
 
-# ================== نظام PDF المحترف ==================
-class ProfessionalPDFGenerator:
-    def __init__(self):
-        # تسجيل الخطوط العربية
+# ================== ذاكرة ملفات PDF ==================
+class InvoicePDFCache:
+    """ملفات PDF على القرص باسم بصمة بيانات الفاتورة؛ أي تعديل يغيّر البصمة فيُولَّد ملف جديد"""
+    
+    # الحقول التي يقرؤها ProfessionalPDFGenerator فقط (pdf_worker.py)
+    INVOICE_FIELDS = (
+        'invoice_number', 'issue_date', 'due_date', 'payment_method', 'status',
+        'client_name', 'client_address', 'client_phone', 'client_email', 'client_tax_number',
+        'items', 'subtotal', 'tax_rate', 'tax_amount', 'discount', 'total_amount', 'notes',
+    )
+    USER_FIELDS = ('company_name', 'address', 'phone', 'email', 'tax_number')
+    # إعادة مسح المجلد دورياً لأن عمال gunicorn الآخرين يكتبون فيه أيضاً
+    RESCAN_INTERVAL = 60
+    
+    def __init__(self, generator, directory, max_bytes):
+        self.generator = generator
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.total_bytes = None
+        self.scanned_at = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def key(self, invoice, user):
+        """sha256 لحقول الفاتورة والبائع وإصدار المولد"""
+        payload = {
+            'invoice': {field: invoice.get(field) for field in self.INVOICE_FIELDS},
+            'user': {field: user.get(field) for field in self.USER_FIELDS},
+            'version': self.generator.VERSION,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def path_for(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+    
+    def lookup(self, invoice, user):
+        """(البصمة، مسار الملف المخزن أو None)"""
+        key = self.key(invoice, user)
+        path = self.path_for(key)
         try:
-            # استخدام خط افتراضي إذا لم تكن الخطوط متوفرة
-            self.arabic_font = "Helvetica"
-        except:
-            self.arabic_font = "Helvetica"
-    
-    def reshape_arabic_text(self, text):
-        """تعديل النص العربي للعرض الصحيح"""
-        if not text:
-            return ""
+            # mtime هو ساعة LRU (atime غير موثوق مع noatime)
+            os.utime(path)
+        except FileNotFoundError:
+            return key, None
         
+        self.count('hits')
+        self.record(invoice, path)
+        return key, path
+    
+    @staticmethod
+    def prepare(invoice):
+        """بيانات المولد: عناصر الفاتورة من نص JSON إلى قائمة"""
+        items = invoice.get('items')
+        return dict(invoice, items=json.loads(items) if isinstance(items, str) else (items or []))
+    
+    def store(self, invoice, key, body):
+        """كتابة PDF مولَّد بشكل ذري وتسجيله في الفاتورة ثم تطبيق حد الحجم"""
+        path = self.path_for(key)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+        
+        self.record(invoice, path)
+        self.evict(len(body))
+        return path
+    
+    def record(self, invoice, path):
+        """تسجيل المسار في الفاتورة وحذف ملف نسختها السابقة"""
+        previous = invoice.get('pdf_path')
+        if previous == path or not invoice.get('id'):
+            return
+        
+        db.execute_query("UPDATE invoices SET pdf_path = ? WHERE id = ?", (path, invoice['id']))
+        if previous:
+            self.remove(previous)
+    
+    def remove(self, path):
+        """حذف ملف من مجلد الذاكرة فقط (المسارات المسجلة خارجه لا تُلمس)"""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+            return
         try:
-            # إعادة تشكيل النص العربي
-            reshaped_text = arabic_reshaper.reshape(text)
-            # عكس النص للعرض من اليمين لليسار
-            bidi_text = get_display(reshaped_text)
-            return bidi_text
-        except:
-            return text
-    
-    def generate_invoice_pdf(self, invoice_data, user_data):
-        """إنشاء فاتورة PDF احترافية"""
-        try:
-            # إنشاء buffer للـ PDF
-            buffer = io.BytesIO()
-            
-            # إنشاء المستند
-            doc = SimpleDocTemplate(
-                buffer,
-                pagesize=A4,
-                rightMargin=20*mm,
-                leftMargin=20*mm,
-                topMargin=20*mm,
-                bottomMargin=20*mm,
-                title=f"Invoice {invoice_data.get('invoice_number', '')}"
-            )
-            
-            styles = getSampleStyleSheet()
-            
-            # إنشاء أنماط مخصصة
-            title_style = ParagraphStyle(
-                'Title',
-                parent=styles['Heading1'],
-                fontSize=24,
-                textColor=colors.black,
-                alignment=1,  # Center
-                spaceAfter=20
-            )
-            
-            # نمط للنصوص العربية
-            arabic_style = ParagraphStyle(
-                'Arabic',
-                parent=styles['Normal'],
-                fontName=self.arabic_font,
-                fontSize=10,
-                textColor=colors.black,
-                alignment=2,  # Right
-                wordWrap='RTL'
-            )
-            
-            # نمط للعناوين
-            heading_style = ParagraphStyle(
-                'Heading',
-                parent=styles['Heading2'],
-                fontSize=14,
-                textColor=colors.black,
-                alignment=2,  # Right
-                spaceAfter=10
-            )
-            
-            # نمط للبيانات
-            data_style = ParagraphStyle(
-                'Data',
-                parent=styles['Normal'],
-                fontSize=10,
-                textColor=colors.black,
-                alignment=2  # Right
-            )
-            
-            elements = []
-            
-            # رأس الفاتورة
-            header_table_data = [
-                [
-                    # معلومات الشركة
-                    Paragraph(f"<b>{self.reshape_arabic_text(user_data.get('company_name', 'شركتي'))}</b>", arabic_style),
-                    # العنوان
-                    Paragraph(f"<b>فاتورة ضريبية</b>", title_style)
-                ]
-            ]
-            
-            header_table = Table(header_table_data, colWidths=[250, 250])
-            header_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 20),
-            ]))
-            
-            elements.append(header_table)
-            elements.append(Spacer(1, 20))
-            
-            # معلومات الشركة والعميل
-            company_info = f"""
-            <b>معلومات البائع:</b><br/>
-            {self.reshape_arabic_text(user_data.get('company_name', 'شركتي'))}<br/>
-            {self.reshape_arabic_text(user_data.get('address', 'العنوان'))}<br/>
-            الهاتف: {user_data.get('phone', '0000000000')}<br/>
-            البريد الإلكتروني: {user_data.get('email', 'info@company.com')}<br/>
-            الرقم الضريبي: {user_data.get('tax_number', '')}
-            """
-            
-            client_info = f"""
-            <b>معلومات العميل:</b><br/>
-            {self.reshape_arabic_text(invoice_data.get('client_name', 'عميل'))}<br/>
-            {self.reshape_arabic_text(invoice_data.get('client_address', 'العنوان'))}<br/>
-            الهاتف: {invoice_data.get('client_phone', '0000000000')}<br/>
-            البريد الإلكتروني: {invoice_data.get('client_email', 'client@email.com')}<br/>
-            الرقم الضريبي: {invoice_data.get('client_tax_number', '')}
-            """
-            
-            info_table_data = [
-                [
-                    Paragraph(company_info, arabic_style),
-                    Paragraph(client_info, arabic_style)
-                ]
-            ]
-            
-            info_table = Table(info_table_data, colWidths=[250, 250])
-            info_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-                ('BACKGROUND', (0, 0), (0, 0), colors.HexColor('#F8F9FA')),
-                ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#F8F9FA')),
-            ]))
-            
-            elements.append(info_table)
-            elements.append(Spacer(1, 20))
-            
-            # تفاصيل الفاتورة
-            details_data = [
-                ['رقم الفاتورة', invoice_data.get('invoice_number', 'INV-0001')],
-                ['تاريخ الإصدار', invoice_data.get('issue_date', datetime.now().strftime('%Y/%m/%d'))],
-                ['تاريخ الاستحقاق', invoice_data.get('due_date', datetime.now().strftime('%Y/%m/%d'))],
-                ['طريقة الدفع', invoice_data.get('payment_method', 'نقدي')],
-                ['الحالة', invoice_data.get('status', 'معلقة')]
-            ]
-            
-            details_table = Table(details_data, colWidths=[100, 100])
-            details_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2C3E50')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#F8F9FA')),
-                ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-                ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 9),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
-            ]))
-            
-            elements.append(details_table)
-            elements.append(Spacer(1, 20))
-            
-            # جدول العناصر
-            items = invoice_data.get('items', [])
-            if not items:
-                items = [
-                    {'name': 'خدمة استشارية', 'description': 'استشارة تقنية متخصصة', 'quantity': 1, 'price': 1000, 'total': 1000},
-                    {'name': 'تصميم جرافيك', 'description': 'تصميم شعار احترافي', 'quantity': 2, 'price': 500, 'total': 1000}
-                ]
-            
-            items_data = [
-                [
-                    'الوصف',
-                    'الكمية', 
-                    'سعر الوحدة',
-                    'المجموع'
-                ]
-            ]
-            
-            for item in items:
-                items_data.append([
-                    self.reshape_arabic_text(item.get('name', '')),
-                    str(item.get('quantity', 1)),
-                    f"{item.get('price', 0):.2f}",
-                    f"{item.get('total', 0):.2f}"
-                ])
-            
-            items_table = Table(items_data, colWidths=[200, 60, 80, 80])
-            items_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2C3E50')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-                ('BACKGROUND', (0, 1), (-1, -2), colors.HexColor('#F8F9FA')),
-                ('TEXTCOLOR', (0, 1), (-1, -2), colors.black),
-                ('GRID', (0, 0), (-1, -2), 0.5, colors.grey),
-                ('ALIGN', (1, 1), (-1, -2), 'RIGHT'),
-            ]))
-            
-            elements.append(items_table)
-            elements.append(Spacer(1, 10))
-            
-            # إضافة المجاميع
-            subtotal = invoice_data.get('subtotal', 2000)
-            tax_rate = invoice_data.get('tax_rate', 15)
-            tax_amount = invoice_data.get('tax_amount', 300)
-            discount = invoice_data.get('discount', 0)
-            total = invoice_data.get('total_amount', 2300)
-            
-            totals_data = [
-                ['', '', 'المجموع الفرعي:', f"{subtotal:.2f}"],
-                ['', '', 'الضريبة:', f"{tax_amount:.2f}"],
-                ['', '', 'الخصم:', f"-{discount:.2f}"],
-                ['', '', '<b>الإجمالي:</b>', f"<b>{total:.2f}</b>"]
-            ]
-            
-            totals_table = Table(totals_data, colWidths=[200, 60, 80, 80])
-            totals_table.setStyle(TableStyle([
-                ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
-                ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
-                ('FONTNAME', (2, -1), (3, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (2, -1), (3, -1), 11),
-                ('TEXTCOLOR', (2, -1), (3, -1), colors.HexColor('#2C3E50')),
-                ('TOPPADDING', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ]))
-            
-            elements.append(totals_table)
-            elements.append(Spacer(1, 20))
-            
-            # الملاحظات
-            if invoice_data.get('notes'):
-                notes_text = f"<b>ملاحظات:</b><br/>{self.reshape_arabic_text(invoice_data.get('notes'))}"
-                elements.append(Paragraph(notes_text, arabic_style))
-                elements.append(Spacer(1, 20))
-            
-            # التوقيعات
-            signatures_data = [
-                [
-                    Paragraph("_________________________<br/>توقيع البائع", data_style),
-                    Paragraph("_________________________<br/>توقيع العميل", data_style)
-                ]
-            ]
-            
-            signatures_table = Table(signatures_data, colWidths=[250, 250])
-            signatures_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('VALIGN', (0, 0), (-1, -1), 'BOTTOM'),
-                ('TOPPADDING', (0, 0), (-1, -1), 40),
-            ]))
-            
-            elements.append(signatures_table)
-            elements.append(Spacer(1, 20))
-            
-            # تذييل الصفحة
-            footer_text = f"""
-            <b>شكراً لتعاملك معنا</b><br/>
-            للاستفسارات: {user_data.get('phone', '')} | {user_data.get('email', '')}<br/>
-            هذه الفاتورة تم إنشاؤها تلقائياً بواسطة نظام InvoiceFlow Pro
-            """
-            
-            elements.append(Paragraph(self.reshape_arabic_text(footer_text), ParagraphStyle(
-                'Footer',
-                parent=styles['Normal'],
-                fontSize=8,
-                textColor=colors.grey,
-                alignment=1,  # Center
-                spaceBefore=20
-            )))
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    def invalidate(self, invoice):
+        """حذف ملف PDF المسجل للفاتورة ومسح invoices.pdf_path؛ لمسارات تعديل الفاتورة وحذفها"""
+        db.execute_query("UPDATE invoices SET pdf_path = NULL WHERE id = ?", (invoice['id'],))
+        if invoice.get('pdf_path'):
+            self.remove(invoice['pdf_path'])
+    
+    def prune(self):
+        """حذف ملفات الفواتير المحذوفة وكل ملف لم يعد مسجلاً في فاتورة؛ يُعيد عدد الملفات المحذوفة"""
+        deleted = db.execute_query(
+            "SELECT id, pdf_path FROM invoices WHERE is_deleted = 1 AND pdf_path IS NOT NULL", fetchall=True
+        )
+        for invoice in deleted:
+            self.invalidate(invoice)
+        
+        recorded = {
+            os.path.abspath(row['pdf_path'])
+            for row in db.execute_query("SELECT pdf_path FROM invoices WHERE pdf_path IS NOT NULL", fetchall=True)
+        }
+        # الملف يُكتب قبل تسجيله في الفاتورة، فالملفات الحديثة تُترك لعامل قد يكون في منتصف التوليد
+        cutoff = time.time() - self.RESCAN_INTERVAL
+        removed = len(deleted)
+        for mtime, _, path in self.entries() if os.path.isdir(self.directory) else ():
+            if mtime < cutoff and os.path.abspath(path) not in recorded:
+                self.remove(path)
+                removed += 1
+        
+        with self.lock:
+            self.total_bytes = None
+        return removed
+    
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+    
+    def entries(self):
+        """(mtime، الحجم، المسار) لملفات الذاكرة فقط (اسمها sha256.pdf)"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pdf') and len(entry.name) == 68:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+    
+    def evict(self, added_bytes=0):
+        """حذف الأقدم استخداماً حتى يعود الحجم الكلي تحت max_bytes"""
+        with self.lock:
+            stale = time.time() - self.scanned_at > self.RESCAN_INTERVAL
+            if self.total_bytes is not None and not stale:
+                self.total_bytes += added_bytes
+                if self.total_bytes <= self.max_bytes:
+                    return 0
             
-            # إنشاء الـ QR Code
+            entries = self.entries()
+            self.total_bytes = sum(size for _, size, _ in entries)
+            self.scanned_at = time.time()
+            evicted = 0
+            for _, size, path in sorted(entries):
+                if self.total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.total_bytes -= size
+                evicted += 1
+            self.stats['evictions'] += evicted
+            return evicted
+    
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, total_bytes=self.total_bytes)
+
+# generator هنا وحدة pdf_worker (إصدار التصميم في بصمة الملف)
+pdf_cache = InvoicePDFCache(pdf_worker, app.config['PDF_CACHE_DIR'], app.config['PDF_CACHE_MAX_BYTES'])
+
+# ================== خدمة توليد PDF ==================
+class PDFQueueFull(Exception):
+    """طابور توليد PDF ممتلئ"""
+
+class PDFRenderService:
+    """توليد PDF في عمليات منفصلة حتى لا يحجز GIL خيوط الطلبات، مع طابور محدود ومهام غير متزامنة"""
+    
+    # الوحدة الوحيدة التي تحتاجها عمليات العمال؛ لا تستورد bot_arabic ولا Flask
+    WORKER_MODULE = 'pdf_worker'
+    POLL_INTERVAL = 0.25
+    
+    def __init__(self, cache, workers=2, queue_size=32, timeout=30, job_ttl=600, batch_size=10, shaping_cache_size=4096):
+        self.cache = cache
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.job_ttl = job_ttl
+        self.batch_size = batch_size
+        self.shaping_cache_size = shaping_cache_size
+        self.lock = Lock()
+        self.pid = None
+        self.executor = None
+        self.slots = None
+        self.jobs = {}
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'rejected': 0, 'batches': 0}
+        # عدادات ArabicTextShaper مجمعة من كل العمال (ذاكرة التشكيل موجودة داخل عمليات العمال)
+        self.shaping_stats = dict.fromkeys(('hits', 'misses', 'evictions', 'skipped'), 0)
+    
+    def ensure_started(self):
+        """إنشاء المجمع مرة لكل عملية (بعد fork في gunicorn)"""
+        with self.lock:
+            if self.pid != os.getpid() or self.executor is None:
+                if self.workers > 0:
+                    # forkserver: العمال يُنسخون من عملية نظيفة بخيط واحد لا من عامل gunicorn متعدد الخيوط
+                    # (خيوط الكتابة والسجلات قد تحمل أقفالاً لحظة fork)، و pdf_worker ومكتباته محملة فيها مسبقاً
+                    context = None
+                    if 'forkserver' in multiprocessing.get_all_start_methods():
+                        context = multiprocessing.get_context('forkserver')
+                        context.set_forkserver_preload([self.WORKER_MODULE])
+                    self.executor = ProcessPoolExecutor(self.workers, mp_context=context,
+                                                        initializer=pdf_worker.init_pdf_worker,
+                                                        initargs=(self.shaping_cache_size,))
+                else:
+                    self.executor = ThreadPoolExecutor(1, thread_name_prefix='pdf-render',
+                                                       initializer=pdf_worker.configure,
+                                                       initargs=(self.shaping_cache_size,))
+                if self.pid != os.getpid():
+                    self.slots = BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+                    self.jobs = {}
+                    self.pid = os.getpid()
+            return self.executor
+    
+    def warm_up(self):
+        """إنشاء العمال وتسخينهم دون انتظار، حتى لا يدفع أول طلب فاتورة كلفة ذلك"""
+        executor = self.ensure_started()
+        if self.workers > 0:
+            # المجمع ينشئ العمليات عند الحاجة: مهمة فارغة لكل عامل تنشئها كلها ويسخنها init_pdf_worker
+            for _ in range(self.workers):
+                executor.submit(os.getpid)
+        else:
+            executor.submit(preload_heavy_modules)
+    
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+    
+    def collect(self, result):
+        """نتيجة المهمة بعد فصل عدادات تشكيل النص المرسلة معها وجمعها"""
+        value, shaping = result
+        with self.lock:
+            for name, count in shaping.items():
+                self.shaping_stats[name] = self.shaping_stats.get(name, 0) + count
+        return value
+    
+    def submit(self, invoice, user):
+        """إرسال مهمة وإرجاع Future ببايتات PDF؛ PDFQueueFull إذا كانت كل الأماكن محجوزة"""
+        return self.submit_call(pdf_worker.render_pdf_job, self.cache.prepare(invoice), dict(user), self.timeout)
+    
+    def submit_call(self, func, *args, wait=None):
+        """إرسال func للعمال بحجز مكان في الطابور؛ مع wait تنتظر الدفعات مكاناً بدلاً من الرفض الفوري"""
+        executor = self.ensure_started()
+        acquired = self.slots.acquire(timeout=wait) if wait else self.slots.acquire(blocking=False)
+        if not acquired:
+            self.count('rejected')
+            raise PDFQueueFull("طابور توليد PDF ممتلئ، حاول لاحقاً")
+        
+        args = (func,) + args
+        try:
             try:
-                # إنشاء QR Code يحتوي على معلومات الفاتورة
-                qr_data = {
-                    'invoice_number': invoice_data.get('invoice_number', ''),
-                    'company': user_data.get('company_name', ''),
-                    'client': invoice_data.get('client_name', ''),
-                    'amount': total,
-                    'date': invoice_data.get('issue_date', ''),
-                    'url': f"https://invoiceflow.pro/invoice/{invoice_data.get('invoice_number', '')}"
-                }
-                
-                qr = qrcode.QRCode(
-                    version=1,
-                    error_correction=qrcode.constants.ERROR_CORRECT_L,
-                    box_size=3,
-                    border=2,
-                )
-                qr.add_data(json.dumps(qr_data, ensure_ascii=False))
-                qr.make(fit=True)
-                
-                qr_img = qr.make_image(fill_color="black", back_color="white")
-                qr_buffer = io.BytesIO()
-                qr_img.save(qr_buffer, format='PNG')
-                qr_buffer.seek(0)
-                
-                # إضافة QR Code إلى PDF
-                qr_image = Image(qr_buffer, width=60, height=60)
-                qr_image.hAlign = 'LEFT'
-                elements.append(qr_image)
-                
-            except Exception as e:
-                print(f"خطأ في إنشاء QR Code: {e}")
-            
-            # بناء المستند
-            doc.build(elements)
-            
-            buffer.seek(0)
-            return buffer
-            
+                future = executor.submit(*args)
+            except BrokenProcessPool:
+                # مات أحد العمال (نفاد الذاكرة مثلاً): مجمع جديد وإعادة المحاولة مرة واحدة
+                with self.lock:
+                    self.executor = None
+                future = self.ensure_started().submit(*args)
+        except BaseException:
+            self.slots.release()
+            raise
+        
+        future.add_done_callback(lambda _: self.slots.release())
+        self.count('submitted')
+        return future
+    
+    @staticmethod
+    def job_id(invoice, key):
+        # المعرف يحمل البصمة، فأي عامل gunicorn يعرف اكتمال المهمة من وجود الملف
+        return f"{invoice['id']}.{key}"
+    
+    @staticmethod
+    def parse_job_id(job_id):
+        """(رقم الفاتورة، البصمة)؛ ValueError إذا كان المعرف غير صالح"""
+        invoice_id, _, key = job_id.partition('.')
+        if not invoice_id.isdigit() or len(key) != 64:
+            raise ValueError("معرف مهمة غير صالح")
+        return int(invoice_id), key
+    
+    def start(self, invoice, user):
+        """بدء مهمة توليد (أو إعادة استخدام مهمة قائمة لنفس البصمة) وإرجاع سجلها"""
+        key, path = self.cache.lookup(invoice, user)
+        job_id = self.job_id(invoice, key)
+        if path:
+            return {'id': job_id, 'path': path, 'error': None, 'done': None}
+        
+        self.ensure_started()
+        with self.lock:
+            now = time.time()
+            for stale_id in [i for i, job in self.jobs.items() if now - job['created'] > self.job_ttl]:
+                del self.jobs[stale_id]
+            job = self.jobs.get(job_id)
+            if job and not job['error']:
+                return job
+        
+        self.cache.count('misses')
+        future = self.submit(invoice, user)
+        job = {'id': job_id, 'user_id': invoice['user_id'], 'created': time.time(),
+               'future': future, 'path': None, 'error': None, 'done': Event()}
+        with self.lock:
+            self.jobs[job_id] = job
+        future.add_done_callback(lambda f: self.finish(job, invoice, key, f))
+        return job
+    
+    def finish(self, job, invoice, key, future):
+        """حفظ نتيجة المهمة في ذاكرة الملفات (يُستدعى عند اكتمال الـ Future)"""
+        try:
+            job['path'] = self.cache.store(invoice, key, self.collect(future.result()))
+            self.count('completed')
+        except pdf_worker.PDFRenderTimeout:
+            job['error'] = 'timeout'
+            self.count('timeouts')
         except Exception as e:
-            print(f"خطأ في إنشاء PDF: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
+            job['error'] = str(e) or e.__class__.__name__
+            self.count('failed')
+        finally:
+            job['done'].set()
+    
+    def render(self, invoice, user):
+        """مسار PDF مع انتظار التوليد (للتنزيل المباشر)؛ PDFQueueFull أو PDFRenderTimeout عند الفشل"""
+        job = self.start(invoice, user)
+        if job['done'] is not None:
+            if not self.wait_finished(job['future'], self.timeout):
+                # المهمة تستمر وتُحفظ نتيجتها لطلب لاحق
+                raise pdf_worker.PDFRenderTimeout()
+            # finish() يحفظ الملف في callback بعد اكتمال الـ Future مباشرة
+            job['done'].wait()
+        if job['error'] == 'timeout':
+            raise pdf_worker.PDFRenderTimeout()
+        if job['error']:
+            raise RuntimeError(job['error'])
+        return job['path']
+    
+    def status(self, job_id):
+        """حالة المهمة: done أو queued أو running أو error، أو None إذا لم تُعرف في هذه العملية"""
+        _, key = self.parse_job_id(job_id)
+        with self.lock:
+            job = self.jobs.get(job_id) if self.pid == os.getpid() else None
+        
+        if job and job['error']:
+            return {'status': 'error', 'error': job['error']}
+        if (job and job['path']) or os.path.exists(self.cache.path_for(key)):
+            return {'status': 'done'}
+        if job:
+            return {'status': 'running' if job['future'].running() else 'queued'}
+        return None
+    
+    def render_batch(self, invoices, user):
+        """مولّد (الفاتورة، مسار PDF) بنفس ترتيب invoices؛ المخزن يعود فوراً والباقي يُولَّد على دفعات
+        من batch_size فاتورة لكل مهمة، مع إبقاء ضعف عدد العمال فقط قيد التنفيذ حتى لا تحتكر الدفعة الطابور"""
+        user = dict(user)
+        lookups = [self.cache.lookup(invoice, user) for invoice in invoices]
+        missing = [index for index, (_, path) in enumerate(lookups) if not path]
+        chunks = deque(missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size))
+        window = max(self.workers, 1) * 2
+        pending = deque()
+        ready = {}
+        self.count('batches')
+        
+        try:
+            for index, invoice in enumerate(invoices):
+                path = lookups[index][1]
+                if path is None:
+                    while index not in ready:
+                        while chunks and len(pending) < window:
+                            indexes = chunks.popleft()
+                            data = [self.cache.prepare(invoices[i]) for i in indexes]
+                            future = self.submit_call(pdf_worker.render_pdf_batch_job, data, user, self.timeout, wait=self.timeout)
+                            pending.append((indexes, future))
+                        
+                        # الدفعات تكتمل بترتيب إرسالها، فالفاتورة المطلوبة في أقدم دفعة معلقة
+                        indexes, future = pending.popleft()
+                        bodies = self.collect(self.wait_result(future, self.timeout))
+                        for i, body in zip(indexes, bodies):
+                            self.cache.count('misses')
+                            ready[i] = self.cache.store(invoices[i], lookups[i][0], body)
+                        self.count('completed')
+                    path = ready.pop(index)
+                yield invoice, path
+        finally:
+            for _, future in pending:
+                future.cancel()
+    
+    def render_merged(self, invoices, user):
+        """مسار ملف PDF مؤقت يضم كل الفواتير (على المستدعي حذفه)، يُولَّد في مهمة واحدة بموارد مشتركة"""
+        fd, path = tempfile.mkstemp(prefix='invoices-', suffix='.pdf')
+        os.close(fd)
+        timeout = self.timeout * math.ceil(len(invoices) / self.batch_size)
+        self.count('batches')
+        try:
+            data = [self.cache.prepare(invoice) for invoice in invoices]
+            future = self.submit_call(pdf_worker.render_merged_pdf_job, data, dict(user), timeout, path, wait=self.timeout)
+            self.collect(self.wait_result(future, timeout))
+        except BaseException:
+            os.remove(path)
+            raise
+        
+        self.count('completed')
+        return path
+    
+    def wait_finished(self, future, timeout):
+        """انتظار اكتمال Future؛ المهلة تُحسب من بدء تشغيل المهمة لا من انتظارها في الطابور. False عند تجاوزها"""
+        # المجمع يعلّم المهمة running عند نقلها لطابور العمال وقد تسبقها هناك مهمة واحدة، فتُضاف مهلتها
+        queued_limit = self.timeout * math.ceil((self.queue_size + 1) / max(self.workers, 1))
+        queued_at = time.monotonic()
+        started_at = None
+        while not futures_wait([future], self.POLL_INTERVAL).done:
+            now = time.monotonic()
+            if future.running():
+                started_at = started_at or now
+                if now - started_at > timeout + self.timeout + 5:
+                    return False
+            elif now - queued_at > queued_limit:
+                return False
+        return True
+    
+    def wait_result(self, future, timeout):
+        """نتيجة Future مع توحيد أخطاء المهلة في PDFRenderTimeout"""
+        try:
+            if not self.wait_finished(future, timeout):
+                raise FutureTimeoutError()
+            return future.result()
+        except (pdf_worker.PDFRenderTimeout, FutureTimeoutError):
+            future.cancel()
+            self.count('timeouts')
+            raise pdf_worker.PDFRenderTimeout()
+        except Exception:
+            self.count('failed')
+            raise
+    
+    def get_stats(self):
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if not job['done'].is_set())
+            shaping = dict(self.shaping_stats)
+        total = shaping['hits'] + shaping['misses']
+        shaping['hit_rate'] = shaping['hits'] / total if total else 0.0
+        return dict(self.stats, pending=pending, workers=self.workers, arabic_shaping=shaping)
+
+class ZipStream:
+    """هدف كتابة لـ zipfile لا يدعم seek: يجمع البايتات المكتوبة لتُبث وتُفرَّغ بعد كل ملف"""
+    
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+    
+    def write(self, data):
+        self.buffer.extend(data)
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+pdf_service = PDFRenderService(
+    pdf_cache,
+    workers=app.config['PDF_WORKERS'],
+    queue_size=app.config['PDF_QUEUE_SIZE'],
+    timeout=app.config['PDF_JOB_TIMEOUT'],
+    job_ttl=app.config['PDF_JOB_TTL'],
+    batch_size=app.config['PDF_BATCH_SIZE'],
+    shaping_cache_size=app.config['ARABIC_SHAPING_CACHE_SIZE']
+)
 
 # ================== الصفحات الرئيسية ==================
 
@@ -5983,9 +6724,8 @@ def login():
         <title>InvoiceFlow Pro - تسجيل الدخول</title>
         <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
         <link href="https://fonts.googleapis.com/css2?family=Tajawal:wght@300;400;500;700&display=swap" rel="stylesheet">
+        <link href="{{ css_url }}" rel="stylesheet">
         <style>
-            {{ css }}
-            
             .login-container {
                 min-height: 100vh;
                 display: flex;
@@ -6246,7 +6986,7 @@ def login():
     </html>
     """
     
-    return render_template_string(html, css=BASE_CSS)
+    return render_template_string(html, css_url=static_assets.url('base'))
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -6347,9 +7087,8 @@ def register():
         <title>InvoiceFlow Pro - إنشاء حساب</title>
         <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
         <link href="https://fonts.googleapis.com/css2?family=Tajawal:wght@300;400;500;700&display=swap" rel="stylesheet">
+        <link href="{{ css_url }}" rel="stylesheet">
         <style>
-            {{ css }}
-            
             .register-container {
                 min-height: 100vh;
                 display: flex;
@@ -6744,7 +7483,7 @@ def register():
     </html>
     """
     
-    return render_template_string(html, css=BASE_CSS)
+    return render_template_string(html, css_url=static_assets.url('base'))
 
 # ================== API للغة ==================
 @app.route('/api/set-language', methods=['POST'])
@@ -6802,6 +7541,265 @@ def mark_all_notifications_as_read():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/notifications', methods=['GET'])
+@login_required
+def list_notifications():
+    """قائمة الإشعارات بترقيم المؤشر"""
+    try:
+        notifications, next_cursor = NotificationSystem.get_notifications_page(
+            session['user_id'],
+            cursor=request.args.get('cursor'),
+            limit=KeysetPaginator.parse_limit(request.args.get('limit')),
+            unread_only=request.args.get('unread') == '1'
+        )
+        return jsonify({'success': True, 'notifications': notifications, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/activities', methods=['GET'])
+@login_required
+def list_activities():
+    """سجل الأنشطة بترقيم المؤشر"""
+    try:
+        # السجلات المؤرشفة بـ compact-logs جزء من التاريخ نفسه
+        activities, next_cursor = log_retention.page(
+            'activities', session['user_id'],
+            cursor=request.args.get('cursor'),
+            limit=KeysetPaginator.parse_limit(request.args.get('limit'))
+        )
+        return jsonify({'success': True, 'activities': activities, 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/notifications/stream')
+@login_required
+def notification_stream():
+    """بث الإشعارات الجديدة عبر Server-Sent Events"""
+    user_id = session['user_id']
+    subscriber = notification_broker.subscribe(user_id)
+    if subscriber is None:
+        return jsonify({'success': False, 'error': 'تم تجاوز عدد الاتصالات المفتوحة'}), 429
+    
+    # الاستئناف بعد انقطاع: الإشعارات التي فاتت منذ آخر حدث استلمه المتصفح
+    backlog = []
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        try:
+            backlog = db.execute_query(
+                "SELECT * FROM notifications WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (user_id, int(last_event_id), notification_broker.max_events), fetchall=True
+            )
+        except Exception:
+            notification_broker.unsubscribe(subscriber)
+            raise
+    backlog_ids = {row['id'] for row in backlog}
+    
+    heartbeat = app.config['NOTIFICATION_STREAM_HEARTBEAT']
+    deadline = time.monotonic() + app.config['NOTIFICATION_STREAM_MAX_DURATION']
+    
+    def format_event(notification):
+        return f"id: {notification['id']}\nevent: notification\ndata: {json.dumps(notification, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        yield "retry: 5000\n\n"
+        for notification in backlog:
+            yield format_event(notification)
+        
+        # يُغلق الاتصال بعد مدة قصوى ويعيد المتصفح الاتصال تلقائياً مع Last-Event-ID
+        while time.monotonic() < deadline:
+            events, overflowed = subscriber.wait(heartbeat)
+            if overflowed:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            if not events:
+                yield ": heartbeat\n\n"
+                continue
+            for notification in events:
+                if notification['id'] not in backlog_ids:
+                    yield format_event(notification)
+    
+    # الإغلاق يُستدعى دائماً من خادم WSGI، حتى لو لم يبدأ المولد (HEAD) أو انقطع العميل مبكراً
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: notification_broker.unsubscribe(subscriber))
+    return response
+
+# ================== تنزيل الفواتير ==================
+def load_invoice_for_pdf(invoice_id):
+    """الفاتورة (للمستخدم الحالي فقط) وبيانات البائع، أو (None, None)"""
+    invoice = db.execute_query(
+        "SELECT * FROM invoices WHERE id = ? AND user_id = ? AND is_deleted = 0",
+        (invoice_id, session['user_id']),
+        fetchone=True
+    )
+    if not invoice:
+        return None, None
+    user = db.execute_query("SELECT * FROM users WHERE id = ?", (session['user_id'],), fetchone=True) or {}
+    return invoice, user
+
+@app.route('/invoice/<int:invoice_id>/pdf')
+@login_required
+def download_invoice_pdf(invoice_id):
+    """تنزيل فاتورة PDF؛ من ذاكرة الملفات إذا لم تتغير، وإلا تُولَّد في خدمة PDF مع الانتظار"""
+    invoice, user = load_invoice_for_pdf(invoice_id)
+    if not invoice:
+        abort(404)
+    
+    try:
+        path = pdf_service.render(invoice, user)
+    except PDFQueueFull:
+        return Response("خدمة PDF مشغولة، حاول بعد قليل", status=503, headers={'Retry-After': '5'})
+    except pdf_worker.PDFRenderTimeout:
+        return Response("استغرق توليد PDF وقتاً أطول من المسموح", status=504)
+    except RuntimeError:
+        abort(500)
+    
+    return send_file(os.path.abspath(path), mimetype='application/pdf', as_attachment=True,
+                     download_name=f"{invoice['invoice_number']}.pdf", max_age=0)
+
+@app.route('/api/invoices/<int:invoice_id>/pdf', methods=['POST'])
+@login_required
+def start_invoice_pdf_job(invoice_id):
+    """بدء توليد PDF في الخلفية وإرجاع معرف المهمة ورابط متابعتها"""
+    invoice, user = load_invoice_for_pdf(invoice_id)
+    if not invoice:
+        return jsonify({'success': False, 'error': 'الفاتورة غير موجودة'}), 404
+    
+    try:
+        job = pdf_service.start(invoice, user)
+    except PDFQueueFull as e:
+        return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '5'}
+    
+    return jsonify({
+        'success': True,
+        'job_id': job['id'],
+        'status_url': url_for('pdf_job_status', job_id=job['id'])
+    }), 202
+
+@app.route('/api/pdf-jobs/<job_id>', methods=['GET'])
+@login_required
+def pdf_job_status(job_id):
+    """حالة مهمة توليد PDF، مع رابط التنزيل عند اكتمالها"""
+    try:
+        invoice_id, _ = PDFRenderService.parse_job_id(job_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    invoice, _ = load_invoice_for_pdf(invoice_id)
+    state = pdf_service.status(job_id) if invoice else None
+    if state is None:
+        # مهمة انتهت صلاحيتها أو بدأت في عامل آخر ولم تكتمل بعد: يمكن إعادة إرسالها بأمان
+        return jsonify({'success': False, 'error': 'المهمة غير معروفة'}), 404
+    
+    if state['status'] == 'done':
+        state['download_url'] = url_for('download_invoice_pdf', invoice_id=invoice_id)
+    return jsonify(dict(state, success=True, job_id=job_id))
+
+def select_batch_invoices(user_id, values, limit):
+    """فواتير التنزيل الجماعي حسب ids (مفصولة بفواصل) أو date_from/date_to/status؛ ValueError للمدخلات غير الصالحة"""
+    where = ["user_id = ?", "is_deleted = 0"]
+    params = [user_id]
+    
+    ids = [value.strip() for raw in values.getlist('ids') for value in raw.split(',') if value.strip()]
+    if ids:
+        if not all(value.isdigit() for value in ids):
+            raise ValueError("ids يجب أن تكون أرقاماً")
+        if len(ids) > limit:
+            raise ValueError(f"الحد الأقصى {limit} فاتورة في الدفعة")
+        where.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(int(value) for value in ids)
+    
+    for name, condition in (('date_from', "issue_date >= ?"), ('date_to', "issue_date <= ?")):
+        if values.get(name):
+            try:
+                params.append(date.fromisoformat(values[name]).isoformat())
+            except ValueError:
+                raise ValueError(f"{name} يجب أن يكون بصيغة YYYY-MM-DD")
+            where.append(condition)
+    
+    if values.get('status'):
+        where.append("status = ?")
+        params.append(values['status'])
+    
+    if len(where) == 2:
+        raise ValueError("حدد ids أو date_from/date_to أو status")
+    
+    invoices = db.execute_query(
+        f"SELECT * FROM invoices WHERE {' AND '.join(where)} ORDER BY issue_date, id LIMIT ?",
+        params + [limit + 1],
+        fetchall=True
+    )
+    if len(invoices) > limit:
+        raise ValueError(f"الحد الأقصى {limit} فاتورة في الدفعة")
+    return invoices
+
+@app.route('/invoices/batch-pdf', methods=['GET', 'POST'])
+@login_required
+def download_invoices_batch():
+    """تنزيل عدة فواتير كملف ZIP (PDF لكل فاتورة) أو كملف PDF واحد مدمج (format=pdf)، مع البث أثناء التوليد"""
+    output = request.values.get('format', 'zip')
+    if output not in ('zip', 'pdf'):
+        return jsonify({'success': False, 'error': 'format يجب أن يكون zip أو pdf'}), 400
+    
+    try:
+        limit = app.config['PDF_MERGED_MAX_INVOICES' if output == 'pdf' else 'PDF_BATCH_MAX_INVOICES']
+        invoices = select_batch_invoices(session['user_id'], request.values, limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if not invoices:
+        return jsonify({'success': False, 'error': 'لا توجد فواتير مطابقة'}), 404
+    
+    user = db.execute_query("SELECT * FROM users WHERE id = ?", (session['user_id'],), fetchone=True) or {}
+    filename = f"invoices-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{output}"
+    
+    try:
+        if output == 'pdf':
+            path = pdf_service.render_merged(invoices, user)
+        else:
+            # أول ملف يُولَّد قبل بدء الاستجابة حتى تظهر أخطاء الطابور كرمز حالة لا كملف مقطوع
+            batch = pdf_service.render_batch(invoices, user)
+            first = next(batch)
+    except PDFQueueFull:
+        return Response("خدمة PDF مشغولة، حاول بعد قليل", status=503, headers={'Retry-After': '5'})
+    except pdf_worker.PDFRenderTimeout:
+        return Response("استغرق توليد PDF وقتاً أطول من المسموح", status=504)
+    except RuntimeError:
+        abort(500)
+    
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'}
+    
+    if output == 'pdf':
+        def stream_file():
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(64 * 1024), b''):
+                    yield block
+        
+        headers['Content-Length'] = str(os.path.getsize(path))
+        # الحذف عند الإغلاق يشمل طلبات HEAD وانقطاع العميل قبل اكتمال البث
+        response = Response(stream_file(), mimetype='application/pdf', headers=headers)
+        response.call_on_close(lambda: os.remove(path))
+        return response
+    
+    def stream_zip():
+        stream = ZipStream()
+        names = set()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+            try:
+                for invoice, path in chain([first], batch):
+                    name = re.sub(r'[^\w.-]+', '_', str(invoice['invoice_number'])) or str(invoice['id'])
+                    if name in names:
+                        name = f"{name}_{invoice['id']}"
+                    names.add(name)
+                    archive.write(path, f"{name}.pdf")
+                    yield stream.drain()
+            except (PDFQueueFull, pdf_worker.PDFRenderTimeout, RuntimeError) as e:
+                # رمز الحالة أُرسل مع أول ملف؛ يُقطع الاتصال فيظهر التنزيل فاشلاً بدلاً من أرشيف ناقص
+                print(f"خطأ في توليد ZIP للفواتير بعد {len(names)} من {len(invoices)}: {type(e).__name__} {e}")
+                raise
+        yield stream.drain()
+    
+    return Response(stream_zip(), mimetype='application/zip', headers=headers)
+
 # ================== لوحة التحكم المحسنة ==================
 @app.route('/dashboard')
 @login_required
@@ -6812,37 +7810,7 @@ def dashboard():
     t = lambda key: multilang.get_text(key, lang)
     
     # إحصائيات المستخدم
-    stats = {
-        'total_invoices': db.execute_query(
-            "SELECT COUNT(*) FROM invoices WHERE user_id = ?", 
-            (user_id,), fetchone=True
-        )['COUNT(*)'] or 0,
-        
-        'total_revenue': db.execute_query(
-            "SELECT COALESCE(SUM(total_amount), 0) FROM invoices WHERE user_id = ? AND status = 'paid'", 
-            (user_id,), fetchone=True
-        )['COALESCE(SUM(total_amount), 0)'] or 0,
-        
-        'pending_invoices': db.execute_query(
-            "SELECT COUNT(*) FROM invoices WHERE user_id = ? AND status = 'pending'", 
-            (user_id,), fetchone=True
-        )['COUNT(*)'] or 0,
-        
-        'total_clients': db.execute_query(
-            "SELECT COUNT(*) FROM clients WHERE user_id = ?", 
-            (user_id,), fetchone=True
-        )['COUNT(*)'] or 0,
-        
-        'overdue_invoices': db.execute_query(
-            "SELECT COUNT(*) FROM invoices WHERE user_id = ? AND status = 'pending' AND due_date < DATE('now')",
-            (user_id,), fetchone=True
-        )['COUNT(*)'] or 0,
-        
-        'monthly_revenue': db.execute_query(
-            "SELECT COALESCE(SUM(total_amount), 0) FROM invoices WHERE user_id = ? AND status = 'paid' AND strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now')",
-            (user_id,), fetchone=True
-        )['COALESCE(SUM(total_amount), 0)'] or 0
-    }
+    stats = DashboardStatsService.get_user_stats(user_id)
     
     # الفواتير الأخيرة
     recent_invoices = db.execute_query(
@@ -6859,13 +7827,7 @@ def dashboard():
     recent_notifications = NotificationSystem.get_user_notifications(user_id, limit=3)
     
     # الأنشطة الحديثة
-    recent_activities = db.execute_query(
-        """SELECT * FROM activities 
-           WHERE user_id = ? 
-           ORDER BY created_at DESC 
-           LIMIT 5""",
-        (user_id,), fetchall=True
-    )
+    recent_activities = log_retention.recent('activities', user_id, 5)
     
     # العملاء الجدد
     new_clients = db.execute_query(
@@ -6884,7 +7846,7 @@ def dashboard():
             <div class="stat-icon">
                 <i class="fas fa-file-invoice-dollar"></i>
             </div>
-            <div class="stat-number">{stats['total_invoices']}</div>
+            <div class="stat-number">{stats.total_invoices}</div>
             <p class="stat-label">{t('total_invoices')}</p>
             <div class="stat-change positive">
                 <i class="fas fa-arrow-up"></i>
@@ -6896,7 +7858,7 @@ def dashboard():
             <div class="stat-icon">
                 <i class="fas fa-dollar-sign"></i>
             </div>
-            <div class="stat-number">${stats['total_revenue']:,.0f}</div>
+            <div class="stat-number">${stats.total_revenue:,.0f}</div>
             <p class="stat-label">{t('total_revenue')}</p>
             <div class="stat-change positive">
                 <i class="fas fa-arrow-up"></i>
@@ -6908,7 +7870,7 @@ def dashboard():
             <div class="stat-icon">
                 <i class="fas fa-clock"></i>
             </div>
-            <div class="stat-number">{stats['pending_invoices']}</div>
+            <div class="stat-number">{stats.pending_invoices}</div>
             <p class="stat-label">{t('pending_invoices')}</p>
             <div class="stat-change negative">
                 <i class="fas fa-arrow-down"></i>
@@ -6920,7 +7882,7 @@ def dashboard():
             <div class="stat-icon">
                 <i class="fas fa-users"></i>
             </div>
-            <div class="stat-number">{stats['total_clients']}</div>
+            <div class="stat-number">{stats.total_clients}</div>
             <p class="stat-label">{t('total_clients')}</p>
             <div class="stat-change positive">
                 <i class="fas fa-arrow-up"></i>
@@ -6966,11 +7928,11 @@ def dashboard():
             <div class="space-y-4">
                 <div class="flex items-center justify-between">
                     <span class="text-muted">{t('invoices_this_month')}:</span>
-                    <span class="font-bold">{stats['monthly_revenue'] / 1000 if stats['monthly_revenue'] > 0 else 0}K</span>
+                    <span class="font-bold">{stats.monthly_revenue / 1000 if stats.monthly_revenue > 0 else 0}K</span>
                 </div>
                 <div class="flex items-center justify-between">
                     <span class="text-muted">{t('revenue_this_month')}:</span>
-                    <span class="font-bold text-success">${stats['monthly_revenue']:,.0f}</span>
+                    <span class="font-bold text-success">${stats.monthly_revenue:,.0f}</span>
                 </div>
                 <div class="flex items-center justify-between">
                     <span class="text-muted">{t('new_clients')}:</span>
@@ -6979,8 +7941,8 @@ def dashboard():
                 <div class="flex items-center justify-between">
                     <span class="text-muted">{t('collection_rate')}:</span>
                     <span class="font-bold text-warning">{
-                        f"{((stats['total_invoices'] - stats['pending_invoices']) / stats['total_invoices'] * 100):.1f}%" 
-                        if stats['total_invoices'] > 0 else "0%"
+                        f"{((stats.total_invoices - stats.pending_invoices) / stats.total_invoices * 100):.1f}%" 
+                        if stats.total_invoices > 0 else "0%"
                     }</span>
                 </div>
             </div>
@@ -7113,13 +8075,70 @@ def dashboard():
             content,
             lang
         ),
-        css=BASE_CSS,
         generate_notifications_list=generate_notifications_list,
         get_time_ago=get_time_ago,
         datetime=datetime,
         t=t
     )
 
+if app.config['PRELOAD_HEAVY_MODULES']:
+    preload_heavy_modules()
+
+if app.config['PDF_PREWARM']:
+    @app.before_request
+    def prewarm_pdf_workers():
+        """تسخين عمال PDF مع أول طلب في كل عملية (المجمع يُنشأ مرة لكل pid)"""
+        if pdf_service.pid != os.getpid():
+            pdf_service.warm_up()
+
+# ================== أوامر الإدارة ==================
+@app.cli.command('init-db')
+def init_db_command():
+    """إنشاء الجداول وتطبيق الترحيلات مرة واحدة قبل تشغيل العمال: flask --app bot_arabic init-db"""
+    db.init_database()
+
+@app.cli.command('rollups')
+@click.argument('action', type=click.Choice(['verify', 'rebuild']))
+def rollups_command(action):
+    """التحقق من جداول الإحصائيات أو إعادة بنائها: flask --app bot_arabic rollups verify"""
+    conn = db.get_connection()
+    try:
+        cursor = conn.cursor()
+        
+        if action == 'rebuild':
+            cursor.execute("BEGIN IMMEDIATE")
+            StatsRollup.rebuild(cursor)
+            conn.commit()
+            print("✅ تمت إعادة بناء جداول الإحصائيات")
+        
+        drift = StatsRollup.verify(cursor)
+    finally:
+        conn.close()
+    
+    if not drift:
+        print("✅ جداول الإحصائيات مطابقة لجدول الفواتير")
+        return
+    
+    print(f"❌ تم العثور على {len(drift)} فرق:")
+    for item in drift[:50]:
+        print(f"   {item['table']} {item['key']} {item['column']}: "
+              f"المخزن={item['stored']} المتوقع={item['expected']}")
+    raise SystemExit(1)
+
+@app.cli.command('compact-logs')
+@click.option('--table', 'tables', multiple=True, type=click.Choice(sorted(app.config['LOG_RETENTION_DAYS'])),
+              help="جدول محدد (الافتراضي: كل الجداول)")
+def compact_logs_command(tables):
+    """نقل السجلات الأقدم من مدة الاحتفاظ إلى قاعدة الأرشيف: flask --app bot_arabic compact-logs"""
+    for table, moved in log_retention.compact(tables).items():
+        print(f"✅ {table}: تم نقل {moved} صف إلى الأرشيف (الاحتفاظ {log_retention.retention_days[table]} يوم)")
+
+@app.cli.command('prune-pdf-cache')
+def prune_pdf_cache_command():
+    """حذف ملفات PDF للفواتير المحذوفة والنسخ القديمة من ذاكرة الملفات: flask --app bot_arabic prune-pdf-cache"""
+    removed = pdf_cache.prune()
+    print(f"✅ تم حذف {removed} ملف PDF من {pdf_cache.directory}")
+
 # ================== تشغيل التطبيق ==================
 if __name__ == '__main__':
     try:
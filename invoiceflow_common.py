@@ -0,0 +1,869 @@
+"""
+المكونات المشتركة بين app.py و bot_arabic.py - InvoiceFlow
+الإصدار: 1.0.0
+
+الضغط، تسلسل JSON، الإحصائيات التراكمية، الترحيلات، أرشفة السجلات،
+ترقيم الصفحات بالمؤشر، الملفات الثابتة ذات البصمة، والكتابة على دفعات.
+كل تطبيق يستورد الأصناف من هنا ويربطها بقاعدة بياناته وإعداداته.
+"""
+
+import os
+import re
+import json
+import time
+import base64
+import gzip
+import zlib
+import atexit
+import hashlib
+import sqlite3
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from datetime import datetime, date, timedelta
+from threading import Thread, Lock, Event
+from queue import Queue, Empty, Full
+from flask import request, url_for, abort, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import Headers
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ================== ضغط الاستجابات ==================
+class CompressionMiddleware:
+    """ضغط استجابات WSGI بـ brotli (إن توفرت المكتبة) أو gzip حسب Accept-Encoding"""
+    
+    COMPRESSIBLE_TYPES = (
+        'text/', 'application/json', 'application/javascript', 'application/x-ndjson',
+        'application/xml', 'image/svg+xml'
+    )
+    # البث المستمر (SSE) لا يُضغط: الضاغط يؤخر الأحداث ويحجز ذاكرة طوال الاتصال
+    EXCLUDED_TYPES = ('text/event-stream',)
+    
+    def __init__(self, wsgi_app, minimum_size=500, level=6):
+        self.wsgi_app = wsgi_app
+        self.minimum_size = minimum_size
+        self.level = level
+    
+    @staticmethod
+    def negotiate(accept_encoding):
+        """اختيار أفضل ترميز يقبله العميل"""
+        accepted = {}
+        for part in accept_encoding.lower().split(','):
+            name, _, params = part.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip()] = quality
+        
+        if brotli is not None and accepted.get('br', 0) > 0:
+            return 'br'
+        if accepted.get('gzip', 0) > 0:
+            return 'gzip'
+        return None
+    
+    def should_compress(self, status, headers):
+        """هل الاستجابة قابلة للضغط؟"""
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+        
+        content_type = headers.get('Content-Type', '')
+        if not content_type.startswith(self.COMPRESSIBLE_TYPES) or content_type.startswith(self.EXCLUDED_TYPES):
+            return False
+        if 'Content-Encoding' in headers or 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        
+        length = headers.get('Content-Length')
+        return length is None or int(length) >= self.minimum_size
+    
+    def compressor(self, encoding):
+        """دالتا الضغط والإنهاء للترميز المختار"""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=min(self.level, 11))
+            return compressor.process, compressor.flush, compressor.finish
+        
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    
+    def stream(self, app_iter, encoding):
+        """ضغط الاستجابات المتدفقة جزءاً بجزء مع تفريغ كل جزء فوراً"""
+        compress, flush, finish = self.compressor(encoding)
+        try:
+            for chunk in app_iter:
+                if chunk:
+                    yield compress(chunk) + flush()
+            yield finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+    
+    @staticmethod
+    def write_unsupported(data):
+        raise RuntimeError("CompressionMiddleware لا يدعم write() القديمة في WSGI")
+    
+    def __call__(self, environ, start_response):
+        encoding = self.negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+        
+        captured = {}
+        
+        def capture_start_response(status, headers, exc_info=None):
+            captured.update(status=status, headers=headers, exc_info=exc_info)
+            return self.write_unsupported
+        
+        app_iter = self.wsgi_app(environ, capture_start_response)
+        status, exc_info = captured['status'], captured['exc_info']
+        headers = Headers(captured['headers'])
+        
+        if not self.should_compress(status, headers):
+            start_response(status, captured['headers'], exc_info)
+            return app_iter
+        
+        headers['Content-Encoding'] = encoding
+        vary = headers.get('Vary')
+        headers['Vary'] = f"{vary}, Accept-Encoding" if vary else 'Accept-Encoding'
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = f"W/{etag}"
+        
+        # الاستجابات معروفة الطول تُضغط دفعة واحدة، والمتدفقة تُضغط أثناء الإرسال
+        if 'Content-Length' in headers:
+            try:
+                body = b''.join(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            compress, _, finish = self.compressor(encoding)
+            body = compress(body) + finish()
+            headers['Content-Length'] = str(len(body))
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return [body]
+        
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return self.stream(app_iter, encoding)
+
+# ================== تسلسل JSON ==================
+class RowSet:
+    """نتيجة استعلام كصفوف tuple مع أسماء الأعمدة؛ لا يُبنى dict لكل صف إلا عند القراءة أو التسلسل"""
+    
+    __slots__ = ('columns', 'rows')
+    
+    def __init__(self, columns, rows):
+        self.columns = tuple(columns)
+        self.rows = rows
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RowSet(self.columns, self.rows[index])
+        return dict(zip(self.columns, self.rows[index]))
+    
+    def __iter__(self):
+        columns = self.columns
+        return (dict(zip(columns, row)) for row in self.rows)
+    
+    def to_list(self):
+        """قائمة dict للتسلسل، مبنية مباشرة من الـ tuples"""
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify عبر orjson إذا كان مثبتاً (وإلا json القياسي)، مع دعم RowSet والتواريخ و Decimal"""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, RowSet):
+            return o.to_list()
+        if isinstance(o, sqlite3.Row):
+            return dict(o)
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return str(o)
+        if isinstance(o, tuple):
+            return list(o)
+        return DefaultJSONProvider.default(o)
+    
+    def orjson_options(self, pretty=False):
+        """خيارات orjson المقابلة لإعدادات المزود (sort_keys و compact)"""
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+    
+    def dumps(self, obj, **kwargs):
+        # معاملات json.dumps الخاصة (مثل separators لكوكي الجلسة) تبقى على المكتبة القياسية
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.orjson_options()).decode('utf-8')
+    
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(obj, default=self.default, option=self.orjson_options(pretty) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+# ================== جداول الإحصائيات التراكمية ==================
+class StatsRollup:
+    """جداول user_stats و user_monthly_stats تُحدَّث تلقائياً بالـ triggers"""
+    
+    # عمود عدد العملاء في user_stats، وعمود العميل النشط إن كان العدّ للنشطين فقط (None = كل العملاء)
+    CLIENTS_COLUMN = 'total_clients'
+    CLIENTS_ACTIVE_COLUMN = None
+    
+    @classmethod
+    def tables(cls):
+        """تعريف الجدولين"""
+        return [
+            f"""
+            CREATE TABLE IF NOT EXISTS user_stats (
+                user_id INTEGER PRIMARY KEY,
+                total_invoices INTEGER NOT NULL DEFAULT 0,
+                total_revenue REAL NOT NULL DEFAULT 0,
+                pending_invoices INTEGER NOT NULL DEFAULT 0,
+                {cls.CLIENTS_COLUMN} INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS user_monthly_stats (
+                user_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                invoice_count INTEGER NOT NULL DEFAULT 0,
+                paid_revenue REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, month)
+            )
+            """,
+        ]
+    
+    @staticmethod
+    def invoice_delta_sql(row, sign):
+        """تعليمات إضافة (+1) أو طرح (-1) مساهمة فاتورة من الإحصائيات"""
+        # status = 'pending' تعطي NULL عندما تكون الحالة NULL، فتفشل الكتابة على عمود NOT NULL
+        paid = f"(CASE WHEN {row}.status = 'paid' THEN COALESCE({row}.total_amount, 0) ELSE 0 END)"
+        month = f"strftime('%Y-%m', {row}.created_at)"
+        return f"""
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES ({row}.user_id);
+            UPDATE user_stats SET
+                total_invoices = total_invoices + ({sign}),
+                total_revenue = total_revenue + ({sign}) * {paid},
+                pending_invoices = pending_invoices + ({sign}) * COALESCE({row}.status = 'pending', 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = {row}.user_id;
+            INSERT OR IGNORE INTO user_monthly_stats (user_id, month) VALUES ({row}.user_id, {month});
+            UPDATE user_monthly_stats SET
+                invoice_count = invoice_count + ({sign}),
+                paid_revenue = paid_revenue + ({sign}) * {paid}
+            WHERE user_id = {row}.user_id AND month = {month};
+        """
+    
+    @classmethod
+    def client_delta_sql(cls, row, sign):
+        """تعليمات تحديث عدد العملاء"""
+        return f"""
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES ({row}.user_id);
+            UPDATE user_stats SET
+                {cls.CLIENTS_COLUMN} = {cls.CLIENTS_COLUMN} + ({sign}),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE user_id = {row}.user_id;
+        """
+    
+    @classmethod
+    def triggers(cls):
+        """(الاسم، الحدث، الشرط، التعليمات) للـ triggers التي تحافظ على الإحصائيات عند الإضافة وتغيير الحالة والحذف المنطقي"""
+        live_new = "NEW.user_id IS NOT NULL AND NEW.is_deleted = 0"
+        live_old = "OLD.user_id IS NOT NULL AND OLD.is_deleted = 0"
+        tracked = "status, total_amount, is_deleted, user_id, created_at"
+        client_new = "NEW.user_id IS NOT NULL"
+        client_old = "OLD.user_id IS NOT NULL"
+        if cls.CLIENTS_ACTIVE_COLUMN:
+            client_new += f" AND NEW.{cls.CLIENTS_ACTIVE_COLUMN} = 1"
+            client_old += f" AND OLD.{cls.CLIENTS_ACTIVE_COLUMN} = 1"
+        triggers = [
+            ('invoices_stats_insert', 'AFTER INSERT ON invoices', live_new, cls.invoice_delta_sql('NEW', 1)),
+            ('invoices_stats_delete', 'AFTER DELETE ON invoices', live_old, cls.invoice_delta_sql('OLD', -1)),
+            ('invoices_stats_update_old', f'AFTER UPDATE OF {tracked} ON invoices', live_old, cls.invoice_delta_sql('OLD', -1)),
+            ('invoices_stats_update_new', f'AFTER UPDATE OF {tracked} ON invoices', live_new, cls.invoice_delta_sql('NEW', 1)),
+            ('clients_stats_insert', 'AFTER INSERT ON clients', client_new, cls.client_delta_sql('NEW', 1)),
+            ('clients_stats_delete', 'AFTER DELETE ON clients', client_old, cls.client_delta_sql('OLD', -1)),
+        ]
+        if cls.CLIENTS_ACTIVE_COLUMN:
+            client_tracked = f"{cls.CLIENTS_ACTIVE_COLUMN}, user_id"
+            triggers += [
+                ('clients_stats_update_old', f'AFTER UPDATE OF {client_tracked} ON clients', client_old, cls.client_delta_sql('OLD', -1)),
+                ('clients_stats_update_new', f'AFTER UPDATE OF {client_tracked} ON clients', client_new, cls.client_delta_sql('NEW', 1)),
+            ]
+        return triggers
+    
+    @classmethod
+    def trigger_statements(cls):
+        """تعليمات CREATE TRIGGER"""
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {name} {event} FOR EACH ROW WHEN {condition} BEGIN {body} END"
+            for name, event, condition, body in cls.triggers()
+        ]
+    
+    @classmethod
+    def recreate_triggers(cls, cursor):
+        """حذف الـ triggers وإنشاؤها من جديد (ترحيل بعد تغيير تعريفها، فـ IF NOT EXISTS لا يستبدلها)"""
+        for name, _, _, _ in cls.triggers():
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for statement in cls.trigger_statements():
+            cursor.execute(statement)
+    
+    @classmethod
+    def create(cls, cursor):
+        """إنشاء الجداول والـ triggers، وإعادة البناء إذا كانت الجداول جديدة"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'")
+        is_new = cursor.fetchone() is None
+        
+        for statement in cls.tables() + cls.trigger_statements():
+            cursor.execute(statement)
+        
+        if is_new:
+            cls.rebuild(cursor)
+    
+    @classmethod
+    def expected_queries(cls):
+        """الاستعلامات التي تعيد حساب الإحصائيات مباشرة من الفواتير والعملاء"""
+        clients_column = cls.CLIENTS_COLUMN
+        active = f" AND {cls.CLIENTS_ACTIVE_COLUMN} = 1" if cls.CLIENTS_ACTIVE_COLUMN else ""
+        active_where = f" WHERE {cls.CLIENTS_ACTIVE_COLUMN} = 1" if cls.CLIENTS_ACTIVE_COLUMN else ""
+        user_stats = f"""
+            SELECT u.user_id,
+                   COALESCE(i.total_invoices, 0) AS total_invoices,
+                   COALESCE(i.total_revenue, 0) AS total_revenue,
+                   COALESCE(i.pending_invoices, 0) AS pending_invoices,
+                   COALESCE(c.{clients_column}, 0) AS {clients_column}
+            FROM (SELECT user_id FROM invoices WHERE user_id IS NOT NULL AND is_deleted = 0
+                  UNION SELECT user_id FROM clients WHERE user_id IS NOT NULL{active}) u
+            LEFT JOIN (
+                SELECT user_id,
+                       COUNT(*) AS total_invoices,
+                       SUM(CASE WHEN status = 'paid' THEN total_amount ELSE 0 END) AS total_revenue,
+                       SUM(status = 'pending') AS pending_invoices
+                FROM invoices WHERE is_deleted = 0 GROUP BY user_id
+            ) i ON i.user_id = u.user_id
+            LEFT JOIN (
+                SELECT user_id, COUNT(*) AS {clients_column} FROM clients{active_where} GROUP BY user_id
+            ) c ON c.user_id = u.user_id
+        """
+        monthly_stats = """
+            SELECT user_id, strftime('%Y-%m', created_at) AS month,
+                   COUNT(*) AS invoice_count,
+                   SUM(CASE WHEN status = 'paid' THEN total_amount ELSE 0 END) AS paid_revenue
+            FROM invoices
+            WHERE user_id IS NOT NULL AND is_deleted = 0
+            GROUP BY user_id, month
+        """
+        return user_stats, monthly_stats
+    
+    @classmethod
+    def rebuild(cls, cursor):
+        """إعادة حساب الإحصائيات بالكامل من جدول الفواتير"""
+        user_stats, monthly_stats = cls.expected_queries()
+        cursor.execute("DELETE FROM user_stats")
+        cursor.execute("DELETE FROM user_monthly_stats")
+        cursor.execute(f"""
+            INSERT INTO user_stats (user_id, total_invoices, total_revenue, pending_invoices, {cls.CLIENTS_COLUMN})
+            {user_stats}
+        """)
+        cursor.execute(f"""
+            INSERT INTO user_monthly_stats (user_id, month, invoice_count, paid_revenue)
+            {monthly_stats}
+        """)
+    
+    @classmethod
+    def verify(cls, cursor, tolerance=0.01):
+        """مقارنة الإحصائيات المخزنة بالقيم المحسوبة وإرجاع قائمة الفروقات"""
+        user_stats, monthly_stats = cls.expected_queries()
+        checks = [
+            ('user_stats', user_stats, "SELECT * FROM user_stats", ('user_id',),
+             ('total_invoices', 'total_revenue', 'pending_invoices', cls.CLIENTS_COLUMN)),
+            ('user_monthly_stats', monthly_stats, "SELECT * FROM user_monthly_stats", ('user_id', 'month'),
+             ('invoice_count', 'paid_revenue')),
+        ]
+        
+        drift = []
+        for table, expected_query, stored_query, key_columns, value_columns in checks:
+            cursor.execute(expected_query)
+            columns = [d[0] for d in cursor.description]
+            expected = {}
+            for row in cursor.fetchall():
+                row = dict(zip(columns, row))
+                expected[tuple(row[k] for k in key_columns)] = row
+            
+            cursor.execute(stored_query)
+            columns = [d[0] for d in cursor.description]
+            stored = {}
+            for row in cursor.fetchall():
+                row = dict(zip(columns, row))
+                stored[tuple(row[k] for k in key_columns)] = row
+            
+            for key in expected.keys() | stored.keys():
+                for column in value_columns:
+                    want = (expected.get(key) or {}).get(column) or 0
+                    have = (stored.get(key) or {}).get(column) or 0
+                    if abs(want - have) > tolerance:
+                        drift.append({'table': table, 'key': key, 'column': column,
+                                      'expected': want, 'stored': have})
+        return drift
+
+# ================== ترحيلات مخطط قاعدة البيانات ==================
+class SchemaMigrator:
+    """ترحيلات مرقمة تُسجَّل في جدول schema_version وتُطبَّق مرة واحدة"""
+    
+    def __init__(self, migrations):
+        self.migrations = sorted(migrations, key=lambda migration: migration[0])
+    
+    @property
+    def latest_version(self):
+        """رقم آخر ترحيل معروف للكود"""
+        return self.migrations[-1][0] if self.migrations else 0
+    
+    @staticmethod
+    def current_version(cursor):
+        """رقم آخر ترحيل مطبق على قاعدة البيانات"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        if cursor.fetchone() is None:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    
+    def migrate(self, conn):
+        """تطبيق الترحيلات الناقصة داخل معاملة واحدة حصرية"""
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE يمنع عمليتين من تطبيق نفس الترحيل في الوقت نفسه
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        try:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            current = self.current_version(cursor)
+            
+            applied = []
+            for version, description, steps in self.migrations:
+                if version <= current:
+                    continue
+                
+                if callable(steps):
+                    steps(cursor)
+                else:
+                    for statement in steps:
+                        cursor.execute(statement)
+                
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                applied.append(version)
+            
+            conn.commit()
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+
+# ================== الكتابة على دفعات ==================
+class BatchWriter(ABC):
+    """خيط خلفي (مرة لكل عملية) يجمع العناصر من طابور محدود ويكتبها دفعة واحدة كل batch_size عنصر أو flush_interval ثانية"""
+    
+    THREAD_NAME = 'batch-writer'
+    
+    def __init__(self, batch_size, flush_interval, queue_size):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.pid = None
+        self.thread = None
+        self.queue = None
+        self.start_lock = Lock()
+        self.stats_lock = Lock()
+        # الأصناف الفرعية توسّع العدادات وتُبقي 'dropped'
+        self.stats = {'dropped': 0}
+        atexit.register(self.flush)
+    
+    def ensure_started(self):
+        """تشغيل خيط الكتابة (مرة لكل عملية بعد fork في gunicorn، ومن جديد إذا توقف)"""
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if self.pid != os.getpid():
+                self.queue = Queue(maxsize=self.queue_size)
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                # الطابور نفسه يبقى عند إعادة التشغيل في العملية نفسها فلا تضيع العناصر المنتظرة
+                self.thread = Thread(target=self._run, name=self.THREAD_NAME, daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+    
+    def _run(self):
+        """خيط الكتابة: انتظار أول عنصر ثم جمع ما يصل حتى batch_size أو انتهاء المهلة"""
+        queue = self.queue
+        while True:
+            batch, waiters = [], []
+            item = queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = queue.get(timeout=remaining)
+                except Empty:
+                    break
+            
+            if batch:
+                try:
+                    self.write_batch(batch)
+                except Exception as e:
+                    # خطأ غير متوقع يُسقط الدفعة فقط؛ توقف الخيط يملأ الطابور ويعلّق flush حتى المهلة
+                    print(f"خطأ في {self.THREAD_NAME}: أُسقطت دفعة من {len(batch)} عنصر: {e}")
+                    with self.stats_lock:
+                        self.stats['dropped'] += len(batch)
+            for waiter in waiters:
+                waiter.set()
+    
+    @abstractmethod
+    def write_batch(self, batch):
+        """كتابة دفعة من خيط الكتابة"""
+    
+    def flush(self, timeout=5):
+        """انتظار كتابة كل العناصر الموجودة في الطابور (يُستدعى عند إغلاق العامل)"""
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return True
+        
+        done = Event()
+        try:
+            self.queue.put(done, timeout=timeout)
+        except Full:
+            return False
+        return done.wait(timeout)
+    
+    def queue_depth(self):
+        """عدد العناصر المنتظرة في طابور هذه العملية"""
+        return self.queue.qsize() if self.pid == os.getpid() else 0
+
+class ActivityBatcher(BatchWriter):
+    """تجميع أحداث النشاط وكتابتها بـ executemany في معاملة واحدة كل N حدث أو M ملي ثانية"""
+    
+    THREAD_NAME = 'activity-batcher'
+    
+    def __init__(self, write_rows, batch_size=100, flush_interval_ms=250, queue_size=10000):
+        super().__init__(batch_size, flush_interval_ms / 1000, queue_size)
+        self.write_rows = write_rows
+        self.stats = {'rows': 0, 'batches': 0, 'sync_writes': 0, 'errors': 0, 'dropped': 0,
+                      'total_flush_ms': 0.0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0}
+    
+    def add(self, row):
+        """إضافة حدث للطابور؛ إذا امتلأ يُكتب مباشرة بدلاً من فقدانه"""
+        self.ensure_started()
+        try:
+            self.queue.put_nowait(row)
+        except Full:
+            self.write([row])
+            with self.stats_lock:
+                self.stats['sync_writes'] += 1
+    
+    def write_batch(self, batch):
+        """الأخطاء تُعالج داخل write"""
+        self.write(batch)
+    
+    def write(self, rows):
+        """كتابة دفعة واحدة وتسجيل زمنها؛ إذا فشلت تُعاد صفاً صفاً فلا يُفقد إلا الصف المعطوب"""
+        started = time.perf_counter()
+        written = len(rows)
+        try:
+            self.write_rows(rows)
+        except Exception as e:
+            print(f"خطأ في كتابة سجل النشاط ({len(rows)} حدث): {e}")
+            with self.stats_lock:
+                self.stats['errors'] += 1
+            # المعاملة الفاشلة تُلغى كاملة، فإعادة الصفوف منفردة لا تكررها
+            written = 0
+            if len(rows) > 1:
+                for row in rows:
+                    try:
+                        self.write_rows([row])
+                        written += 1
+                    except Exception as e:
+                        print(f"خطأ في كتابة حدث نشاط: {e} {row!r}")
+            with self.stats_lock:
+                self.stats['dropped'] += len(rows) - written
+            if not written:
+                return
+        
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.stats_lock:
+            self.stats['rows'] += written
+            self.stats['batches'] += 1
+            self.stats['total_flush_ms'] += elapsed
+            self.stats['last_flush_ms'] = elapsed
+            self.stats['max_flush_ms'] = max(self.stats['max_flush_ms'], elapsed)
+    
+    def get_stats(self):
+        """عمق الطابور وزمن الكتابة"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self.queue_depth()
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+# ================== أرشفة السجلات ==================
+class LogRetention:
+    """نقل السجلات الأقدم من مدة الاحتفاظ على دفعات إلى قاعدة أرشيف مرفقة، مع قراءة تشمل الاثنتين"""
+    
+    def __init__(self, database, archive_path, retention_days, batch_size=1000):
+        self.database = database
+        self.archive_path = archive_path
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+    
+    def connect(self):
+        """اتصال بالقاعدة الرئيسية مع إرفاق قاعدة الأرشيف باسم archive"""
+        conn = sqlite3.connect(self.database.db_path, timeout=30)
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+        return conn
+    
+    @staticmethod
+    def ensure_archive_table(conn, table):
+        """إنشاء نسخة من الجدول في الأرشيف بنفس الأعمدة وفهارس created_at"""
+        sql = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        conn.execute(re.sub(r'^CREATE TABLE\s+(IF NOT EXISTS\s+)?"?\w+"?',
+                            f'CREATE TABLE IF NOT EXISTS archive.{table}', sql))
+        conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_created ON {table} (created_at)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_user_created ON {table} (user_id, created_at)")
+    
+    def compact_table(self, table, now=None):
+        """نقل الصفوف الأقدم من مدة الاحتفاظ؛ كل دفعة في معاملة قصيرة حتى لا يُحجز الكاتب طويلاً"""
+        cutoff = ((now or datetime.utcnow()) - timedelta(days=self.retention_days[table])).strftime('%Y-%m-%d %H:%M:%S')
+        conn = self.connect()
+        moved = 0
+        
+        try:
+            self.ensure_archive_table(conn, table)
+            conn.commit()
+            
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                last_id = conn.execute(
+                    f"SELECT MAX(id) FROM (SELECT id FROM main.{table} WHERE created_at < ? ORDER BY id LIMIT ?)",
+                    (cutoff, self.batch_size)
+                ).fetchone()[0]
+                if last_id is None:
+                    conn.rollback()
+                    break
+                
+                conn.execute(
+                    f"INSERT OR IGNORE INTO archive.{table} SELECT * FROM main.{table} WHERE id <= ? AND created_at < ?",
+                    (last_id, cutoff)
+                )
+                deleted = conn.execute(
+                    f"DELETE FROM main.{table} WHERE id <= ? AND created_at < ?", (last_id, cutoff)
+                ).rowcount
+                conn.commit()
+                moved += deleted
+        finally:
+            conn.close()
+        
+        return moved
+    
+    def compact(self, tables=None, now=None):
+        """أرشفة كل الجداول المحددة وإرجاع عدد الصفوف المنقولة لكل جدول"""
+        return {table: self.compact_table(table, now) for table in (tables or self.retention_days)}
+    
+    def recent(self, table, user_id, limit):
+        """أحدث السجلات للمستخدم؛ تُكمل من الأرشيف إذا لم تكفِ الصفوف الحية"""
+        query = f"SELECT * FROM {table} WHERE user_id = ? ORDER BY created_at DESC LIMIT ?"
+        rows = self.database.execute_query(query, (user_id, limit), fetchall=True)
+        if len(rows) >= limit or not os.path.exists(self.archive_path):
+            return rows
+        
+        conn = sqlite3.connect(f"file:{self.archive_path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            archived = [dict(row) for row in conn.execute(query, (user_id, limit - len(rows)))]
+        except sqlite3.OperationalError:
+            # الجدول لم يُؤرشف بعد
+            archived = []
+        finally:
+            conn.close()
+        
+        return rows + archived
+    
+    def page(self, table, user_id, cursor=None, limit=50):
+        """صفحة بمؤشر KeysetPaginator تمتد من الصفوف الحية إلى الأرشيف بترتيب (created_at, id) نفسه"""
+        where, params = "user_id = ?", [user_id]
+        if cursor:
+            where += " AND (created_at, id) < (?, ?)"
+            params.extend(KeysetPaginator.decode_cursor(cursor))
+        params.append(limit + 1)
+        # كل فرع يستخدم فهرس (user_id, created_at) في قاعدته ويكفيه limit + 1 صف
+        branch = f"SELECT * FROM (SELECT * FROM {{schema}}.{table} WHERE {where} ORDER BY created_at DESC, id DESC LIMIT ?)"
+        
+        rows = None
+        if os.path.exists(self.archive_path):
+            conn = sqlite3.connect(f"file:{self.database.db_path}?mode=ro", uri=True, timeout=30)
+            try:
+                conn.execute("ATTACH DATABASE ? AS archive", (f"file:{self.archive_path}?mode=ro",))
+                result = conn.execute(
+                    f"{branch.format(schema='main')} UNION ALL {branch.format(schema='archive')} "
+                    "ORDER BY created_at DESC, id DESC LIMIT ?",
+                    params + params + [limit + 1]
+                )
+                rows = RowSet([column[0] for column in result.description], result.fetchall())
+            except sqlite3.OperationalError:
+                # الجدول لم يُؤرشف بعد
+                rows = None
+            finally:
+                conn.close()
+        
+        if rows is None:
+            rows = self.database.execute_query(branch.format(schema='main'), params, fetchall=True, rowset=True)
+        next_cursor = KeysetPaginator.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+# ================== ترقيم الصفحات بالمؤشر ==================
+class KeysetPaginator:
+    """ترقيم الصفحات بمؤشر على (created_at, id) بدلاً من OFFSET؛ الصفوف الجديدة لا تزيح الصفحات التالية"""
+    
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+    # قاعدة بيانات التطبيق (تحددها الأصناف الفرعية في app.py و bot_arabic.py)
+    database = None
+    
+    @staticmethod
+    def encode_cursor(row):
+        """مؤشر معتم: base64 لآخر (created_at, id) في الصفحة"""
+        raw = json.dumps([row['created_at'], row['id']], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(token):
+        """فك المؤشر؛ ValueError إذا كان غير صالح"""
+        try:
+            created_at, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        except (ValueError, TypeError):
+            raise ValueError("مؤشر الصفحة غير صالح")
+        if not isinstance(created_at, str) or not isinstance(row_id, int):
+            raise ValueError("مؤشر الصفحة غير صالح")
+        return created_at, row_id
+    
+    @classmethod
+    def parse_limit(cls, value):
+        """عدد الصفوف المطلوب ضمن الحد الأقصى"""
+        try:
+            return max(1, min(int(value), cls.MAX_LIMIT))
+        except (TypeError, ValueError):
+            return cls.DEFAULT_LIMIT
+    
+    @classmethod
+    def fetch(cls, table, where, params, cursor=None, limit=DEFAULT_LIMIT, columns='*'):
+        """صفحة من الجدول بترتيب تنازلي وإرجاع (الصفوف، next_cursor)؛ columns يجب أن تشمل id و created_at"""
+        query = f"SELECT {columns} FROM {table} WHERE {where}"
+        params = list(params)
+        if cursor:
+            query += " AND (created_at, id) < (?, ?)"
+            params.extend(cls.decode_cursor(cursor))
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        
+        rows = cls.database.execute_query(query, params, fetchall=True, rowset=True)
+        next_cursor = cls.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+# ================== الملفات الثابتة ذات البصمة ==================
+class StaticAssets:
+    """كتابة CSS في ملفات ثابتة تحمل بصمة المحتوى لتخزينها مؤقتاً في المتصفح"""
+    
+    MAX_AGE = 365 * 24 * 3600
+    SUFFIXES = {'gzip': '.gz', 'br': '.br'}
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.fingerprints = {}
+    
+    def register(self, name, content):
+        """كتابة الملف مرة واحدة باسم يحتوي على بصمة المحتوى"""
+        data = content.encode('utf-8')
+        fingerprint = hashlib.sha256(data).hexdigest()[:12]
+        filename = f"{name}.{fingerprint}.css"
+        path = os.path.join(self.directory, filename)
+        
+        os.makedirs(self.directory, exist_ok=True)
+        self.write_file(path, data)
+        # نسخ مضغوطة مسبقاً بجانب الملف الأصلي
+        self.write_file(path + self.SUFFIXES['gzip'], lambda: gzip.compress(data, 9, mtime=0))
+        if brotli is not None:
+            self.write_file(path + self.SUFFIXES['br'], lambda: brotli.compress(data, quality=11))
+        
+        self.files[name] = filename
+        self.fingerprints[filename] = fingerprint
+        return filename
+    
+    @staticmethod
+    def write_file(path, data):
+        """كتابة ذرية (مرة واحدة) حتى لا يقرأ عامل آخر ملفاً ناقصاً"""
+        if os.path.exists(path):
+            return
+        if callable(data):
+            data = data()
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    
+    def url(self, name):
+        """رابط الملف بالبصمة الحالية"""
+        return url_for('fingerprinted_asset', filename=self.files[name])
+    
+    def send(self, filename):
+        """تقديم الملف مع Cache-Control طويل و ETag ثابت"""
+        fingerprint = self.fingerprints.get(filename)
+        if fingerprint is None:
+            abort(404)
+        
+        # تقديم النسخة المضغوطة مسبقاً إن قبلها العميل
+        encoding = CompressionMiddleware.negotiate(request.headers.get('Accept-Encoding', ''))
+        if encoding and os.path.exists(os.path.join(self.directory, filename + self.SUFFIXES[encoding])):
+            filename, fingerprint = filename + self.SUFFIXES[encoding], f"{fingerprint}-{encoding}"
+        else:
+            encoding = None
+        
+        response = send_from_directory(
+            self.directory, filename, mimetype='text/css',
+            max_age=self.MAX_AGE, etag=fingerprint, conditional=True
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
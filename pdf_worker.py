@@ -0,0 +1,623 @@
+"""
+توليد فواتير PDF وعمليات عمال PDF - InvoiceFlow Pro
+
+عمال ProcessPoolExecutor في bot_arabic.py يستوردون هذه الوحدة وحدها (تُحمَّل مسبقاً في
+عملية forkserver)، لذا لا تستورد Flask ولا قاعدة البيانات ولا تنفذ شيئاً عند الاستيراد
+سوى إنشاء المولد. bot_arabic.py يصل إليها عبر LazyModule عند أول فاتورة.
+"""
+
+import io
+import json
+import signal
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from types import MappingProxyType
+from threading import Lock, current_thread, main_thread
+import arabic_reshaper
+from bidi import algorithm as bidi_algorithm
+import qrcode
+from reportlab import platypus
+from reportlab.lib import colors, pagesizes
+from reportlab.lib import styles as pdf_styles
+from reportlab.lib import units as pdf_units
+
+# يُزاد عند أي تغيير في تصميم الفاتورة حتى لا تُقدَّم ملفات PDF المخزنة بالتصميم القديم
+VERSION = '2'
+
+# ================== نظام PDF المحترف ==================
+# أنماط الفقرات والجداول لتصميم الفاتورة، مشتركة بين كل الفواتير وللقراءة فقط: أوامر الجداول tuples
+# (Table.setStyle يبني منها TableStyle لكل جدول)، وأنماط الفقرات خصائص ParagraphStyle في MappingProxyType
+# تُبنى منها كائنات جديدة لكل مستند (ParagraphStyle قابل للتعديل ولا يُشارك بين المستندات)
+PARAGRAPH_STYLES = ('title', 'arabic', 'heading', 'data', 'footer')
+PDFTheme = namedtuple('PDFTheme', PARAGRAPH_STYLES + (
+    'header_table', 'info_table', 'details_table', 'items_table', 'totals_table', 'signatures_table'
+))
+
+class ArabicTextShaper:
+    """إعادة تشكيل النص العربي وترتيبه للعرض (bidi) مع ذاكرة LRU محدودة؛ نفس البائع يتكرر في آلاف الفواتير"""
+    
+    # النصوص الثابتة في تصميم الفاتورة التي تمر بإعادة التشكيل؛ تُحسب مرة ولا تُطرد
+    LABELS = (
+        # الرأس وكتلتا البائع والعميل
+        'فاتورة ضريبية', 'معلومات البائع:', 'معلومات العميل:', 'الهاتف:', 'البريد الإلكتروني:', 'الرقم الضريبي:',
+        # جدول التفاصيل
+        'رقم الفاتورة', 'تاريخ الإصدار', 'تاريخ الاستحقاق', 'طريقة الدفع', 'الحالة',
+        # جدول العناصر والمجاميع
+        'الوصف', 'الكمية', 'سعر الوحدة', 'المجموع', 'المجموع الفرعي:', 'الضريبة:', 'الخصم:', 'الإجمالي:',
+        # الملاحظات والتوقيعات والتذييل
+        'ملاحظات:', 'توقيع البائع', 'توقيع العميل',
+        'شكراً لتعاملك معنا', 'للاستفسارات:', 'هذه الفاتورة تم إنشاؤها تلقائياً بواسطة نظام InvoiceFlow Pro',
+        # القيم الافتراضية وعناصر المثال
+        'شركتي', 'العنوان', 'عميل',
+        'خدمة استشارية', 'استشارة تقنية متخصصة', 'تصميم جرافيك', 'تصميم شعار احترافي',
+    )
+    # النصوص الأطول (الملاحظات مثلاً) نادراً ما تتكرر فلا تُحفظ؛ الذاكرة لا تتجاوز max_size × هذا الطول
+    MAX_TEXT_LENGTH = 200
+    
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'skipped': 0}
+        self.labels = None
+    
+    def precompute(self):
+        """جدول النصوص الثابتة؛ يُحسب عند أول استخدام حتى لا تُحمَّل مكتبات التشكيل مع بدء التطبيق"""
+        if self.labels is None:
+            self.labels = {label: self.layout(label) for label in self.LABELS}
+        return self.labels
+    
+    @staticmethod
+    def layout(text):
+        """تعديل النص العربي للعرض الصحيح (بدون ذاكرة)"""
+        try:
+            # إعادة تشكيل النص العربي
+            reshaped_text = arabic_reshaper.reshape(text)
+            # عكس النص للعرض من اليمين لليسار
+            return bidi_algorithm.get_display(reshaped_text)
+        except Exception:
+            return text
+    
+    def shape(self, text):
+        """النص بعد التشكيل، من الجدول الثابت أو الذاكرة إن سبق تشكيله"""
+        if not text:
+            return ""
+        if not isinstance(text, str):
+            return self.layout(text)
+        
+        shaped = self.precompute().get(text)
+        with self.lock:
+            if shaped is None:
+                shaped = self.entries.get(text)
+                if shaped is not None:
+                    self.entries.move_to_end(text)
+            self.stats['hits' if shaped is not None else 'misses'] += 1
+        if shaped is not None:
+            return shaped
+        
+        shaped = self.layout(text)
+        with self.lock:
+            self.store(text, shaped)
+        return shaped
+    
+    def shape_many(self, texts):
+        """تشكيل قائمة نصوص (أسماء العناصر مثلاً) بقفل واحد للبحث وتشكيل كل نص مكرر مرة واحدة"""
+        labels = self.precompute()
+        results = [None] * len(texts)
+        missing = {}
+        with self.lock:
+            for index, text in enumerate(texts):
+                if not text:
+                    results[index] = ""
+                    continue
+                if not isinstance(text, str):
+                    results[index] = self.layout(text)
+                    continue
+                shaped = labels.get(text) or self.entries.get(text)
+                if shaped is None:
+                    missing.setdefault(text, []).append(index)
+                    continue
+                if text in self.entries:
+                    self.entries.move_to_end(text)
+                self.stats['hits'] += 1
+                results[index] = shaped
+            self.stats['misses'] += sum(len(indexes) for indexes in missing.values())
+        
+        shaped_missing = {text: self.layout(text) for text in missing}
+        with self.lock:
+            for text, shaped in shaped_missing.items():
+                self.store(text, shaped)
+                for index in missing[text]:
+                    results[index] = shaped
+        return results
+    
+    def store(self, text, shaped):
+        # يُستدعى مع القفل
+        if len(text) > self.MAX_TEXT_LENGTH:
+            self.stats['skipped'] += 1
+            return
+        self.entries[text] = shaped
+        self.entries.move_to_end(text)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+    
+    def get_stats(self):
+        """عدادات الإصابة والإخفاق وحجم الذاكرة"""
+        with self.lock:
+            stats = dict(self.stats, size=len(self.entries), labels=len(self.labels or ()))
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+    
+    def drain_stats(self):
+        """العدادات منذ آخر استدعاء مع تصفيرها؛ عمال PDF يرسلونها مع نتيجة كل مهمة لتُجمع في العملية الأم"""
+        with self.lock:
+            stats, self.stats = self.stats, dict.fromkeys(self.stats, 0)
+        return stats
+
+class ProfessionalPDFGenerator:
+    def __init__(self, shaper=None):
+        # تسجيل الخطوط العربية
+        try:
+            # استخدام خط افتراضي إذا لم تكن الخطوط متوفرة
+            self.arabic_font = "Helvetica"
+        except:
+            self.arabic_font = "Helvetica"
+        self.shaper = shaper or ArabicTextShaper()
+    
+    def reshape_arabic_text(self, text):
+        """تعديل النص العربي للعرض الصحيح"""
+        return self.shaper.shape(text)
+    
+    # سجل الأنماط لكل خط، يُبنى مرة في كل عملية (عمال PDF يبنونه في init_pdf_worker قبل أول مهمة)
+    _themes = {}
+    _themes_lock = Lock()
+    
+    @classmethod
+    def theme(cls, font):
+        """أنماط التصميم للخط المحدد (مجمدة لأنها مشتركة بين كل المستندات)"""
+        theme = cls._themes.get(font)
+        if theme is None:
+            with cls._themes_lock:
+                theme = cls._themes.get(font)
+                if theme is None:
+                    theme = cls._themes[font] = cls.build_theme(font)
+        return theme
+    
+    @staticmethod
+    def build_theme(font):
+        """بناء PDFTheme: خصائص أنماط الفقرات من getSampleStyleSheet وأوامر الجداول الستة (tuples تُمرر إلى setStyle)"""
+        styles = pdf_styles.getSampleStyleSheet()
+        
+        # إنشاء أنماط مخصصة
+        title_style = pdf_styles.ParagraphStyle(
+            'Title',
+            parent=styles['Heading1'],
+            fontSize=24,
+            textColor=colors.black,
+            alignment=1,  # Center
+            spaceAfter=20
+        )
+        
+        # نمط للنصوص العربية
+        arabic_style = pdf_styles.ParagraphStyle(
+            'Arabic',
+            parent=styles['Normal'],
+            fontName=font,
+            fontSize=10,
+            textColor=colors.black,
+            alignment=2,  # Right
+            wordWrap='RTL'
+        )
+        
+        # نمط للعناوين
+        heading_style = pdf_styles.ParagraphStyle(
+            'Heading',
+            parent=styles['Heading2'],
+            fontSize=14,
+            textColor=colors.black,
+            alignment=2,  # Right
+            spaceAfter=10
+        )
+        
+        # نمط للبيانات
+        data_style = pdf_styles.ParagraphStyle(
+            'Data',
+            parent=styles['Normal'],
+            fontSize=10,
+            textColor=colors.black,
+            alignment=2  # Right
+        )
+        
+        footer_style = pdf_styles.ParagraphStyle(
+            'Footer',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=colors.grey,
+            alignment=1,  # Center
+            spaceBefore=20
+        )
+        
+        # الخصائص بعد دمجها مع النمط الأب، بدون parent حتى لا يبقى مرجع لورقة الأنماط القابلة للتعديل
+        def freeze(style):
+            return MappingProxyType({key: value for key, value in vars(style).items() if key != 'parent'})
+        
+        return PDFTheme(
+            title=freeze(title_style),
+            arabic=freeze(arabic_style),
+            heading=freeze(heading_style),
+            data=freeze(data_style),
+            footer=freeze(footer_style),
+            header_table=(
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 20),
+            ),
+            info_table=(
+                ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 15),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+                ('BACKGROUND', (0, 0), (0, 0), colors.HexColor('#F8F9FA')),
+                ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#F8F9FA')),
+            ),
+            details_table=(
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2C3E50')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, 0), 10),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+                ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor('#F8F9FA')),
+                ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+                ('ALIGN', (0, 1), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+                ('FONTSIZE', (0, 1), (-1, -1), 9),
+                ('GRID', (0, 0), (-1, -1), 0.5, colors.grey)
+            ),
+            items_table=(
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2C3E50')),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, 0), 10),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+                ('BACKGROUND', (0, 1), (-1, -2), colors.HexColor('#F8F9FA')),
+                ('TEXTCOLOR', (0, 1), (-1, -2), colors.black),
+                ('GRID', (0, 0), (-1, -2), 0.5, colors.grey),
+                ('ALIGN', (1, 1), (-1, -2), 'RIGHT'),
+            ),
+            totals_table=(
+                ('ALIGN', (2, 0), (2, -1), 'RIGHT'),
+                ('ALIGN', (3, 0), (3, -1), 'RIGHT'),
+                ('FONTNAME', (2, -1), (3, -1), 'Helvetica-Bold'),
+                ('FONTSIZE', (2, -1), (3, -1), 11),
+                ('TEXTCOLOR', (2, -1), (3, -1), colors.HexColor('#2C3E50')),
+                ('TOPPADDING', (0, 0), (-1, -1), 10),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
+            ),
+            signatures_table=(
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('VALIGN', (0, 0), (-1, -1), 'BOTTOM'),
+                ('TOPPADDING', (0, 0), (-1, -1), 40),
+            )
+        )
+    
+    def batch_resources(self, user_data):
+        """الأنماط وكتلة البائع والتذييل بعد إعادة التشكيل؛ تُبنى مرة وتُشارك بين فواتير الدفعة"""
+        label = self.reshape_arabic_text
+        company_info = f"""
+        <b>{label('معلومات البائع:')}</b><br/>
+        {self.reshape_arabic_text(user_data.get('company_name', 'شركتي'))}<br/>
+        {self.reshape_arabic_text(user_data.get('address', 'العنوان'))}<br/>
+        {label('الهاتف:')} {user_data.get('phone', '0000000000')}<br/>
+        {label('البريد الإلكتروني:')} {user_data.get('email', 'info@company.com')}<br/>
+        {label('الرقم الضريبي:')} {user_data.get('tax_number', '')}
+        """
+        
+        # تُشكَّل النصوص وحدها لا السطور مع وسوم HTML، فلا يعكس bidi ترتيب الوسوم
+        footer_text = f"""
+        <b>{label('شكراً لتعاملك معنا')}</b><br/>
+        {label('للاستفسارات:')} {user_data.get('phone', '')} | {user_data.get('email', '')}<br/>
+        {label('هذه الفاتورة تم إنشاؤها تلقائياً بواسطة نظام InvoiceFlow Pro')}
+        """
+        
+        theme = self.theme(self.arabic_font)
+        return {
+            'theme': theme,
+            'styles': self.paragraph_styles(theme),
+            'company_name': self.reshape_arabic_text(user_data.get('company_name', 'شركتي')),
+            'company_info': company_info,
+            'footer': footer_text,
+        }
+    
+    @staticmethod
+    def paragraph_styles(theme):
+        """كائنات ParagraphStyle جديدة من خصائص السجل المجمدة، لمستند واحد أو دفعة واحدة"""
+        return {name: pdf_styles.ParagraphStyle(**getattr(theme, name)) for name in PARAGRAPH_STYLES}
+    
+    @staticmethod
+    def document(output, title):
+        """قالب المستند بهوامش الفاتورة"""
+        return platypus.SimpleDocTemplate(
+            output,
+            pagesize=pagesizes.A4,
+            rightMargin=20*pdf_units.mm,
+            leftMargin=20*pdf_units.mm,
+            topMargin=20*pdf_units.mm,
+            bottomMargin=20*pdf_units.mm,
+            title=title
+        )
+    
+    def invoice_elements(self, invoice_data, user_data, resources):
+        """عناصر platypus لفاتورة واحدة"""
+        theme = resources['theme']
+        styles = resources['styles']
+        label = self.reshape_arabic_text
+        arabic_style = styles['arabic']
+        title_style = styles['title']
+        data_style = styles['data']
+        footer_style = styles['footer']
+        
+        elements = []
+        
+        # رأس الفاتورة
+        header_table_data = [
+            [
+                # معلومات الشركة
+                platypus.Paragraph(f"<b>{resources['company_name']}</b>", arabic_style),
+                # العنوان
+                platypus.Paragraph(f"<b>{label('فاتورة ضريبية')}</b>", title_style)
+            ]
+        ]
+        
+        header_table = platypus.Table(header_table_data, colWidths=[250, 250])
+        header_table.setStyle(theme.header_table)
+        
+        elements.append(header_table)
+        elements.append(platypus.Spacer(1, 20))
+        
+        # معلومات الشركة والعميل
+        client_info = f"""
+        <b>{label('معلومات العميل:')}</b><br/>
+        {self.reshape_arabic_text(invoice_data.get('client_name', 'عميل'))}<br/>
+        {self.reshape_arabic_text(invoice_data.get('client_address', 'العنوان'))}<br/>
+        {label('الهاتف:')} {invoice_data.get('client_phone', '0000000000')}<br/>
+        {label('البريد الإلكتروني:')} {invoice_data.get('client_email', 'client@email.com')}<br/>
+        {label('الرقم الضريبي:')} {invoice_data.get('client_tax_number', '')}
+        """
+        
+        info_table_data = [
+            [
+                platypus.Paragraph(resources['company_info'], arabic_style),
+                platypus.Paragraph(client_info, arabic_style)
+            ]
+        ]
+        
+        info_table = platypus.Table(info_table_data, colWidths=[250, 250])
+        info_table.setStyle(theme.info_table)
+        
+        elements.append(info_table)
+        elements.append(platypus.Spacer(1, 20))
+        
+        # تفاصيل الفاتورة
+        details_data = [
+            [label('رقم الفاتورة'), invoice_data.get('invoice_number', 'INV-0001')],
+            [label('تاريخ الإصدار'), invoice_data.get('issue_date', datetime.now().strftime('%Y/%m/%d'))],
+            [label('تاريخ الاستحقاق'), invoice_data.get('due_date', datetime.now().strftime('%Y/%m/%d'))],
+            [label('طريقة الدفع'), invoice_data.get('payment_method', 'نقدي')],
+            [label('الحالة'), invoice_data.get('status', 'معلقة')]
+        ]
+        
+        details_table = platypus.Table(details_data, colWidths=[100, 100])
+        details_table.setStyle(theme.details_table)
+        
+        elements.append(details_table)
+        elements.append(platypus.Spacer(1, 20))
+        
+        # جدول العناصر
+        items = invoice_data.get('items', [])
+        if not items:
+            items = [
+                {'name': 'خدمة استشارية', 'description': 'استشارة تقنية متخصصة', 'quantity': 1, 'price': 1000, 'total': 1000},
+                {'name': 'تصميم جرافيك', 'description': 'تصميم شعار احترافي', 'quantity': 2, 'price': 500, 'total': 1000}
+            ]
+        
+        items_data = [
+            [
+                label('الوصف'),
+                label('الكمية'),
+                label('سعر الوحدة'),
+                label('المجموع')
+            ]
+        ]
+        
+        names = self.shaper.shape_many([item.get('name', '') for item in items])
+        for item, name in zip(items, names):
+            items_data.append([
+                name,
+                str(item.get('quantity', 1)),
+                f"{item.get('price', 0):.2f}",
+                f"{item.get('total', 0):.2f}"
+            ])
+        
+        items_table = platypus.Table(items_data, colWidths=[200, 60, 80, 80])
+        items_table.setStyle(theme.items_table)
+        
+        elements.append(items_table)
+        elements.append(platypus.Spacer(1, 10))
+        
+        # إضافة المجاميع
+        subtotal = invoice_data.get('subtotal', 2000)
+        tax_rate = invoice_data.get('tax_rate', 15)
+        tax_amount = invoice_data.get('tax_amount', 300)
+        discount = invoice_data.get('discount', 0)
+        total = invoice_data.get('total_amount', 2300)
+        
+        totals_data = [
+            ['', '', label('المجموع الفرعي:'), f"{subtotal:.2f}"],
+            ['', '', label('الضريبة:'), f"{tax_amount:.2f}"],
+            ['', '', label('الخصم:'), f"-{discount:.2f}"],
+            ['', '', f"<b>{label('الإجمالي:')}</b>", f"<b>{total:.2f}</b>"]
+        ]
+        
+        totals_table = platypus.Table(totals_data, colWidths=[200, 60, 80, 80])
+        totals_table.setStyle(theme.totals_table)
+        
+        elements.append(totals_table)
+        elements.append(platypus.Spacer(1, 20))
+        
+        # الملاحظات
+        if invoice_data.get('notes'):
+            notes_text = f"<b>{label('ملاحظات:')}</b><br/>{self.reshape_arabic_text(invoice_data.get('notes'))}"
+            elements.append(platypus.Paragraph(notes_text, arabic_style))
+            elements.append(platypus.Spacer(1, 20))
+        
+        # التوقيعات
+        signatures_data = [
+            [
+                platypus.Paragraph(f"_________________________<br/>{label('توقيع البائع')}", data_style),
+                platypus.Paragraph(f"_________________________<br/>{label('توقيع العميل')}", data_style)
+            ]
+        ]
+        
+        signatures_table = platypus.Table(signatures_data, colWidths=[250, 250])
+        signatures_table.setStyle(theme.signatures_table)
+        
+        elements.append(signatures_table)
+        elements.append(platypus.Spacer(1, 20))
+        
+        # تذييل الصفحة
+        elements.append(platypus.Paragraph(resources['footer'], footer_style))
+        
+        # إنشاء الـ QR Code
+        try:
+            # إنشاء QR Code يحتوي على معلومات الفاتورة
+            qr_data = {
+                'invoice_number': invoice_data.get('invoice_number', ''),
+                'company': user_data.get('company_name', ''),
+                'client': invoice_data.get('client_name', ''),
+                'amount': total,
+                'date': invoice_data.get('issue_date', ''),
+                'url': f"https://invoiceflow.pro/invoice/{invoice_data.get('invoice_number', '')}"
+            }
+            
+            qr = qrcode.QRCode(
+                version=1,
+                error_correction=qrcode.constants.ERROR_CORRECT_L,
+                box_size=3,
+                border=2,
+            )
+            qr.add_data(json.dumps(qr_data, ensure_ascii=False))
+            qr.make(fit=True)
+            
+            qr_img = qr.make_image(fill_color="black", back_color="white")
+            qr_buffer = io.BytesIO()
+            qr_img.save(qr_buffer, format='PNG')
+            qr_buffer.seek(0)
+            
+            # إضافة QR Code إلى PDF
+            qr_image = platypus.Image(qr_buffer, width=60, height=60)
+            qr_image.hAlign = 'LEFT'
+            elements.append(qr_image)
+        
+        except Exception as e:
+            print(f"خطأ في إنشاء QR Code: {e}")
+        
+        return elements
+    
+    def generate_invoice_pdf(self, invoice_data, user_data, resources=None):
+        """إنشاء فاتورة PDF احترافية (resources: موارد مشتركة من batch_resources عند التوليد على دفعات)"""
+        try:
+            # إنشاء buffer للـ PDF
+            buffer = io.BytesIO()
+            
+            # إنشاء المستند
+            doc = self.document(buffer, f"Invoice {invoice_data.get('invoice_number', '')}")
+            elements = self.invoice_elements(invoice_data, user_data, resources or self.batch_resources(user_data))
+            
+            # بناء المستند
+            doc.build(elements)
+            
+            buffer.seek(0)
+            return buffer
+            
+        except Exception as e:
+            print(f"خطأ في إنشاء PDF: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+    
+    def generate_merged_pdf(self, invoices, user_data, output):
+        """كل الفواتير في مستند واحد يُكتب إلى output (ملف أو buffer)، كل فاتورة تبدأ بصفحة جديدة"""
+        resources = self.batch_resources(user_data)
+        elements = []
+        for index, invoice_data in enumerate(invoices):
+            if index:
+                elements.append(platypus.PageBreak())
+            elements.extend(self.invoice_elements(invoice_data, user_data, resources))
+        self.document(output, f"Invoices ({len(invoices)})").build(elements)
+
+# ================== مهام عمال PDF ==================
+class PDFRenderTimeout(BaseException):
+    """تجاوز مهلة التوليد؛ يرث BaseException حتى لا يبتلعه except Exception داخل المولد"""
+
+def _pdf_job_alarm(signum, frame):
+    raise PDFRenderTimeout()
+
+# المولد المشترك في العملية: في عمال PDF، أو في العملية نفسها عند PDF_WORKERS=0
+arabic_shaper = ArabicTextShaper()
+pdf_generator = ProfessionalPDFGenerator(arabic_shaper)
+
+def configure(shaping_cache_size):
+    """حجم ذاكرة تشكيل النص من إعدادات التطبيق (ARABIC_SHAPING_CACHE_SIZE)"""
+    arabic_shaper.max_size = shaping_cache_size
+
+def init_pdf_worker(shaping_cache_size):
+    """تهيئة عملية العامل: إشارات افتراضية، الإعدادات، وتوليد مستند صغير لتسخين reportlab وبناء الأنماط"""
+    # عملية forkserver ترث معالجات إشارات مختلفة عن الافتراضية
+    for name in ('SIGTERM', 'SIGINT', 'SIGQUIT', 'SIGHUP'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+    configure(shaping_cache_size)
+    pdf_generator.generate_invoice_pdf({'invoice_number': 'WARMUP', 'items': []}, {})
+
+def run_pdf_job(timeout, func, *args):
+    """تنفيذ func داخل العامل مع إيقافها بـ PDFRenderTimeout بعد timeout ثانية"""
+    use_alarm = hasattr(signal, 'SIGALRM') and current_thread() is main_thread()
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _pdf_job_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+def render_pdf_job(invoice_data, user_data, timeout):
+    """يُنفذ داخل العامل: (بايتات PDF للفاتورة، عدادات تشكيل النص)"""
+    buffer = run_pdf_job(timeout, pdf_generator.generate_invoice_pdf, invoice_data, user_data)
+    if buffer is None:
+        raise RuntimeError("فشل توليد PDF")
+    return buffer.getvalue(), arabic_shaper.drain_stats()
+
+def render_pdf_batch_job(invoices_data, user_data, timeout):
+    """يُنفذ داخل العامل: (قائمة بايتات PDF لعدة فواتير تشترك في الأنماط وكتلة البائع، عدادات تشكيل النص)"""
+    def render_all():
+        resources = pdf_generator.batch_resources(user_data)
+        return [pdf_generator.generate_invoice_pdf(invoice_data, user_data, resources)
+                for invoice_data in invoices_data]
+    
+    buffers = run_pdf_job(timeout, render_all)
+    if any(buffer is None for buffer in buffers):
+        raise RuntimeError("فشل توليد PDF")
+    return [buffer.getvalue() for buffer in buffers], arabic_shaper.drain_stats()
+
+def render_merged_pdf_job(invoices_data, user_data, timeout, output_path):
+    """يُنفذ داخل العامل: كل الفواتير في ملف PDF واحد على القرص (المسار والعدادات فقط تعود عبر الأنبوب)"""
+    run_pdf_job(timeout, pdf_generator.generate_merged_pdf, invoices_data, user_data, output_path)
+    return output_path, arabic_shaper.drain_stats()
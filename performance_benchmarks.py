@@ -0,0 +1,694 @@
+#!/usr/bin/env python3
+"""
+نظام قياس الأداء - InvoiceFlow Pro
+الإصدار: 1.0.0
+
+الاستخدام:
+    python performance_benchmarks.py dashboard-stats [--invoices 1000000] [--rounds 20]
+    python performance_benchmarks.py importtime [--rounds 5]
+    python performance_benchmarks.py render [--rounds 200]
+    python performance_benchmarks.py page-bytes
+    python performance_benchmarks.py conditional-get [--invoices 5000] [--rounds 200]
+    python performance_benchmarks.py json [--invoices 10000] [--rounds 20]
+    python performance_benchmarks.py pdf-cache [--rounds 50]
+    python performance_benchmarks.py pdf-service [--rounds 40]
+    python performance_benchmarks.py pdf-batch [--rounds 200]
+    python performance_benchmarks.py pdf-styles [--rounds 50]
+    python performance_benchmarks.py arabic-shaping [--rounds 200]
+"""
+
+import argparse
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# ================== أدوات مساعدة ==================
+def print_header(title):
+    """طباعة عنوان القياس"""
+    print("=" * 70)
+    print(f"📊 {title}")
+    print("=" * 70)
+
+def timed(func, rounds):
+    """تشغيل الدالة عدة مرات وإرجاع متوسط ووسيط الزمن بالملي ثانية"""
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return sum(samples) / len(samples), samples[len(samples) // 2]
+
+def load_bot_app(db_path):
+    """استيراد bot_arabic.py مع قاعدة بيانات مؤقتة للقياس"""
+    # كل قياس ينشئ خدمة PDF خاصة به، فلا تُسخَّن خدمة الوحدة حتى لا تنافسه على المعالج
+    os.environ.setdefault('PDF_PREWARM', '0')
+    import bot_arabic
+    bot_arabic.app.config['DATABASE_PATH'] = db_path
+    bot_arabic.db = bot_arabic.EnhancedDatabaseSystem()
+    return bot_arabic
+
+class QueryCounter:
+    """عداد الاستعلامات المنفذة عبر db.execute_query"""
+    
+    def __init__(self, database):
+        self.database = database
+        self.original = database.execute_query
+        self.count = 0
+    
+    def __enter__(self):
+        def counting(*args, **kwargs):
+            self.count += 1
+            return self.original(*args, **kwargs)
+        self.database.execute_query = counting
+        return self
+    
+    def __exit__(self, *exc):
+        self.database.execute_query = self.original
+
+def seed_invoices(db_path, user_id, invoices, clients=500):
+    """إنشاء بيانات تجريبية: عملاء وفواتير بحالات وتواريخ متنوعة"""
+    conn = sqlite3.connect(db_path)
+    statuses = ['paid', 'paid', 'pending', 'overdue', 'cancelled']
+    now = datetime.now()
+    
+    conn.executemany(
+        "INSERT INTO clients (user_id, name, created_at) VALUES (?, ?, ?)",
+        ((user_id, f"Client {i}", (now - timedelta(days=i % 700)).strftime('%Y-%m-%d %H:%M:%S'))
+         for i in range(clients))
+    )
+    
+    def rows():
+        rnd = random.Random(42)
+        for i in range(invoices):
+            created = now - timedelta(minutes=rnd.randint(0, 60 * 24 * 730))
+            due = created + timedelta(days=30)
+            amount = round(rnd.uniform(50, 5000), 2)
+            yield (
+                f"BENCH-{user_id}-{i:08d}", user_id, f"Client {i % clients}",
+                created.strftime('%Y-%m-%d'), due.strftime('%Y-%m-%d'), '[]',
+                amount, amount, rnd.choice(statuses), created.strftime('%Y-%m-%d %H:%M:%S')
+            )
+    
+    conn.executemany('''
+        INSERT INTO invoices (invoice_number, user_id, client_name, issue_date, due_date, items,
+                              subtotal, total_amount, status, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    conn.close()
+
+# ================== إحصائيات لوحة التحكم ==================
+# الاستعلامات الستة التي كانت تنفذها /dashboard قبل خدمة الإحصائيات
+LEGACY_DASHBOARD_QUERIES = [
+    "SELECT COUNT(*) FROM invoices WHERE user_id = ?",
+    "SELECT COALESCE(SUM(total_amount), 0) FROM invoices WHERE user_id = ? AND status = 'paid'",
+    "SELECT COUNT(*) FROM invoices WHERE user_id = ? AND status = 'pending'",
+    "SELECT COUNT(*) FROM clients WHERE user_id = ?",
+    "SELECT COUNT(*) FROM invoices WHERE user_id = ? AND status = 'pending' AND due_date < DATE('now')",
+    "SELECT COALESCE(SUM(total_amount), 0) FROM invoices WHERE user_id = ? AND status = 'paid' AND strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now')",
+]
+
+# مسح واحد بتجميع شرطي (قبل جداول الإحصائيات التراكمية)
+SINGLE_PASS_QUERIES = [
+    """
+    SELECT
+        COUNT(*) AS total_invoices,
+        COALESCE(SUM(CASE WHEN status = 'paid' THEN total_amount END), 0) AS total_revenue,
+        COUNT(CASE WHEN status = 'pending' THEN 1 END) AS pending_invoices,
+        COUNT(CASE WHEN status = 'pending' AND due_date < DATE('now') THEN 1 END) AS overdue_invoices,
+        COALESCE(SUM(CASE WHEN status = 'paid'
+                          AND strftime('%Y-%m', created_at) = strftime('%Y-%m', 'now')
+                     THEN total_amount END), 0) AS monthly_revenue
+    FROM invoices
+    WHERE user_id = ? AND is_deleted = 0
+    """,
+    "SELECT COUNT(*) AS total_clients FROM clients WHERE user_id = ?",
+]
+
+def bench_dashboard_stats(args):
+    """مقارنة عدد الاستعلامات وزمن حساب مؤشرات لوحة التحكم قبل وبعد"""
+    print_header(f"إحصائيات لوحة التحكم ({args.invoices:,} فاتورة)")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot = load_bot_app(db_path)
+        user_id = 1
+        
+        started = time.perf_counter()
+        seed_invoices(db_path, user_id, args.invoices)
+        print(f"⏱️  إنشاء البيانات: {time.perf_counter() - started:.1f}s")
+        
+        def legacy():
+            for query in LEGACY_DASHBOARD_QUERIES:
+                bot.db.execute_query(query, (user_id,), fetchone=True)
+        
+        def single_pass():
+            for query in SINGLE_PASS_QUERIES:
+                bot.db.execute_query(query, (user_id,), fetchone=True)
+        
+        def service():
+            bot.DashboardStatsService.get_user_stats(user_id)
+        
+        variants = (
+            ('6 استعلامات منفصلة', legacy),
+            ('مسح واحد بتجميع شرطي', single_pass),
+            ('جداول user_stats', service),
+        )
+        
+        results = []
+        for name, func in variants:
+            with QueryCounter(bot.db) as counter:
+                func()
+            mean, median = timed(func, args.rounds)
+            results.append((name, counter.count, mean, median))
+        
+        print(f"\n{'الطريقة':<32}{'استعلامات':>10}{'متوسط ms':>12}{'وسيط ms':>12}")
+        for name, queries, mean, median in results:
+            print(f"{name:<32}{queries:>10}{mean:>12.1f}{median:>12.1f}")
+
+# ================== زمن إقلاع العامل ==================
+HEAVY_IMPORTS = ['pandas', 'numpy', 'reportlab', 'qrcode', 'PIL', 'arabic_reshaper', 'bidi']
+
+def measure_import(module, cwd, env):
+    """استيراد الوحدة في عملية جديدة مع -X importtime وإرجاع (الزمن الكلي ms، سطور التقرير)"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    
+    # الصيغة: import time: self [us] | cumulative | imported package
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return elapsed, modules
+
+def bench_importtime(args):
+    """قياس زمن استيراد bot_arabic.py (زمن إقلاع العامل) مع وبدون التحميل المسبق"""
+    print_header("زمن استيراد bot_arabic.py")
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        base_env = dict(os.environ, PYTHONPATH=repo_dir)
+        # تهيئة قاعدة البيانات مرة واحدة حتى لا يدخل إنشاء الجداول في القياس
+        measure_import('bot_arabic', tmp, base_env)
+        
+        variants = (
+            ('تحميل كسول', dict(base_env, DB_BOOTSTRAP_MODE='probe', PRELOAD_HEAVY_MODULES='0')),
+            ('تحميل مسبق', dict(base_env, DB_BOOTSTRAP_MODE='probe', PRELOAD_HEAVY_MODULES='1')),
+        )
+        
+        reports = {}
+        print(f"\n{'الوضع':<20}{'متوسط ms':>12}{'وسيط ms':>12}{'وحدات':>10}  المكتبات الثقيلة المحملة")
+        for name, env in variants:
+            samples = []
+            for _ in range(args.rounds):
+                elapsed, modules = measure_import('bot_arabic', tmp, env)
+                samples.append(elapsed)
+            samples.sort()
+            reports[name] = modules
+            loaded = sorted({m[0].split('.')[0] for m in modules} & set(HEAVY_IMPORTS))
+            print(f"{name:<20}{sum(samples) / len(samples):>12.1f}{samples[len(samples) // 2]:>12.1f}"
+                  f"{len(modules):>10}  {', '.join(loaded) or '-'}")
+        
+        print("\nأبطأ 10 وحدات (تحميل كسول، cumulative):")
+        slowest = sorted(reports[variants[0][0]], key=lambda m: -m[2])[:10]
+        for name, self_us, cumulative_us in slowest:
+            print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+# ================== عرض الصفحات ==================
+def load_secure_app(workdir):
+    """استيراد app.py مع قاعدة بيانات داخل مجلد مؤقت"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import app as secure_app
+    return secure_app
+
+def measure_render(func, rounds):
+    """متوسط زمن العرض (ms) وذروة الذاكرة المخصصة (KB) لكل عرض"""
+    func()
+    mean, _ = timed(func, rounds)
+    
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(rounds, 20)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return mean, sum(peaks) / len(peaks) / 1024
+
+def bench_render(args):
+    """مقارنة render_template_string(CSS + content) بالقالب المترجم مسبقاً في app.py"""
+    print_header("عرض صفحات app.py")
+    cwd = os.getcwd()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        secure_app = load_secure_app(tmp)
+        flask_app = secure_app.app
+        client = flask_app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=1, username='admin', user_role='admin', user_logged_in=True)
+        
+        def page(path):
+            return lambda: client.get(path)
+        
+        def handler(func, error):
+            def render():
+                with flask_app.test_request_context('/'):
+                    func(error)
+            return render
+        
+        pages = (
+            ('/dashboard', page('/dashboard')),
+            ('/invoices', page('/invoices')),
+            ('/reports', page('/reports')),
+            ('404', page('/missing-page')),
+            ('500', handler(secure_app.internal_server_error, None)),
+            ('429', handler(secure_app.ratelimit_handler, None)),
+        )
+        
+        from flask import render_template_string
+        
+        def legacy_render_page(content, title=None):
+            return render_template_string(secure_app.GLOBAL_DESIGN_CSS + content)
+        
+        variants = (
+            ('render_template_string', legacy_render_page),
+            ('PAGE_LAYOUT', secure_app.render_page),
+        )
+        
+        print(f"\n{'الصفحة':<14}{'الطريقة':<26}{'متوسط ms':>12}{'ذاكرة KB':>12}")
+        for path, func in pages:
+            for name, renderer in variants:
+                secure_app.render_page = renderer
+                # معالج 500 يطبع حدثاً أمنياً في كل عرض
+                with contextlib.redirect_stdout(io.StringIO()):
+                    mean, peak_kb = measure_render(func, args.rounds)
+                print(f"{path:<14}{name:<26}{mean:>12.2f}{peak_kb:>12.1f}")
+        secure_app.render_page = variants[1][1]
+        os.chdir(cwd)
+
+# ================== حجم الصفحات ==================
+def bench_page_bytes(args):
+    """حجم كل صفحة مع CSS مضمن (قبل) مقابل ملف CSS بالبصمة يُخزن في المتصفح (بعد)"""
+    print_header("البايتات لكل صفحة في app.py")
+    cwd = os.getcwd()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        secure_app = load_secure_app(tmp)
+        client = secure_app.app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=1, username='admin', user_role='admin', user_logged_in=True)
+        
+        asset_sizes = {}
+        session_inline = session_cached = 0
+        
+        print(f"\n{'الصفحة':<16}{'HTML':>10}{'CSS':>10}{'مضمن (قبل)':>14}{'زيارة متكررة':>16}{'gzip':>10}")
+        for path in ('/', '/login', '/dashboard', '/invoices', '/reports', '/missing-page'):
+            html = client.get(path).data
+            compressed = len(client.get(path, headers={'Accept-Encoding': 'gzip'}).data)
+            css = 0
+            for url in re.findall(r'href="(/assets/css/[^"]+)"', html.decode('utf-8')):
+                if url not in asset_sizes:
+                    asset_sizes[url] = len(client.get(url).data)
+                    session_cached += asset_sizes[url]
+                css += asset_sizes[url]
+            
+            inline = len(html) + css
+            session_inline += inline
+            session_cached += len(html)
+            print(f"{path:<16}{len(html):>10,}{css:>10,}{inline:>14,}{len(html):>16,}{compressed:>10,}")
+        
+        print(f"\nإجمالي الجلسة: {session_inline:,} بايت مع CSS مضمن، {session_cached:,} بايت مع التخزين المؤقت "
+              f"({100 - session_cached * 100 / session_inline:.0f}% أقل)")
+        os.chdir(cwd)
+
+# ================== الطلبات الشرطية ==================
+def bench_conditional_get(args):
+    """عملاء يستطلعون /api/v1/invoices مع If-None-Match بينما تتغير فاتورة في 10% من الجولات"""
+    print_header("ETag و 304 على /api/v1/invoices")
+    cwd = os.getcwd()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        secure_app = load_secure_app(tmp)
+        seed_invoices(secure_app.secure_db.db_path, 1, args.invoices)
+        # الحد الافتراضي (50 طلباً في الساعة) يوقف الاستطلاع قبل نهاية القياس
+        secure_app.limiter.enabled = False
+        client = secure_app.app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=1, username='admin', user_role='admin', user_logged_in=True)
+        
+        writer = sqlite3.connect(secure_app.secure_db.db_path)
+        rnd = random.Random(7)
+        newest = [row[0] for row in writer.execute(
+            "SELECT id FROM invoices WHERE user_id = 1 ORDER BY created_at DESC, id DESC LIMIT 50")]
+        paths = ['/api/v1/invoices'] + [f'/api/v1/invoices/{invoice_id}' for invoice_id in newest[:10]]
+        
+        # لكل مسار: (ETag المخزن، حجم آخر استجابة كاملة) كما يحتفظ بها تطبيق الجوال
+        cached = {}
+        stats = {'requests': 0, '304': 0, 'bytes': 0, 'full_bytes': 0, 'ms_200': [], 'ms_304': []}
+        for _ in range(args.rounds):
+            if rnd.random() < 0.1:
+                writer.execute("UPDATE invoices SET status = ? WHERE id = ?",
+                               (rnd.choice(['paid', 'pending']), rnd.choice(newest)))
+                writer.commit()
+            
+            for path in paths:
+                headers = {'If-None-Match': cached[path][0]} if path in cached else {}
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                elapsed = (time.perf_counter() - started) * 1000
+                
+                stats['requests'] += 1
+                stats['bytes'] += len(response.data)
+                if response.status_code == 304:
+                    stats['304'] += 1
+                    stats['ms_304'].append(elapsed)
+                    stats['full_bytes'] += cached[path][1]
+                else:
+                    stats['ms_200'].append(elapsed)
+                    stats['full_bytes'] += len(response.data)
+                    cached[path] = (response.headers['ETag'], len(response.data))
+        writer.close()
+        
+        def mean(samples):
+            return sum(samples) / len(samples) if samples else 0
+        
+        print(f"\nالطلبات: {stats['requests']:,} ({len(paths)} مسارات × {args.rounds} جولة)")
+        print(f"نسبة 304: {stats['304'] * 100 / stats['requests']:.1f}%")
+        print(f"البايتات المرسلة: {stats['bytes']:,} بدلاً من {stats['full_bytes']:,} "
+              f"(توفير {stats['full_bytes'] - stats['bytes']:,} بايت، "
+              f"{100 - stats['bytes'] * 100 / max(stats['full_bytes'], 1):.0f}%)")
+        print(f"متوسط الزمن: 200 = {mean(stats['ms_200']):.2f} ms، 304 = {mean(stats['ms_304']):.2f} ms")
+        os.chdir(cwd)
+
+# ================== تسلسل JSON ==================
+def bench_json(args):
+    """زمن الاستعلام + jsonify لـ N صف: قائمة dict مع json القياسي مقابل RowSet مع orjson"""
+    print_header(f"تسلسل {args.invoices:,} فاتورة إلى JSON")
+    cwd = os.getcwd()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        secure_app = load_secure_app(tmp)
+        seed_invoices(secure_app.secure_db.db_path, 1, args.invoices)
+        flask_app = secure_app.app
+        query = "SELECT * FROM invoices WHERE user_id = ? AND is_deleted = 0"
+        from flask.json.provider import DefaultJSONProvider
+        import invoiceflow_common
+        
+        def run(provider, rowset):
+            def serialize():
+                rows = secure_app.secure_db.execute_query(query, (1,), fetchall=True, rowset=rowset)
+                return provider.response({'success': True, 'data': rows})
+            return serialize
+        
+        orjson_module = invoiceflow_common.orjson
+        variants = (
+            ('dict + json (قبل)', DefaultJSONProvider(flask_app), False, orjson_module),
+            ('RowSet + json', secure_app.FastJSONProvider(flask_app), True, None),
+            ('RowSet + orjson', secure_app.FastJSONProvider(flask_app), True, orjson_module),
+        )
+        
+        print(f"\n{'الطريقة':<22}{'متوسط ms':>12}{'ذاكرة KB':>12}{'بايت':>14}")
+        with flask_app.app_context():
+            for name, provider, rowset, orjson_impl in variants:
+                if name.endswith('orjson') and orjson_impl is None:
+                    print(f"{name:<22}{'orjson غير مثبت':>38}")
+                    continue
+                invoiceflow_common.orjson = orjson_impl
+                serialize = run(provider, rowset)
+                size = len(serialize().get_data())
+                mean, peak_kb = measure_render(serialize, args.rounds)
+                print(f"{name:<22}{mean:>12.1f}{peak_kb:>12.0f}{size:>14,}")
+        invoiceflow_common.orjson = orjson_module
+        os.chdir(cwd)
+
+# ================== ذاكرة ملفات PDF ==================
+def cached_pdf_in_thread(cache, invoice, user):
+    """مسار PDF من ذاكرة الملفات، أو توليده في الخيط الحالي (السلوك قبل خدمة PDF)"""
+    key, path = cache.lookup(invoice, user)
+    if path:
+        return path
+    cache.count('misses')
+    buffer = cache.generator.pdf_generator.generate_invoice_pdf(cache.prepare(invoice), user)
+    return cache.store(invoice, key, buffer.getvalue())
+
+def bench_pdf_cache(args):
+    """زمن أول تنزيل (توليد PDF) مقابل إعادة التنزيل (قراءة الملف المخزن) لعدد --rounds من الفواتير"""
+    print_header(f"ذاكرة ملفات PDF ({args.rounds} فاتورة)")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot = load_bot_app(db_path)
+        seed_invoices(db_path, 1, args.rounds, clients=10)
+        cache = bot.InvoicePDFCache(bot.pdf_worker, os.path.join(tmp, 'invoices'), 500 * 1024 * 1024)
+        invoices = bot.db.execute_query("SELECT * FROM invoices WHERE user_id = 1", fetchall=True)
+        user = bot.db.execute_query("SELECT * FROM users WHERE id = 1", fetchone=True) or {}
+        # تحميل reportlab وأول مستند خارج القياس
+        bot.pdf_worker.pdf_generator.generate_invoice_pdf(dict(invoices[0], items=[]), user)
+        
+        def download_all():
+            for invoice in invoices:
+                with open(cached_pdf_in_thread(cache, invoice, user), 'rb') as f:
+                    f.read()
+        
+        print(f"\n{'الطريقة':<28}{'ms لكل فاتورة':>16}{'فاتورة/ث':>12}")
+        for name in ('أول تنزيل (توليد)', 'إعادة التنزيل (ملف)'):
+            started = time.perf_counter()
+            download_all()
+            elapsed = time.perf_counter() - started
+            print(f"{name:<28}{elapsed * 1000 / len(invoices):>16.2f}{len(invoices) / elapsed:>12.0f}")
+        print(f"\nالإحصائيات: {cache.get_stats()}")
+
+def bench_pdf_service(args):
+    """زمن استجابة طلب خفيف أثناء توليد --rounds فاتورة: في خيوط الطلبات مقابل مجمع العمليات"""
+    print_header(f"استجابة الموقع أثناء توليد {args.rounds} فاتورة PDF")
+    import threading
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot = load_bot_app(db_path)
+        seed_invoices(db_path, 1, args.rounds, clients=10)
+        invoices = bot.db.execute_query("SELECT * FROM invoices WHERE user_id = 1", fetchall=True)
+        user = bot.db.execute_query("SELECT * FROM users WHERE id = 1", fetchone=True) or {}
+        bot.preload_heavy_modules()
+        client = bot.app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=1, user_logged_in=True)
+        
+        def in_request_threads(directory):
+            # أربعة خيوط طلبات تولد الفواتير بنفسها (السلوك قبل الخدمة)
+            cache = bot.InvoicePDFCache(bot.pdf_worker, directory, 500 * 1024 * 1024)
+            threads = [threading.Thread(target=lambda chunk=invoices[i::4]: [cached_pdf_in_thread(cache, inv, user) for inv in chunk])
+                       for i in range(4)]
+            for thread in threads:
+                thread.start()
+            return lambda: [thread.join() for thread in threads]
+        
+        def process_pool(directory):
+            cache = bot.InvoicePDFCache(bot.pdf_worker, directory, 500 * 1024 * 1024)
+            service = bot.PDFRenderService(cache, workers=2, queue_size=len(invoices))
+            service.ensure_started().submit(bot.pdf_worker.init_pdf_worker, service.shaping_cache_size).result()
+            jobs = [service.start(invoice, user) for invoice in invoices]
+            return lambda: [job['done'].wait() for job in jobs]
+        
+        print(f"\n{'الطريقة':<22}{'فاتورة/ث':>10}{'p50 ms':>10}{'p95 ms':>10}{'أقصى ms':>10}")
+        for name, start in (('خيوط الطلبات', in_request_threads), ('مجمع العمليات', process_pool)):
+            latencies = []
+            started = time.perf_counter()
+            wait = start(os.path.join(tmp, name.replace(' ', '-')))
+            waiter = threading.Thread(target=wait)
+            waiter.start()
+            while waiter.is_alive():
+                probe = time.perf_counter()
+                client.get('/api/notifications?limit=5')
+                latencies.append((time.perf_counter() - probe) * 1000)
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95)]
+            print(f"{name:<22}{len(invoices) / elapsed:>10.1f}{latencies[len(latencies) // 2]:>10.1f}"
+                  f"{p95:>10.1f}{latencies[-1]:>10.1f}")
+
+def bench_pdf_batch(args):
+    """فاتورة/ث لتنزيل --rounds فاتورة: طلب لكل فاتورة مقابل ZIP دفعة واحدة و PDF مدمج"""
+    print_header(f"تنزيل {args.rounds} فاتورة PDF دفعة واحدة")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot = load_bot_app(db_path)
+        seed_invoices(db_path, 1, args.rounds, clients=10)
+        invoices = bot.db.execute_query("SELECT id FROM invoices WHERE user_id = 1", fetchall=True)
+        bot.app.config['PDF_BATCH_MAX_INVOICES'] = len(invoices)
+        bot.app.config['PDF_MERGED_MAX_INVOICES'] = len(invoices)
+        bot.preload_heavy_modules()
+        client = bot.app.test_client()
+        with client.session_transaction() as session:
+            session.update(user_id=1, user_logged_in=True)
+        
+        def use_service(directory):
+            # المسارات تقرأ pdf_service من الوحدة، فكل طريقة تبدأ بذاكرة ملفات فارغة
+            cache = bot.InvoicePDFCache(bot.pdf_worker, directory, 500 * 1024 * 1024)
+            bot.pdf_service = bot.PDFRenderService(cache, workers=2, queue_size=len(invoices))
+            bot.pdf_service.ensure_started().submit(bot.pdf_worker.init_pdf_worker, bot.pdf_service.shaping_cache_size).result()
+        
+        def one_by_one():
+            return sum(len(client.get(f"/invoice/{invoice['id']}/pdf").get_data()) for invoice in invoices)
+        
+        def batch(output):
+            return lambda: len(client.get(f'/invoices/batch-pdf?date_from=2000-01-01&format={output}').get_data())
+        
+        print(f"\n{'الطريقة':<26}{'فاتورة/ث':>10}{'ms لكل فاتورة':>16}{'KB':>10}")
+        runs = (('طلب لكل فاتورة', 'single', one_by_one), ('ZIP دفعة واحدة', 'zip', batch('zip')),
+                ('ZIP من الذاكرة', None, batch('zip')), ('PDF مدمج', 'merged', batch('pdf')))
+        for name, directory, run in runs:
+            if directory:
+                use_service(os.path.join(tmp, directory))
+            started = time.perf_counter()
+            size = run()
+            elapsed = time.perf_counter() - started
+            print(f"{name:<26}{len(invoices) / elapsed:>10.1f}{elapsed * 1000 / len(invoices):>16.2f}{size / 1024:>10.0f}")
+        print(f"\nالإحصائيات: {bot.pdf_service.get_stats()}")
+
+def bench_pdf_styles(args):
+    """الزمن وذروة الذاكرة واستدعاءات الدوال لكل PDF: بناء الأنماط في كل فاتورة مقابل سجل الأنماط المشترك"""
+    print_header(f"أنماط PDF المشتركة ({args.rounds} فاتورة)")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot_app(os.path.join(tmp, 'bench.db'))
+        bot.preload_heavy_modules()
+        invoice = {'invoice_number': 'INV-1', 'client_name': 'عميل', 'subtotal': 100.0, 'tax_amount': 15.0,
+                   'discount': 0.0, 'total_amount': 115.0,
+                   'items': [{'name': 'خدمة', 'quantity': 1, 'price': 100.0, 'total': 100.0}]}
+        user = {'company_name': 'شركتي', 'address': 'الرياض', 'phone': '0500000000', 'email': 'info@company.com'}
+        
+        class PerInvoiceStyles(bot.pdf_worker.ProfessionalPDFGenerator):
+            # السلوك السابق: getSampleStyleSheet والأنماط تُبنى من جديد لكل فاتورة
+            def theme(self, font):
+                return self.build_theme(font)
+        
+        print(f"\n{'الطريقة':<24}{'ms لكل PDF':>12}{'استدعاءات/PDF':>16}{'ذروة KB/PDF':>16}")
+        for name, generator in (('أنماط لكل فاتورة', PerInvoiceStyles()), ('سجل أنماط مشترك', bot.pdf_worker.ProfessionalPDFGenerator())):
+            render = lambda: generator.generate_invoice_pdf(invoice, user)
+            render()
+            
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                render()
+            elapsed = time.perf_counter() - started
+            
+            profiler = cProfile.Profile()
+            profiler.runcall(lambda: [render() for _ in range(args.rounds)])
+            calls = pstats.Stats(profiler).total_calls / args.rounds
+            
+            # ذروة الذاكرة المخصصة أثناء render فوق ما كان محجوزاً قبلها
+            tracemalloc.start()
+            allocated = 0
+            for _ in range(args.rounds):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                render()
+                allocated += tracemalloc.get_traced_memory()[1] - before
+            tracemalloc.stop()
+            
+            print(f"{name:<24}{elapsed * 1000 / args.rounds:>12.2f}{calls:>16.0f}{allocated / 1024 / args.rounds:>16.0f}")
+        
+        started = time.perf_counter()
+        bot.pdf_worker.ProfessionalPDFGenerator.build_theme('Helvetica')
+        print(f"\nبناء سجل الأنماط مرة واحدة: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+def bench_arabic_shaping(args):
+    """ms لكل PDF لـ --rounds فاتورة من نفس البائع: تشكيل كل نص في كل فاتورة مقابل ذاكرة التشكيل"""
+    print_header(f"ذاكرة تشكيل النص العربي ({args.rounds} فاتورة لبائع واحد)")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot_app(os.path.join(tmp, 'bench.db'))
+        bot.preload_heavy_modules()
+        rng = random.Random(42)
+        catalog = [f"خدمة رقم {i} - صيانة وتركيب" for i in range(40)]
+        clients = [(f"مؤسسة العميل {i}", f"شارع {i}، الرياض") for i in range(50)]
+        user = {'company_name': 'شركة النور للتجارة', 'address': 'جدة، حي الروضة', 'phone': '0500000000', 'email': 'info@company.com'}
+        invoices = []
+        for number in range(args.rounds):
+            client_name, client_address = rng.choice(clients)
+            items = [{'name': name, 'quantity': 1, 'price': 100.0, 'total': 100.0} for name in rng.sample(catalog, 5)]
+            invoices.append({'invoice_number': f'INV-{number}', 'client_name': client_name, 'client_address': client_address,
+                             'items': items, 'subtotal': 500.0, 'tax_amount': 75.0, 'discount': 0.0, 'total_amount': 575.0})
+        
+        class Unmemoized(bot.pdf_worker.ArabicTextShaper):
+            # السلوك السابق: arabic_reshaper + bidi لكل نص في كل فاتورة
+            def shape(self, text):
+                return self.layout(text) if text else ""
+            
+            def shape_many(self, texts):
+                return [self.shape(text) for text in texts]
+        
+        print(f"\n{'الطريقة':<22}{'ms لكل PDF':>12}{'ms تشكيل/PDF':>14}{'نسبة الإصابة':>14}")
+        for name, shaper in (('بدون ذاكرة', Unmemoized()), ('ذاكرة LRU', bot.pdf_worker.ArabicTextShaper())):
+            generator = bot.pdf_worker.ProfessionalPDFGenerator(shaper)
+            
+            started = time.perf_counter()
+            for invoice in invoices:
+                generator.generate_invoice_pdf(invoice, user)
+            elapsed = time.perf_counter() - started
+            
+            # التشكيل وحده: نصوص البائع والعميل والعناصر كما يطلبها التصميم
+            started = time.perf_counter()
+            for invoice in invoices:
+                generator.batch_resources(user)
+                shaper.shape(invoice['client_name'])
+                shaper.shape(invoice['client_address'])
+                shaper.shape_many([item['name'] for item in invoice['items']])
+            shaping = time.perf_counter() - started
+            
+            hit_rate = shaper.get_stats()['hit_rate']
+            print(f"{name:<22}{elapsed * 1000 / len(invoices):>12.2f}{shaping * 1000 / len(invoices):>14.2f}{hit_rate:>14.1%}")
+
+# ================== التشغيل ==================
+BENCHMARKS = {
+    'dashboard-stats': bench_dashboard_stats,
+    'importtime': bench_importtime,
+    'render': bench_render,
+    'page-bytes': bench_page_bytes,
+    'conditional-get': bench_conditional_get,
+    'json': bench_json,
+    'pdf-cache': bench_pdf_cache,
+    'pdf-service': bench_pdf_service,
+    'pdf-batch': bench_pdf_batch,
+    'pdf-styles': bench_pdf_styles,
+    'arabic-shaping': bench_arabic_shaping,
+}
+
+def main():
+    """الدالة الرئيسية"""
+    parser = argparse.ArgumentParser(description="قياسات أداء InvoiceFlow")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--invoices', type=int, default=1_000_000, help="عدد الفواتير التجريبية")
+    parser.add_argument('--rounds', type=int, default=20, help="عدد مرات التكرار")
+    args = parser.parse_args()
+    
+    BENCHMARKS[args.benchmark](args)
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -6,9 +6,18 @@
 الفريق: الدكتورة نور، المهندس باسل، المهندسة لينا
 """
 
+import os
 import re
+import json
+import base64
+import sqlite3
 import subprocess
 import sys
+import tempfile
+import importlib.util
+from datetime import datetime, date
+from decimal import Decimal
+from contextlib import contextmanager
 from colorama import init, Fore, Back, Style
 
 init(autoreset=True)
@@ -133,6 +142,203 @@ class QualityTeam:
             print(f"   ❌ خطأ في الاستيراد: {e}")
             return False
     
+    @contextmanager
+    def app_under_test(self):
+        """تحميل التطبيق داخل مجلد مؤقت حتى لا تُلمس قاعدة البيانات الحقيقية"""
+        module_path = os.path.abspath(self.file_path)
+        original_cwd = os.getcwd()
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            # الوحدة المحملة من مسار لا تُستورد باسمها في عمليات PDF، ولا حاجة لها في الاختبار
+            os.environ.setdefault('PDF_PREWARM', '0')
+            try:
+                spec = importlib.util.spec_from_file_location("app_under_test", module_path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                yield module
+            finally:
+                os.chdir(original_cwd)
+    
+    def test_query_plans(self):
+        """اختبار خطط تنفيذ الاستعلامات الساخنة: لا مسح كامل للجداول"""
+        print("🔎 اختبار خطط الاستعلامات (EXPLAIN QUERY PLAN)...")
+        with self.app_under_test() as module:
+            database = getattr(module, 'db', None) or getattr(module, 'secure_db')
+            conn = sqlite3.connect(database.db_path)
+            
+            all_passed = True
+            for name, query, params in module.HOT_QUERIES:
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+                # الاستعلامات الفرعية ذات الصف الواحد ليست جداول حقيقية
+                virtual = {detail.split()[-1] for detail in plan
+                           if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+                problems = [
+                    detail for detail in plan
+                    if (detail.startswith('SCAN ')
+                        and detail != 'SCAN CONSTANT ROW'
+                        and detail.split()[1] not in virtual)
+                    or 'USE TEMP B-TREE FOR ORDER BY' in detail
+                ]
+                
+                if problems:
+                    print(f"   ❌ {name}: {'; '.join(problems)}")
+                    all_passed = False
+                else:
+                    print(f"   ✅ {name}")
+            
+            conn.close()
+            return all_passed
+    
+    def test_api_behaviour(self):
+        """اختبار سلوك واجهات API: ترقيم المؤشر، المؤشرات التالفة، بث SSE، فلاتر التصدير، ETag/304، fields= و JSON"""
+        print("🌐 اختبار سلوك واجهات API...")
+        with self.app_under_test() as module:
+            app = module.app
+            routes = {rule.rule for rule in app.url_map.iter_rules()}
+            if getattr(module, 'limiter', None) is not None:
+                module.limiter.enabled = False
+            
+            database = getattr(module, 'db', None) or getattr(module, 'secure_db')
+            conn = sqlite3.connect(database.db_path)
+            statuses = ['paid', 'pending', 'overdue']
+            conn.executemany('''
+                INSERT INTO invoices (invoice_number, user_id, client_name, issue_date, due_date, items,
+                                      subtotal, total_amount, status, created_at)
+                VALUES (?, 1, ?, ?, ?, '[]', ?, ?, ?, ?)
+            ''', [
+                (f"TEST-{i:04d}", f"Client {i}", f"2024-01-{i + 1:02d}", f"2024-02-{i + 1:02d}",
+                 100.0 + i, 100.0 + i, statuses[i % 3],
+                 # عدة صفوف بنفس created_at حتى يُختبر ترتيب id داخل المؤشر
+                 f"2024-01-{i // 2 + 1:02d} 10:00:00")
+                for i in range(7)
+            ])
+            # المسارات المرقمة بالمؤشر: (المسار، مفتاح القائمة في JSON، الجدول، إدراج صف تجريبي)
+            paged = [
+                ('/api/v1/invoices', 'data', 'invoices', None),
+                ('/api/v1/activities', 'data', 'activity_logs',
+                 "INSERT INTO activity_logs (user_id, action, created_at) VALUES (1, ?, ?)"),
+                ('/api/notifications', 'notifications', 'notifications',
+                 "INSERT INTO notifications (user_id, type, title, message, created_at) VALUES (1, 'info', ?, '-', ?)"),
+                ('/api/activities', 'activities', 'activities',
+                 "INSERT INTO activities (user_id, action, description, created_at) VALUES (1, 'TEST', ?, ?)"),
+            ]
+            paged = [entry for entry in paged if entry[0] in routes]
+            for _, _, _, insert in paged:
+                if insert:
+                    conn.executemany(insert, [(f"T{i}", f"2024-01-{i // 2 + 1:02d} 10:00:00") for i in range(7)])
+            conn.commit()
+            
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['user_logged_in'] = True
+            
+            all_passed = True
+            
+            def check(name, condition):
+                nonlocal all_passed
+                print(f"   {'✅' if condition else '❌'} {name}")
+                all_passed = all_passed and bool(condition)
+            
+            # ترقيم المؤشر: الصفحات الصغيرة تغطي كل الصفوف مرة واحدة بترتيب (created_at, id) تنازلياً
+            for route, key, table, _ in paged:
+                expected = [row[0] for row in conn.execute(
+                    f"SELECT id FROM {table} WHERE user_id = 1 ORDER BY created_at DESC, id DESC")]
+                seen, cursor = [], None
+                for _ in range(len(expected) + 1):
+                    body = client.get(route, query_string={'limit': 2, **({'cursor': cursor} if cursor else {})}).get_json()
+                    seen += [row['id'] for row in body[key]]
+                    cursor = body['next_cursor']
+                    if not cursor:
+                        break
+                check(f"{route}: ترقيم المؤشر", seen == expected)
+                
+                bad_cursors = ['!!!', base64.urlsafe_b64encode(json.dumps(['x', 'y']).encode()).decode()]
+                check(f"{route}: مؤشر تالف ← 400",
+                      all(client.get(route, query_string={'cursor': bad}).status_code == 400 for bad in bad_cursors))
+            
+            if '/api/notifications/stream' in routes:
+                # بث قصير: الإشعارات الفائتة بعد Last-Event-ID، ثم إشعار جديد، ثم الإغلاق عند المدة القصوى
+                app.config['NOTIFICATION_STREAM_HEARTBEAT'] = 0.1
+                app.config['NOTIFICATION_STREAM_MAX_DURATION'] = 1
+                broker = module.notification_broker
+                ids = [row[0] for row in conn.execute("SELECT id FROM notifications WHERE user_id = 1 ORDER BY id")]
+                response = client.get('/api/notifications/stream', buffered=False,
+                                      headers={'Last-Event-ID': str(ids[-3]), 'Accept-Encoding': 'gzip'})
+                broker.publish({'id': ids[-1] + 1, 'user_id': 1, 'title': 'live'})
+                body = response.get_data(as_text=True)
+                response.close()
+                event_ids = [int(line[4:]) for line in body.splitlines() if line.startswith('id: ')]
+                check("SSE: الإشعارات الفائتة ثم الجديدة", event_ids == ids[-2:] + [ids[-1] + 1])
+                check("SSE: text/event-stream بدون ضغط",
+                      response.mimetype == 'text/event-stream' and 'Content-Encoding' not in response.headers)
+                check("SSE: تحرير الاتصال عند الإغلاق", 1 not in broker.subscribers)
+            
+            if '/api/v1/invoices/export' in routes:
+                response = client.get('/api/v1/invoices/export',
+                                      query_string={'status': 'paid', 'date_from': '2024-01-02'})
+                numbers = [json.loads(line)['invoice_number'] for line in response.get_data(as_text=True).splitlines()]
+                expected = [row[0] for row in conn.execute(
+                    "SELECT invoice_number FROM invoices WHERE user_id = 1 AND status = 'paid' "
+                    "AND issue_date >= '2024-01-02' ORDER BY created_at, id")]
+                check("التصدير: فلاتر الحالة والتاريخ", response.status_code == 200 and numbers == expected)
+                
+                response = client.get('/api/v1/invoices/export', query_string={'format': 'csv', 'status': 'pending'})
+                lines = response.get_data(as_text=True).splitlines()
+                check("التصدير: CSV بعنوان وصف لكل فاتورة",
+                      response.status_code == 200 and len(lines) == 1 + sum(1 for i in range(7) if i % 3 == 1))
+                check("التصدير: معاملات غير صالحة ← 400",
+                      client.get('/api/v1/invoices/export', query_string={'date_from': '01/02/2024'}).status_code == 400
+                      and client.get('/api/v1/invoices/export', query_string={'format': 'xml'}).status_code == 400)
+            
+            if '/api/v1/invoices/<int:invoice_id>' in routes:
+                invoice_id = conn.execute("SELECT MIN(id) FROM invoices WHERE user_id = 1").fetchone()[0]
+                for url in (f'/api/v1/invoices/{invoice_id}', '/api/v1/invoices'):
+                    first = client.get(url)
+                    etag = first.headers.get('ETag')
+                    repeat = client.get(url, headers={'If-None-Match': etag or ''})
+                    check(f"{url}: ETag ثم 304", first.status_code == 200 and etag
+                          and repeat.status_code == 304 and not repeat.get_data())
+                    
+                    conn.execute("UPDATE invoices SET status = 'paid', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                                 (invoice_id,))
+                    conn.commit()
+                    changed = client.get(url, headers={'If-None-Match': etag or ''})
+                    check(f"{url}: 200 بعد تعديل الفاتورة",
+                          changed.status_code == 200 and changed.headers.get('ETag') != etag)
+                
+                check("fields= غير معروف ← 400",
+                      client.get('/api/v1/invoices', query_string={'fields': 'bogus'}).status_code == 400
+                      and client.get(f'/api/v1/invoices/{invoice_id}', query_string={'include': 'status'}).status_code == 400)
+                data = client.get('/api/v1/invoices', query_string={'fields': 'total_amount'}).get_json()['data']
+                check("fields= يُسقط الأعمدة في SQL",
+                      data and all(set(row) == {'id', 'created_at', 'total_amount'} for row in data))
+                data = client.get('/api/v1/invoices').get_json()['data']
+                check("القائمة الافتراضية بدون الأعمدة الثقيلة",
+                      data and not any(column in row for row in data for column in module.InvoiceFields.HEAVY))
+                data = client.get('/api/v1/invoices', query_string={'include': 'items'}).get_json()['data']
+                check("include=items", data and all('items' in row for row in data))
+            
+            provider = app.json
+            if isinstance(provider, getattr(module, 'FastJSONProvider', ())):
+                # مخرجات orjson يجب أن تطابق json القياسي لنفس الكائن (RowSet والتواريخ و Decimal)
+                sample = {
+                    'rows': module.RowSet(['id', 'total'], [(1, 2.5), (2, None)]),
+                    'created_at': datetime(2024, 1, 2, 3, 4, 5),
+                    'due_date': date(2024, 2, 1),
+                    'amount': Decimal('10.50'),
+                    'client': 'عميل',
+                }
+                expected = json.loads(json.dumps(sample, default=provider.default))
+                with app.test_request_context():
+                    body = provider.response(sample).get_json()
+                check("JSON: مطابقة المكتبة القياسية",
+                      json.loads(provider.dumps(sample)) == expected and body == expected)
+            
+            conn.close()
+            return all_passed
+    
     def run_all_tests(self):
         """تشغيل جميع الاختبارات"""
         tests = [
@@ -141,6 +347,8 @@ class QualityTeam:
             ("السطور المهمة", self.test_specific_lines),
             ("صيغة Jinja2", self.test_jinja2_syntax),
             ("الاستيرادات", self.test_imports),
+            ("خطط الاستعلامات", self.test_query_plans),
+            ("سلوك واجهات API", self.test_api_behaviour),
         ]
         
         print("\n" + "=" * 70)